@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the tagup and multipkg pipelines.
+
+For each size a set of synthetic packages is generated, one repository per
+package, with setup.cfg files whose install_requires form a random
+dependency graph. The benchmarks then time metadata parsing, the vcs
+queries, each tagup stage over all of the packages, and multipkg running a
+setup.py command over them as a multi-package repository.
+
+Results are written as JSON, and can be compared against an earlier run::
+
+    python benchmarks/bench.py --sizes 10,100 --output new.json --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import pkg_resources
+
+# Identities for the synthetic commits
+os.environ.setdefault('HGUSER', 'bench <bench@example.com>')
+for _var in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+    os.environ.setdefault(_var + '_NAME', 'bench')
+    os.environ.setdefault(_var + '_EMAIL', 'bench@example.com')
+
+from pp.pkglib import vcs, metadata, timing, cmdserver
+from pp.pkglib.osutil import run
+from pp.pkglib.distindex import DistIndex
+from pp.pkglib.scripts import tagup
+
+DEFAULT_SIZES = [10, 100, 500]
+
+SETUP_CFG = """\
+[metadata]
+name = %(name)s
+version = 1.0.0
+install_requires =
+%(requires)s
+"""
+
+# Plain setuptools, so building doesn't depend on pkglib being installed
+SETUP_PY = """\
+import ConfigParser
+from setuptools import setup
+cfg = ConfigParser.ConfigParser()
+cfg.read('setup.cfg')
+setup(name=cfg.get('metadata', 'name'), version=cfg.get('metadata', 'version'),
+      py_modules=[])
+"""
+
+IGNORE = ['*.egg-info', 'dist', 'build', '*.unpinned', '*.pyc']
+
+MULTIPKG_SETUP_PY = """\
+from pp.pkglib import multipkg
+multipkg.setup()
+"""
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.bench')
+
+
+def get_name(i):
+    return 'pp.bench%d' % i
+
+
+def get_dependencies(size, fanout, seed=0):
+    """ Returns a dict of package number -> numbers of the packages it
+        requires, each requiring up to `fanout` packages numbered before it.
+    """
+    rand = random.Random(seed)
+    return dict((i, sorted(rand.sample(range(i), min(i, rand.randint(0, fanout)))))
+                for i in range(size))
+
+
+def write_package(path, name, requires):
+    os.makedirs(path)
+    with open(os.path.join(path, 'setup.cfg'), 'w') as fp:
+        fp.write(SETUP_CFG % {'name': name,
+                              'requires': ''.join('    %s\n' % i for i in requires)})
+    with open(os.path.join(path, 'setup.py'), 'w') as fp:
+        fp.write(SETUP_PY)
+    # What 'setup.py develop' would leave behind, so pkg_resources finds it
+    egg_info = os.path.join(path, '%s.egg-info' % pkg_resources.to_filename(name))
+    os.makedirs(egg_info)
+    with open(os.path.join(egg_info, 'PKG-INFO'), 'w') as fp:
+        fp.write('Metadata-Version: 1.0\nName: %s\nVersion: 1.0.0\n' % name)
+    with open(os.path.join(egg_info, 'requires.txt'), 'w') as fp:
+        fp.write(''.join('%s\n' % i for i in requires))
+
+
+def init_repo(path, repo):
+    if repo == 'git':
+        with open(os.path.join(path, '.gitignore'), 'w') as fp:
+            fp.write(''.join('%s\n' % i for i in IGNORE))
+        run(['git', 'init', '-q'], cwd=path)
+        run(['git', 'add', '-A'], cwd=path)
+        run(['git', 'commit', '-q', '-m', 'Initial'], cwd=path)
+    else:
+        with open(os.path.join(path, '.hgignore'), 'w') as fp:
+            fp.write('syntax: glob\n' + ''.join('%s\n' % i for i in IGNORE))
+        run(['hg', 'init'], cwd=path)
+        run(['hg', 'commit', '-q', '-A', '-m', 'Initial'], cwd=path)
+
+
+def make_packages(root, size, fanout=3, repo='hg', seed=0, per_repo=1):
+    """ Generates `size` packages under `root`, with `per_repo` packages in
+        each repository. Returns the list of their directories.
+    """
+    deps = get_dependencies(size, fanout, seed)
+    res = []
+    for start in range(0, size, per_repo):
+        numbers = range(start, min(start + per_repo, size))
+        if per_repo == 1:
+            repo_root = os.path.join(root, get_name(start).replace('.', '-'))
+            paths = [repo_root]
+        else:
+            repo_root = os.path.join(root, 'repo%d' % (start // per_repo))
+            paths = [os.path.join(repo_root, get_name(i).replace('.', '-')) for i in numbers]
+        for i, path in zip(numbers, paths):
+            write_package(path, get_name(i), [get_name(j) for j in deps[i]])
+        init_repo(repo_root, repo)
+        res.extend(paths)
+    return res
+
+
+def make_multipkg(root, size, fanout=3, seed=0):
+    """ Generates one repository with `size` packages in sub-directories,
+        driven by a top-level multipkg setup.py. Returns its directory.
+    """
+    deps = get_dependencies(size, fanout, seed)
+    os.makedirs(root)
+    dirs = []
+    for i in range(size):
+        dirs.append(get_name(i).replace('.', '-'))
+        write_package(os.path.join(root, dirs[-1]), get_name(i),
+                      [get_name(j) for j in deps[i]])
+    with open(os.path.join(root, 'setup.cfg'), 'w') as fp:
+        fp.write('[metadata]\nname = pp.bench\nversion = 1.0.1\n\n[multipkg]\npkg_dirs =\n%s'
+                 % ''.join('    %s\n' % i for i in dirs))
+    with open(os.path.join(root, 'setup.py'), 'w') as fp:
+        fp.write(MULTIPKG_SETUP_PY)
+    return root
+
+
+class Timer(object):
+    """ Records how long each benchmark takes
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def __call__(self, name, func, *args, **kwargs):
+        start = time.time()
+        res = func(*args, **kwargs)
+        self.results[name] = time.time() - start
+        get_log().info("  %-40s %8.3fs" % (name, self.results[name]))
+        return res
+
+
+def bench_metadata(timer, paths):
+    for path in paths:
+        metadata.invalidate(path)
+    timer('metadata.read_metadata (cold)', lambda: [metadata.read_metadata(i) for i in paths])
+    timer('metadata.read_metadata (warm)', lambda: [metadata.read_metadata(i) for i in paths])
+    timer('metadata.get_parser (uncached)',
+          lambda: [metadata.get_parser(i, cached=False) for i in paths])
+
+
+def bench_vcs(timer, paths, repo):
+    timer('vcs.get_tags', lambda: [vcs.get_tags(i) for i in paths])
+    timer('vcs.get_revno', lambda: [vcs.get_revno(i) for i in paths])
+    for use_cmdserver in ((False, True) if repo == 'hg' else (False,)):
+        vcs.use_cmdserver(use_cmdserver)
+        suffix = ' (cmdserver)' if use_cmdserver else ''
+        timer('vcs.get_status' + suffix, lambda: [vcs.get_status(i) for i in paths])
+        timer('vcs.get_repo_states' + suffix, vcs.get_repo_states, paths)
+        cmdserver.close_servers()
+    vcs.use_cmdserver(False)
+
+
+def bench_tagup(timer, paths, jobs, upload_dir):
+    """ Runs tagup over every package, timing each stage
+    """
+    dists = []
+    for path in paths:
+        dists.extend(pkg_resources.find_distributions(path, only=True))
+    tagup._index = DistIndex(dists, prefixes=tagup.SOURCE_PACKAGE_PREFIXES)
+    tagup.PKG_REPO = upload_dir
+    args = tagup.get_args([i.project_name for i in dists] + ['-j', str(jobs)])
+
+    # As tagup runs by default
+    vcs.use_cmdserver(True)
+    profiler = timing.Profiler()
+    timing.set_profiler(profiler)
+    try:
+        timer('tagup', tagup.tagup, args)
+    finally:
+        timing.set_profiler(None)
+        cmdserver.close_servers()
+        vcs.use_cmdserver(False)
+        tagup._index = tagup._resolver = None
+    for name, seconds, _ in profiler.totals('stage'):
+        timer.results['tagup %s' % name] = seconds
+        get_log().info("  %-40s %8.3fs" % ('tagup %s' % name, seconds))
+    timer.results['tagup commands (count)'] = sum(i[2] for i in profiler.totals('subprocess'))
+
+
+def bench_multipkg(timer, root, jobs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    cmd = [sys.executable, 'setup.py', '-j', str(jobs), 'egg_info']
+    with open(os.devnull, 'w') as devnull:
+        timer('multipkg.setup egg_info', subprocess.check_call, cmd, cwd=root,
+              env=env, stdout=devnull, stderr=subprocess.STDOUT)
+
+
+def run_benchmarks(size, args):
+    timer = Timer()
+    root = tempfile.mkdtemp(prefix='pkglib-bench-')
+    # Keep tagup's caches and journal out of the user's cache
+    cache_dir = os.environ.get('PKGLIB_CACHE_DIR')
+    os.environ['PKGLIB_CACHE_DIR'] = os.path.join(root, 'cache')
+    try:
+        get_log().info("Generating %d packages in %s" % (size, root))
+        paths = timer('generate', make_packages, os.path.join(root, 'repos'), size,
+                      args.fanout, args.vcs, args.seed, args.per_repo)
+        bench_metadata(timer, paths)
+        bench_vcs(timer, paths, args.vcs)
+        upload_dir = os.path.join(root, 'uploads')
+        os.makedirs(upload_dir)
+        bench_tagup(timer, paths, args.jobs, upload_dir)
+        try:
+            from pkglib import config
+        except ImportError:
+            get_log().info("Skipping multipkg benchmark, pkglib isn't installed")
+        else:
+            bench_multipkg(timer, make_multipkg(os.path.join(root, 'multipkg'), size,
+                                                args.fanout, args.seed), args.jobs)
+    finally:
+        if cache_dir is None:
+            del os.environ['PKGLIB_CACHE_DIR']
+        else:
+            os.environ['PKGLIB_CACHE_DIR'] = cache_dir
+        if args.keep:
+            get_log().info("Keeping %s" % root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return timer.results
+
+
+def compare(old, new):
+    """ Returns a table of the benchmarks in both sets of results, with the
+        new time as a ratio of the old.
+    """
+    lines = ['%-6s %-40s %10s %10s %7s' % ('size', 'benchmark', 'old', 'new', 'ratio')]
+    for size in sorted(set(old['results']) & set(new['results']), key=int):
+        before, after = old['results'][size], new['results'][size]
+        for name in sorted(set(before) & set(after)):
+            ratio = after[name] / before[name] if before[name] else float('nan')
+            lines.append('%-6s %-40s %10.3f %10.3f %6.2fx' % (size, name, before[name],
+                                                             after[name], ratio))
+    return '\n'.join(lines)
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the tagup and multipkg pipelines.')
+    parser.add_argument('--sizes', default=','.join(str(i) for i in DEFAULT_SIZES),
+                        help="Comma-separated numbers of packages (default: %(default)s)")
+    parser.add_argument('--fanout', type=int, default=3,
+                        help="Most packages each package requires (default: %(default)s)")
+    parser.add_argument('--vcs', choices=['hg', 'git'], default='hg',
+                        help="Type of repository to generate (default: %(default)s)")
+    parser.add_argument('--per-repo', type=int, default=1,
+                        help="Packages in each repository (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for the dependency graph (default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, default=tagup.DEFAULT_JOBS,
+                        help="Jobs for tagup stages and multipkg (default: %(default)s)")
+    parser.add_argument('--output', default='bench-%s.json' % time.strftime('%Y%m%d-%H%M%S'),
+                        help="File to write results to (default: %(default)s)")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Earlier results to compare against")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the generated repositories")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = get_args(argv)
+    # Only the benchmark timings, not every stage's progress
+    for name in ('pp.pkglib.scripts.tagup', 'pp.pkglib.osutil', 'pp.pkglib.upload'):
+        logging.getLogger(name).setLevel(logging.WARN)
+
+    results = {'python': sys.version.split()[0], 'platform': platform.platform(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'vcs': args.vcs,
+               'fanout': args.fanout, 'per_repo': args.per_repo, 'jobs': args.jobs,
+               'results': {}}
+    for size in [int(i) for i in args.sizes.split(',')]:
+        get_log().info("Benchmarking %d packages" % size)
+        results['results'][str(size)] = run_benchmarks(size, args)
+
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+    get_log().info("Wrote results to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            get_log().info(compare(json.load(fp), results))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 # See http://peak.telecommunity.com/DevCenter/setuptools#namespace-packages
-try:
-    __import__('pkg_resources').declare_namespace(__name__)
-except ImportError:
+# pkgutil-style unless pkg_resources is already loaded: importing it scans
+# every installed distribution, which is most of the startup time of the
+# pp.pkglib scripts.
+import sys
+if 'pkg_resources' in sys.modules:
+    sys.modules['pkg_resources'].declare_namespace(__name__)
+else:
     from pkgutil import extend_path
     __path__ = extend_path(__path__, __name__)
 import modulefinder
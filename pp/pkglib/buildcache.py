@@ -0,0 +1,82 @@
+"""
+Cache of built sdists, keyed by the content of the package they were
+built from.
+
+The key is a hash of every tracked file in the package plus its current
+setup.cfg (which may hold pinned requirements that aren't committed yet),
+so a package whose sources haven't changed reuses its stored sdist instead
+of running setup.py again.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from pp.pkglib import vcs
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.buildcache')
+
+
+def hash_file(sha, filename):
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), ''):
+            sha.update(chunk)
+
+
+class BuildCache(object):
+    """ A directory of sdists, stored as ``<key>/<sdist filename>``
+
+        Parameters
+        ----------
+        :param path: `str`
+            The cache directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_key(self, pkg_dir, extra=''):
+        """ Returns the cache key for the package in `pkg_dir`
+
+            Parameters
+            ----------
+            :param extra: `str`
+                Anything else the build depends on, eg. the build command
+        """
+        sha = hashlib.sha1(extra)
+        setup_cfg = os.path.join(os.path.abspath(pkg_dir), 'setup.cfg')
+        files = set(vcs.get_files(pkg_dir))
+        files.add(setup_cfg)
+        for filename in sorted(files):
+            if not os.path.isfile(filename):
+                continue
+            sha.update('\0%s\0' % os.path.relpath(filename, pkg_dir))
+            hash_file(sha, filename)
+        return sha.hexdigest()
+
+    def restore(self, key, sdist):
+        """ Copies the cached sdist for `key` to the path `sdist`, returning
+            False if it isn't in the cache.
+        """
+        cached = os.path.join(self.path, key, os.path.basename(sdist))
+        if not os.path.isfile(cached):
+            return False
+        if not os.path.isdir(os.path.dirname(sdist)):
+            os.makedirs(os.path.dirname(sdist))
+        shutil.copyfile(cached, sdist)
+        return True
+
+    def store(self, key, sdist):
+        """ Adds a freshly built sdist to the cache under `key`
+        """
+        target = os.path.join(self.path, key)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        # Copy then rename so a concurrent restore never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=target, prefix='.store-')
+        os.close(fd)
+        shutil.copyfile(sdist, tmp)
+        os.rename(tmp, os.path.join(target, os.path.basename(sdist)))
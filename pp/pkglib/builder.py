@@ -0,0 +1,139 @@
+"""
+Runs ``setup.py`` commands without starting a new interpreter each time.
+
+A small pool of worker processes imports setuptools (and pkglib's setup
+machinery, if installed) once. Each build is then run in a child forked
+from a warm worker, so every package gets a fresh copy of the interpreter
+state without paying for startup and imports again.
+
+Builds run on the interpreter running this code rather than whichever
+``python`` is first on the PATH.
+"""
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import traceback
+import collections
+import subprocess
+import multiprocessing
+
+from pp.pkglib.osutil import get_span_name
+from pp.pkglib.timing import span
+
+# Modules imported once by each worker
+PRELOAD = ['setuptools', 'pkglib.setuptools']
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.builder')
+
+
+def can_fork():
+    return hasattr(os, 'fork')
+
+
+def _preload(modules):
+    for name in modules:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def run_setup(pkg_dir, args, output):
+    """ Runs ``setup.py <args>`` in `pkg_dir` in a forked child of this
+        process, writing its stdout and stderr to the file `output`.
+        Returns the exit code.
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            os.close(fd)
+            # In case sys.stdout/err had been pointed somewhere else
+            sys.stdout = os.fdopen(1, 'w', 1)
+            sys.stderr = os.fdopen(2, 'w', 0)
+            os.chdir(pkg_dir)
+            sys.argv = ['setup.py'] + list(args)
+            sys.path.insert(0, os.getcwd())
+            try:
+                execfile('setup.py', {'__name__': '__main__', '__file__': 'setup.py'})
+                code = 0
+            except SystemExit, e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+                else:
+                    sys.stderr.write('%s\n' % e.code)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+    status = os.waitpid(pid, 0)[1]
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ForkBuilder(object):
+    """ A pool of preloaded workers for running setup.py commands.
+
+        Create it from the main thread before starting any others; builds
+        can then be sent to it from any thread.
+
+        Parameters
+        ----------
+        :param jobs: `int`
+            Number of builds to run at the same time
+        :param preload: `list`
+            Modules to import in each worker
+    """
+
+    def __init__(self, jobs=1, preload=PRELOAD):
+        self.output_dir = tempfile.mkdtemp(prefix='pkglib-build-')
+        self.pool = multiprocessing.Pool(max(1, jobs), _preload, (list(preload),))
+
+    def run(self, pkg_dir, args):
+        """ Runs ``setup.py <args>`` in `pkg_dir`, returning a tuple of
+            ``(returncode, output_file)``. The output file holds the combined
+            stdout and stderr and is removed by `close`.
+        """
+        fd, output = tempfile.mkstemp(dir=self.output_dir, suffix='.log')
+        os.close(fd)
+        get_log().debug('build: setup.py %s in %s' % (' '.join(args), pkg_dir))
+        rc = self.pool.apply(run_setup, (os.path.abspath(pkg_dir), list(args), output))
+        return rc, output
+
+    def check_run(self, pkg_dir, args, prefix='', tail=100):
+        """ Like `run`, logging the output with the given prefix and raising
+            CalledProcessError with the last `tail` lines if the build fails.
+        """
+        cmd = ['setup.py'] + list(args)
+        with span(get_span_name(['python'] + cmd), 'subprocess', cmd=cmd, cwd=pkg_dir,
+                  forked=True):
+            rc, output = self.run(pkg_dir, args)
+        lines = collections.deque(maxlen=tail)
+        try:
+            with open(output) as fp:
+                for line in fp:
+                    line = line.rstrip('\n')
+                    lines.append(line)
+                    get_log().info('%s%s' % (prefix, line))
+        finally:
+            os.remove(output)
+        if rc != 0:
+            get_log().error("Non-zero exit code for: %r" % cmd)
+            raise subprocess.CalledProcessError(rc, cmd, '\n'.join(lines))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
@@ -0,0 +1,118 @@
+"""
+Finds the packages that have changed since their last release.
+
+Each package's last release is its highest release tag below the version
+in its setup.cfg; packages sharing a repository have their own tags, see
+`vcs.get_tag_prefix`. The files changed since then are listed
+with one ``hg status --rev``/``git diff`` per repository and release tag,
+and a package has changed if any file under its directory has.
+
+Tagging itself changes some files that shouldn't count: ``.hgtags``, and
+setup.cfg, whose version is rolled over and whose pinned requirements are
+put back. So a package whose only change is to setup.cfg has changed only
+if its setup.cfg differs from both the released one and the one before the
+requirements were pinned, ignoring the version.
+"""
+import os
+import logging
+import StringIO
+from ConfigParser import ConfigParser
+
+from pp.pkglib import vcs, metadata
+from pp.pkglib.metadata import Version
+
+# Files changed by tagging rather than by development
+IGNORED = ['.hgtags']
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.changes')
+
+
+def get_last_release(tags, version):
+    """ Returns the highest released version below `version`, or None.
+        `tags` are one package's releases, as returned by
+        `vcs.get_package_tags`, so a sibling's release in the same
+        repository is never taken for this package's.
+    """
+    version = Version(str(version))
+    older = [Version(i) for i in tags if Version(i) < version]
+    return max(older).vstring if older else None
+
+
+def get_config(parser):
+    """ Returns the contents of a setup.cfg parser as a dict, without the
+        version.
+    """
+    res = dict((i, dict(parser.items(i))) for i in parser.sections())
+    res.get('metadata', {}).pop('version', None)
+    return res
+
+
+def parse_config(text):
+    parser = ConfigParser()
+    parser.readfp(StringIO.StringIO(text))
+    return get_config(parser)
+
+
+def get_changed_packages(pkg_dirs, states=None):
+    """ Returns the set of package directories with changes since their last
+        release.
+
+        Parameters
+        ----------
+        :param pkg_dirs: `list`
+            Package directories, each with a setup.cfg
+        :param states: `dict`
+            Path -> `vcs.RepoState` for the packages, as returned by
+            `vcs.get_repo_states`, to save querying the tags again
+    """
+    if states is None:
+        states = vcs.get_repo_states(pkg_dirs)
+    changed = set()
+    groups = {}
+    for pkg_dir in pkg_dirs:
+        state = states[pkg_dir]
+        cfg = metadata.read_metadata(pkg_dir)
+        prefix = vcs.get_tag_prefix(cfg['name'], pkg_dir, state.root)
+        release = get_last_release(vcs.get_package_tags(state.tags, prefix), cfg['version'])
+        if release is None:
+            get_log().debug("%s has never been released" % pkg_dir)
+            changed.add(pkg_dir)
+        else:
+            groups.setdefault((state.root, prefix + release), []).append(pkg_dir)
+
+    for (root, release), dirs in groups.items():
+        backend = vcs.get_backend(root)
+        files = dict((k, v) for k, v in backend.get_changed_files(release).items()
+                     if os.path.basename(k) not in IGNORED)
+        check_cfg = []
+        for pkg_dir in dirs:
+            prefix = os.path.relpath(pkg_dir, root)
+            prefix = '' if prefix == '.' else prefix + '/'
+            setup_cfg = prefix + 'setup.cfg'
+            own = [i for i in files if i.startswith(prefix)]
+            if [i for i in own if i != setup_cfg] or files.get(setup_cfg, 'M') != 'M':
+                changed.add(pkg_dir)
+            elif own:
+                check_cfg.append((pkg_dir, setup_cfg))
+        if check_cfg:
+            changed.update(check_setup_cfgs(backend, release, check_cfg))
+    return changed
+
+
+def check_setup_cfgs(backend, release, items):
+    """ Returns the package directories from `items`, a list of
+        ``(pkg_dir, setup.cfg path relative to the root)``, whose setup.cfg
+        has changed since `release` by more than tagging changes it.
+    """
+    current = dict((pkg_dir, get_config(metadata.get_parser(pkg_dir))) for pkg_dir, _ in items)
+    released = backend.cat(release, [i[1] for i in items])
+    pending = [(pkg_dir, cfg) for pkg_dir, cfg in items
+               if released[cfg] is None or parse_config(released[cfg]) != current[pkg_dir]]
+    if not pending:
+        return set()
+    # The tagged revision holds the pinned requirements; compare with the one before
+    unpinned = backend.cat(backend.get_previous_revno(release), [i[1] for i in pending])
+    return set(pkg_dir for pkg_dir, cfg in pending
+               if unpinned[cfg] is None or parse_config(unpinned[cfg]) != current[pkg_dir])
@@ -0,0 +1,140 @@
+"""
+Client for Mercurial's command server.
+
+Rather than paying for a fresh ``hg`` process on every call, a single
+``hg serve --cmdserver pipe`` process is kept per repository and commands
+are sent to it over its pipe protocol. See
+http://mercurial.selenic.com/wiki/CommandServer for the protocol details.
+"""
+import os
+import atexit
+import struct
+import logging
+import threading
+import subprocess
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.cmdserver')
+
+
+class CommandServerError(Exception):
+    """ Raised when the command server can't be started or talked to """
+    pass
+
+
+class CommandServer(object):
+    """ A running ``hg serve --cmdserver pipe`` process for one repository.
+
+        Parameters
+        ----------
+        :param path: `str`
+            Root directory of the repository.
+        :param hg: `str`
+            The hg executable to run.
+    """
+
+    def __init__(self, path, hg='hg'):
+        self.path = path
+        self.hg = hg
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+        cmd = [self.hg, 'serve', '--cmdserver', 'pipe',
+               '--config', 'ui.interactive=False']
+        get_log().debug('starting command server in %s' % self.path)
+        try:
+            self.proc = subprocess.Popen(cmd, cwd=self.path, env=env,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        except OSError, e:
+            raise CommandServerError("Unable to start hg command server: %s" % e)
+        channel, hello = self._read_channel()
+        if channel != 'o' or 'runcommand' not in hello:
+            self.close()
+            raise CommandServerError("Unexpected hello from hg command server: %r"
+                                     % hello)
+        return self
+
+    def _read_channel(self):
+        header = self.proc.stdout.read(5)
+        if len(header) < 5:
+            raise CommandServerError("hg command server in %s went away" % self.path)
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            # Input requests carry the size wanted instead of any data
+            return channel, length
+        return channel, self.proc.stdout.read(length)
+
+    def runcommand(self, args):
+        """ Runs an hg command, returning a tuple of
+            ``(returncode, stdout, stderr)``
+
+            Parameters
+            ----------
+            :param args: `list`
+                The hg command line, without the leading ``hg``
+        """
+        data = '\0'.join(args)
+        out, err = [], []
+        with self.lock:
+            if self.proc is None:
+                self.start()
+            self.proc.stdin.write('runcommand\n' + struct.pack('>I', len(data)) + data)
+            self.proc.stdin.flush()
+            while True:
+                channel, value = self._read_channel()
+                if channel == 'o':
+                    out.append(value)
+                elif channel == 'e':
+                    err.append(value)
+                elif channel == 'r':
+                    return struct.unpack('>i', value)[0], ''.join(out), ''.join(err)
+                elif channel in 'IL':
+                    # We never have any input to give; an empty reply is EOF
+                    self.proc.stdin.write(struct.pack('>I', 0))
+                    self.proc.stdin.flush()
+                elif channel.isupper():
+                    raise CommandServerError("Unsupported hg command server channel %r"
+                                             % channel)
+
+    def close(self):
+        if self.proc is None:
+            return
+        get_log().debug('stopping command server in %s' % self.path)
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+        self.proc = None
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(path):
+    """ Returns the command server for the repository at `path`. The server
+        process itself is started by the first command sent to it.
+    """
+    path = os.path.abspath(path)
+    with _servers_lock:
+        if path not in _servers:
+            _servers[path] = CommandServer(path)
+        return _servers[path]
+
+
+def close_servers():
+    """ Stops all the command servers started by this process.
+    """
+    with _servers_lock:
+        for server in _servers.values():
+            server.close()
+        _servers.clear()
+
+
+atexit.register(close_servers)
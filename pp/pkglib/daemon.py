@@ -0,0 +1,292 @@
+"""
+An optional long-running server that keeps pkglib's expensive state warm.
+
+Planning a tagup from scratch means indexing the environment, parsing every
+package's metadata and asking each repository for its tags. Run
+``pkglibd serve`` and the same queries go to a process that already has all
+of that, over a Unix socket:
+
+- The index of installed distributions is rebuilt when the mtimes of the
+  ``sys.path`` directories, their .pth files or a source package's egg-info
+  change.
+- Parsed metadata is cached by `metadata.MetadataStore`, which already
+  checks the setup.cfg mtimes.
+- Repository states are cached by `vcs.StateCache`, stamped with the mtimes
+  of the files hg and git keep them in, and hg commands go through command
+  servers.
+
+Each request is one line of JSON, ``{"command": ..., "args": [...], "cwd": ...}``,
+answered with one line of JSON, ``{"ok": true, "result": ...}`` or
+``{"ok": false, "error": ...}``. Requests are handled one at a time.
+
+This module only imports the standard library at the top so that the
+client stays quick to start; the server imports the rest when it starts.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import errno
+import socket
+import hashlib
+import logging
+import SocketServer
+
+from pp.pkglib.osutil import get_cache_dir
+
+# Overrides the socket path
+SOCKET_ENV = 'PKGLIB_SOCKET'
+
+# Registered with command()
+COMMANDS = {}
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.daemon')
+
+
+class DaemonError(Exception):
+    """ A request failed in the server, or there's no server to send it to """
+    pass
+
+
+def get_socket_path():
+    """ Returns the path of the server's socket. Each environment gets its own
+        server, as the one it indexes is the one it runs in.
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    return os.path.join(get_cache_dir('daemon'),
+                        'pkglibd-%s.sock' % hashlib.sha1(sys.prefix).hexdigest()[:12])
+
+
+def request(command, args=(), path=None, timeout=None):
+    """ Sends a command to the server and returns its result.
+
+        Parameters
+        ----------
+        :param command: `str`
+            The command name, eg ``plan``
+        :param args: `list`
+            Its arguments, which must serialize to JSON
+        :param path: `str`
+            The server's socket, defaulting to `get_socket_path()`
+        :param timeout: `float`
+            Seconds to wait for the reply, defaulting to forever
+    """
+    path = path or get_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except socket.error, e:
+            raise DaemonError("No pkglibd server at %s (%s)" % (path, e))
+        sock.sendall(json.dumps({'command': command, 'args': list(args),
+                                 'cwd': os.getcwd()}) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        fp = sock.makefile('rb')
+        line = fp.readline()
+        fp.close()
+    finally:
+        sock.close()
+    if not line:
+        raise DaemonError("The pkglibd server at %s closed the connection" % path)
+    response = json.loads(line)
+    if not response['ok']:
+        raise DaemonError(response['error'])
+    return response['result']
+
+
+def is_running(path=None):
+    try:
+        request('ping', path=path, timeout=5)
+    except (DaemonError, socket.error):
+        return False
+    return True
+
+
+def command(func):
+    """ Registers a server command, called with the `State`, the request's
+        arguments and the client's cwd.
+    """
+    COMMANDS[func.__name__.replace('cmd_', '')] = func
+    return func
+
+
+def get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+
+class State(object):
+    """ What the server keeps between requests, and the checks that say
+        when it's out of date.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.index_stamp = None
+        self.index_builds = 0
+        self.stopping = False
+
+    def get_index_stamp(self):
+        """ Returns the mtimes of everything a change to the installed
+            distributions would touch.
+        """
+        from pp.pkglib.scripts import tagup
+        res = []
+        for entry in sys.path:
+            if os.path.isdir(entry):
+                res.append((entry, get_mtime(entry)))
+                res.extend((i, get_mtime(i))
+                           for i in sorted(glob.glob(os.path.join(entry, '*.pth'))))
+        if tagup._index is not None:
+            for key in sorted(tagup._index.src):
+                egg_info = getattr(tagup._index.by_key[key], 'egg_info', None)
+                if egg_info:
+                    res.extend((i, get_mtime(os.path.join(egg_info, i)))
+                               for i in ('PKG-INFO', 'requires.txt'))
+        return res
+
+    def refresh(self):
+        """ Rebuilds the distribution index, and with it the resolver, if the
+            environment has changed since it was built.
+        """
+        import site
+        import pkg_resources
+        from pp.pkglib.scripts import tagup
+        from pp.pkglib.distindex import DistIndex
+
+        stamp = self.get_index_stamp()
+        if tagup._index is not None and stamp == self.index_stamp:
+            return
+        if self.index_stamp is not None:
+            get_log().info("Environment has changed, re-indexing")
+            # Pick up any paths added to .pth files by new develop installs
+            for entry in list(sys.path):
+                if glob.glob(os.path.join(entry, '*.pth')):
+                    site.addsitedir(entry)
+        tagup._index = DistIndex(pkg_resources.WorkingSet(),
+                                 prefixes=tagup.SOURCE_PACKAGE_PREFIXES)
+        tagup._resolver = None
+        self.index_builds += 1
+        # Now including the new index's egg-infos
+        self.index_stamp = self.get_index_stamp()
+
+
+@command
+def cmd_ping(state, args, cwd):
+    return {'pid': os.getpid(), 'uptime': time.time() - state.started}
+
+
+@command
+def cmd_status(state, args, cwd):
+    from pp.pkglib import vcs
+    from pp.pkglib.scripts import tagup
+    return {'pid': os.getpid(),
+            'uptime': time.time() - state.started,
+            'requests': state.requests,
+            'index_builds': state.index_builds,
+            'distributions': len(tagup._index) if tagup._index is not None else 0,
+            'repositories': len(vcs._state_cache.entries) if vcs._state_cache else 0}
+
+
+@command
+def cmd_stop(state, args, cwd):
+    state.stopping = True
+    return {'pid': os.getpid()}
+
+
+@command
+def cmd_plan(state, args, cwd):
+    """ Returns the tagup plan for some distributions, as `tagup.Plan.to_dict`.
+        Takes tagup's command line; nothing is changed, whatever it says.
+    """
+    from pp.pkglib.scripts import tagup
+    if not [i for i in args if not i.startswith('-')]:
+        raise DaemonError("No distributions given")
+    state.refresh()
+    try:
+        return tagup.plan_tagup(tagup.get_args(args)).to_dict()
+    except tagup.UserError, e:
+        raise DaemonError(e.args[0])
+
+
+@command
+def cmd_changed(state, args, cwd):
+    """ Returns which of the given package directories have changed since
+        their last release.
+    """
+    from pp.pkglib import changes
+    pkg_dirs = [os.path.normpath(os.path.join(cwd, i)) for i in args]
+    return sorted(changes.get_changed_packages(pkg_dirs))
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        state = self.server.state
+        state.requests += 1
+        try:
+            req = json.loads(self.rfile.readline())
+            func = COMMANDS.get(req.get('command'))
+            if func is None:
+                raise DaemonError("Unknown command: %s" % req.get('command'))
+            start = time.time()
+            result = func(state, req.get('args', []), req.get('cwd') or os.getcwd())
+            get_log().info("%s %s: %.3fs" % (req['command'], ' '.join(req.get('args', [])),
+                                            time.time() - start))
+            response = {'ok': True, 'result': result}
+        except SystemExit, e:
+            # From argparse, which has already said why
+            response = {'ok': False, 'error': "Bad arguments (exit code %s)" % e.code}
+        except DaemonError, e:
+            response = {'ok': False, 'error': e.args[0]}
+        except Exception, e:
+            get_log().exception("Request failed")
+            response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+class Server(SocketServer.UnixStreamServer):
+
+    def __init__(self, path):
+        self.state = State()
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+
+
+def serve(path=None):
+    """ Runs the server until it's sent ``stop``.
+    """
+    from pp.pkglib import vcs, cmdserver
+
+    path = path or get_socket_path()
+    if os.path.exists(path):
+        if is_running(path):
+            raise DaemonError("A pkglibd server is already running at %s" % path)
+        # Left behind by one that died
+        os.unlink(path)
+    vcs.use_cmdserver(True)
+    vcs.cache_states(True)
+    server = Server(path)
+    get_log().info("pkglibd %d listening on %s" % (os.getpid(), path))
+    try:
+        # Warm up before the first request
+        server.state.refresh()
+        while not server.state.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        cmdserver.close_servers()
+        vcs.cache_states(False)
+        get_log().info("pkglibd %d stopped" % os.getpid())
@@ -0,0 +1,109 @@
+"""
+An index over the distributions installed in an environment.
+
+Scanning ``pkg_resources.working_set`` for every lookup is quadratic once a
+run deals with many distributions in a large environment, so the index is
+built once and then answers lookups and source/third-party classification
+from dictionaries.
+"""
+import logging
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.distindex')
+
+
+class MissingDistributions(KeyError):
+    """ Raised when one or more distributions are not in the index.
+        The missing names are available as `names`.
+    """
+    def __init__(self, names):
+        KeyError.__init__(self, "Distribution%s not installed: %s" %
+                          ('s' if len(names) > 1 else '', ', '.join(names)))
+        self.names = names
+
+    def __str__(self):
+        return self.args[0]
+
+
+def is_src_name(project_name, prefixes):
+    for prefix in prefixes:
+        if project_name.startswith(prefix):
+            return True
+    return False
+
+
+class DistIndex(object):
+    """ Name and key lookup of distributions, plus their classification as
+        source packages (ones we could be tagging up in this environment)
+        or third-party ones.
+
+        Parameters
+        ----------
+        :param dists: `iterable`
+            Distributions to index, defaulting to ``pkg_resources.working_set``.
+            The first distribution seen for a name wins, as with the working set.
+        :param prefixes: `list`
+            Project name prefixes of source packages.
+    """
+
+    def __init__(self, dists=None, prefixes=('pp.',)):
+        if dists is None:
+            import pkg_resources
+            dists = pkg_resources.working_set
+        self.prefixes = list(prefixes)
+        self.by_name = {}
+        self.by_key = {}
+        self.src = set()
+        self.third_party = set()
+        for dist in dists:
+            if dist.key in self.by_key:
+                continue
+            self.by_name[dist.project_name] = dist
+            self.by_key[dist.key] = dist
+            if is_src_name(dist.project_name, self.prefixes):
+                if not dist.location.endswith('.egg'):
+                    self.src.add(dist.key)
+            else:
+                self.third_party.add(dist.key)
+        get_log().debug("Indexed %d distributions" % len(self.by_key))
+
+    def __len__(self):
+        return len(self.by_key)
+
+    def __iter__(self):
+        return iter(self.by_key.values())
+
+    def __contains__(self, name):
+        return name in self.by_name or name in self.by_key
+
+    def get(self, name):
+        """ Returns the distribution with the given project name or key
+        """
+        try:
+            return self.by_name[name]
+        except KeyError:
+            try:
+                return self.by_key[name]
+            except KeyError:
+                raise MissingDistributions([name])
+
+    def get_many(self, names):
+        """ Returns the distributions for a list of names, in order. If any
+            of them are missing they are all reported in one error.
+        """
+        missing = [i for i in names if i not in self]
+        if missing:
+            raise MissingDistributions(missing)
+        return [self.get(i) for i in names]
+
+    def is_src(self, dist):
+        if dist.key in self.by_key:
+            return dist.key in self.src
+        return (is_src_name(dist.project_name, self.prefixes)
+                and not dist.location.endswith('.egg'))
+
+    def is_third_party(self, dist):
+        if dist.key in self.by_key:
+            return dist.key in self.third_party
+        return not is_src_name(dist.project_name, self.prefixes)
@@ -0,0 +1,82 @@
+"""
+Records how a virtualenv was built, so it can be reused or updated in place.
+
+The state file in the environment holds a fingerprint of the interpreter
+and bootstrap options it was created with, the third-party requirements
+installed into it and the wheels of their resolved closure. When the
+fingerprint still matches the environment is kept; when only the
+requirements differ, just the difference in wheels is installed or removed.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+
+STATE_FILE = '.pkglib-env.json'
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.envstate')
+
+
+def get_fingerprint(options):
+    """ Returns a fingerprint of this interpreter and the options an
+        environment is bootstrapped with.
+    """
+    data = json.dumps([os.path.realpath(sys.executable), sys.version,
+                       sorted(options.items())])
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_wheel_name(filename):
+    """ Returns the project key of a wheel file, eg. ``zope-interface`` for
+        ``zope_interface-4.1.0-cp27-cp27mu-linux_x86_64.whl``
+    """
+    return os.path.basename(filename).split('-')[0].replace('_', '-').lower()
+
+
+def diff_wheels(old, new):
+    """ Returns a tuple of ``(to_install, to_remove)`` between two sets of
+        wheels, each the whole resolved closure of an environment's
+        requirements: the wheels in `new` but not `old`, and the project
+        names with a wheel in `old` but none in `new`.
+
+        Working on the closures rather than the requirements means a
+        dependency still needed by something else is never removed, and
+        the dependencies of a dropped requirement are.
+    """
+    old_files = set(os.path.basename(i) for i in old)
+    new_names = set(get_wheel_name(i) for i in new)
+    to_install = sorted(i for i in new if os.path.basename(i) not in old_files)
+    to_remove = sorted(set(get_wheel_name(i) for i in old) - new_names)
+    return to_install, to_remove
+
+
+class EnvState(object):
+    """ The recorded state of the environment at `env_root`
+    """
+
+    def __init__(self, env_root):
+        self.path = os.path.join(env_root, STATE_FILE)
+        self.fingerprint = None
+        self.requirements = []
+        # Wheel file names; None for environments recorded before these were
+        self.wheels = []
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as fp:
+                    data = json.load(fp)
+                self.fingerprint = data.get('fingerprint')
+                self.requirements = data.get('requirements', [])
+                self.wheels = data.get('wheels')
+            except (IOError, ValueError), e:
+                get_log().warn("Ignoring unreadable %s: %s" % (self.path, e))
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'fingerprint': self.fingerprint,
+                       'requirements': sorted(self.requirements),
+                       'wheels': sorted(self.wheels or [])}, fp, indent=2)
+        os.rename(tmp, self.path)
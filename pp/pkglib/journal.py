@@ -0,0 +1,78 @@
+"""
+A journal of the work done by a multi-stage run, so it can be resumed.
+
+The journal holds the run's plan and every (stage, item) pair completed so
+far. It is rewritten atomically after each item, so after a crash it
+records exactly the work that finished.
+"""
+import os
+import json
+import logging
+import threading
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.journal')
+
+
+class Journal(object):
+    """ The journal file at `path`
+
+        Parameters
+        ----------
+        :param path: `str`
+            File to keep the journal in
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.plan = None
+        self.done = {}
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        with open(self.path) as fp:
+            data = json.load(fp)
+        self.plan = data['plan']
+        self.done = dict((k, set(v)) for k, v in data['done'].items())
+        get_log().info("Resuming from %s" % self.path)
+
+    def start(self, plan):
+        """ Starts a new journal for a run of the given plan, which must be
+            JSON serialisable.
+        """
+        with self.lock:
+            self.plan = plan
+            self.done = {}
+            self._save()
+
+    def is_done(self, stage, item):
+        with self.lock:
+            return item in self.done.get(stage, ())
+
+    def mark_done(self, stage, item):
+        with self.lock:
+            self.done.setdefault(stage, set()).add(item)
+            self._save()
+
+    def remove(self):
+        """ Removes the journal once the run has finished
+        """
+        if self.exists():
+            os.remove(self.path)
+
+    def _save(self):
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump({'plan': self.plan,
+                       'done': dict((k, sorted(v)) for k, v in self.done.items())},
+                      fp, indent=2)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp, self.path)
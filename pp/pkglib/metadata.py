@@ -1,4 +1,6 @@
+import os
 import logging
+import threading
 from ConfigParser import ConfigParser
 from distutils.version import LooseVersion as Version
 
@@ -7,18 +9,111 @@ def get_log():
        return logging.getLogger('pp.pkglib.metadata')
 
 
-def get_parser():
-    """ Returns a parser for the setup.cfg in the cwd
+MULTI_LINE_KEYS=['install_requires']
+
+
+class MetadataStore(object):
+    """ Cache of parsed setup.cfg files, keyed by absolute path.
+
+        Each entry remembers the file's mtime, size and inode, and the file is
+        only parsed again once one of these changes. Safe to use from
+        multiple threads.
     """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def _stamp(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def _get(self, path):
+        filename = os.path.abspath(os.path.join(path or '', 'setup.cfg'))
+        stamp = self._stamp(filename)
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != stamp:
+                get_log().debug("Parsing %s" % filename)
+                parser = read_parser(filename)
+                entry = (stamp, parser, {})
+                self.entries[filename] = entry
+            return entry
+
+    def get_parser(self, path=None):
+        """ Returns the shared parser for the setup.cfg in the given directory
+        """
+        return self._get(path)[1]
+
+    def get_metadata(self, path=None):
+        """ Returns the shared metadata dict for the setup.cfg in the given
+            directory
+        """
+        stamp, parser, cache = self._get(path)
+        with self.lock:
+            if 'metadata' not in cache:
+                cache['metadata'] = get_metadata(parser)
+            return cache['metadata']
+
+    def invalidate(self, path=None):
+        """ Drops the cached setup.cfg for the given directory
+        """
+        filename = os.path.abspath(os.path.join(path or '', 'setup.cfg'))
+        with self.lock:
+            self.entries.pop(filename, None)
+
+
+_store = MetadataStore()
+
+
+def read_parser(filename):
     parser = ConfigParser()
-    parser.read('setup.cfg')
+    parser.read(filename)
     return parser
 
-MULTI_LINE_KEYS=['install_requires']
+
+def get_parser(path=None, cached=True):
+    """ Returns a parser for the setup.cfg in the given directory,
+        defaulting to the cwd.
+
+        Cached parsers are shared between callers and must not be changed;
+        pass ``cached=False`` to get a private copy to edit and save with
+        `write_parser`.
+    """
+    if not cached:
+        return read_parser(os.path.join(path or '', 'setup.cfg'))
+    return _store.get_parser(path)
+
+
+def write_parser(parser, path=None):
+    """ Writes a parser out to the setup.cfg in the given directory
+    """
+    with open(os.path.join(path or '', 'setup.cfg'), 'wb') as fp:
+        parser.write(fp)
+    _store.invalidate(path)
+
+
+def invalidate(path=None):
+    """ Forgets the cached setup.cfg for the given directory, for use after
+        changing the file by other means.
+    """
+    _store.invalidate(path)
+
+
+def read_metadata(path=None):
+    """ Returns the (cached, shared) metadata for the setup.cfg in the given
+        directory.
+    """
+    return _store.get_metadata(path)
+
+
 def get_metadata(parser):
     res = dict(parser.items('metadata'))
     for key in MULTI_LINE_KEYS:
-        res[key] = [i.strip() for i in res[key].split() if i.strip()]
+        res[key] = [i.strip() for i in res.get(key, '').split() if i.strip()]
     return res
 
 def get_version(parser):
@@ -7,6 +7,19 @@ Any failure in a sub-command will cause the loop to stop, unless it was a
 test command in which case it will continue through all the packages, unless
 the '-x' option was there in which case it will stop as normal.
 
+Packages are run in the order given by their install_requires. Independent
+packages can be run at the same time by giving a job count before the
+command, eg::
+
+    python setup.py -j 4 test
+
+Adding '--fork' runs each package's setup.py in a child forked from a worker
+that has already imported setuptools, rather than starting a new interpreter
+for every package.
+
+Adding '--only-changed' skips packages with no changes since their last
+release tag, other than those depending on a package that has changed.
+
 
 If you have interdependent packages you need to setup in an environment, a
 trick to sidestep the setup ordering problem is to run the following in order::
@@ -14,46 +27,206 @@ trick to sidestep the setup ordering problem is to run the following in order::
     python setup.py develop --no-deps
     python setup.py develop
 """
+import os
 import sys
+import shutil
+import threading
 import subprocess
-from pkglib import config, manage
+
+import pkg_resources
+from pkglib import config
+
+from pp.pkglib import metadata, changes
+from pp.pkglib.scheduler import run_graph
+from pp.pkglib.builder import ForkBuilder, can_fork
+
+# Guards the console so each package's output is printed in one piece.
+_output_lock = threading.Lock()
+
+
+def get_options(argv):
+    """ Pulls the ``-j N``/``--jobs=N``, ``--fork`` and ``--only-changed``
+        options out of the global setup.py options, ie. anything before the
+        first command.
+
+        Returns
+        -------
+        A tuple of ``(jobs, fork, only_changed, remaining_argv)``
+    """
+    jobs = 1
+    fork = False
+    only_changed = False
+    argv = list(argv)
+    i = 0
+    while i < len(argv) and argv[i].startswith('-'):
+        arg = argv[i]
+        value = None
+        if arg in ('-j', '--jobs') and i + 1 < len(argv):
+            value = argv[i + 1]
+            del argv[i:i + 2]
+        elif arg.startswith('--jobs='):
+            value = arg.split('=', 1)[1]
+            del argv[i]
+        elif arg.startswith('-j') and arg[2:].isdigit():
+            value = arg[2:]
+            del argv[i]
+        elif arg == '--fork':
+            fork = True
+            del argv[i]
+            continue
+        elif arg == '--only-changed':
+            only_changed = True
+            del argv[i]
+            continue
+        else:
+            i += 1
+            continue
+        try:
+            jobs = int(value)
+        except ValueError:
+            print ("Invalid value for --jobs: {0}".format(value))
+            sys.exit(1)
+    return max(jobs, 1), fork, only_changed, argv
+
+
+def get_dependencies(pkgs):
+    """ Returns a dict of pkg dir -> the other pkg dirs it requires, taken
+        from the install_requires of each sub-package.
+
+        Parameters
+        ----------
+        :param pkgs: `dict`
+            Mapping of pkg dir to its parsed sub-package metadata.
+    """
+    by_key = dict((pkg_resources.safe_name(cfg['name']).lower(), dirname)
+                  for dirname, cfg in pkgs.items())
+    deps = {}
+    for dirname, cfg in pkgs.items():
+        reqs = pkg_resources.parse_requirements(cfg.get('install_requires', []))
+        deps[dirname] = set(by_key[r.key] for r in reqs if r.key in by_key)
+    return deps
+
+
+def get_affected(changed, deps):
+    """ Returns the changed pkg dirs and every pkg dir that depends on one
+        of them, directly or not.
+
+        Parameters
+        ----------
+        :param changed: `set`
+            The pkg dirs that have changed
+        :param deps: `dict`
+            Mapping of pkg dir to the pkg dirs it requires, as returned by
+            `get_dependencies`
+    """
+    affected = set(changed)
+    more = True
+    while more:
+        more = [i for i in deps if i not in affected and deps[i] & affected]
+        affected.update(more)
+    return affected
+
+
+def run_pkg(dirname, cmd, buffered, builder=None):
+    """ Runs the setup.py command in the given pkg dir, returning its
+        exit code. If `buffered` is set the command's output is collected
+        and printed when it finishes so it is not mixed in with the output
+        of packages running alongside it. Output is always buffered when
+        running through a `ForkBuilder`.
+    """
+    header = ("In directory {0}: Running '{1}'"
+              .format(dirname, ' '.join(cmd)))
+    if builder:
+        rc, output = builder.run(dirname, cmd[2:])
+        with _output_lock:
+            print (header)
+            with open(output) as fp:
+                shutil.copyfileobj(fp, sys.stdout)
+            sys.stdout.flush()
+        os.remove(output)
+        returncode = rc
+    elif not buffered:
+        print (header)
+        p = subprocess.Popen(cmd, cwd=dirname)
+        p.communicate()
+        returncode = p.returncode
+    else:
+        p = subprocess.Popen(cmd, cwd=dirname, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        out = p.communicate()[0]
+        with _output_lock:
+            print (header)
+            sys.stdout.write(out)
+            sys.stdout.flush()
+        returncode = p.returncode
+    if returncode != 0:
+        with _output_lock:
+            print ("Command failed in {0} with exit code {1}"
+                   .format(dirname, returncode))
+    return returncode
 
 
 def setup():
     """ Mirror pkglib's setup() method for each sub-package in this repository.
+
+        Packages are run in dependency order, taken from the install_requires
+        of each sub-package. Passing ``-j N`` before the setup.py command
+        runs up to N independent packages at the same time.
     """
     top_level_parser = config.parse.get_pkg_cfg_parser()
     cfg = config._parse_metadata(top_level_parser, 'multipkg', ['pkg_dirs'])
-    rc = [0]
+    jobs, fork, only_changed, argv = get_options(sys.argv[1:])
+
+    pkgs = {}
     for dirname in cfg['pkg_dirs']:
-        with manage.chdir(dirname):
-            # Update sub-package setup.cfg with top-level version
-            sub_parser = config.parse.get_pkg_cfg_parser()
-            sub_cfg = config.parse_pkg_metadata(sub_parser)
-            if sub_cfg['version'] != cfg['version']:
-                print ("Updating setup.cfg version for {0}: {1} -> {2}"
-                       .format(dirname, sub_cfg['version'], cfg['version']))
-                sub_parser.set('metadata', 'version', cfg['version'])
-                with open('setup.cfg', 'w') as sub_cfg_file:
-                    sub_parser.write(sub_cfg_file)
-
-            cmd = [sys.executable, "setup.py"] + sys.argv[1:]
-            print ("In directory {0}: Running '{1}'"
-                   .format(dirname, ' '.join(cmd)))
-            p = subprocess.Popen(cmd)
-            p.communicate()
-            if p.returncode != 0:
-                # Here we exit straight away, unless this was a run as
-                # 'python setup.py test'. Reason for this is that we want to
-                # run all the packages' tests through and gather the results.
-                # Exception: using the -x/--exitfirst option.
-                # For any other setup.py command, a failure here is likely
-                # some sort of build or config issue and it's best not to
-                # plow on.
-                print "Command failed with exit code {0}".format(p.returncode)
-                if 'test' in cmd and not '-x' in ' '.join(cmd)  \
-                                and not '--exitfirst' in ' '.join(cmd):
-                    rc[0] = p.returncode
-                else:
-                    sys.exit(p.returncode)
-    sys.exit(rc[0])
+        # Update sub-package setup.cfg with top-level version
+        sub_parser = metadata.get_parser(dirname, cached=False)
+        sub_cfg = config.parse_pkg_metadata(sub_parser)
+        if sub_cfg['version'] != cfg['version']:
+            print ("Updating setup.cfg version for {0}: {1} -> {2}"
+                   .format(dirname, sub_cfg['version'], cfg['version']))
+            sub_parser.set('metadata', 'version', cfg['version'])
+            metadata.write_parser(sub_parser, dirname)
+        pkgs[dirname] = sub_cfg
+
+    cmd = [sys.executable, "setup.py"] + argv
+
+    # Here we exit straight away, unless this was a run as
+    # 'python setup.py test'. Reason for this is that we want to
+    # run all the packages' tests through and gather the results.
+    # Exception: using the -x/--exitfirst option.
+    # For any other setup.py command, a failure here is likely
+    # some sort of build or config issue and it's best not to
+    # plow on.
+    keep_going = ('test' in cmd and not '-x' in ' '.join(cmd)
+                  and not '--exitfirst' in ' '.join(cmd))
+
+    builder = None
+    if fork and can_fork():
+        builder = ForkBuilder(jobs)
+
+    def run(dirname):
+        rc = run_pkg(dirname, cmd, buffered=jobs > 1, builder=builder)
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd)
+        return rc
+
+    pkg_dirs = cfg['pkg_dirs']
+    deps = get_dependencies(pkgs)
+    if only_changed:
+        affected = get_affected(changes.get_changed_packages(pkg_dirs), deps)
+        for dirname in pkg_dirs:
+            if dirname not in affected:
+                print ("Skipping {0}: no changes since its last release".format(dirname))
+        pkg_dirs = [i for i in pkg_dirs if i in affected]
+
+    try:
+        results, failures = run_graph(pkg_dirs, deps, run, jobs=jobs, keep_going=keep_going)
+    finally:
+        if builder:
+            builder.close()
+    for dirname in reversed(pkg_dirs):
+        if dirname in failures:
+            exc = failures[dirname][1]
+            sys.exit(getattr(exc, 'returncode', 1))
+    sys.exit(0)
@@ -1,8 +1,14 @@
 import os
-import subprocess
+import time
 import logging
+import threading
+import subprocess
+import collections
 from contextlib import contextmanager
 
+from pp.pkglib.scheduler import run_graph
+from pp.pkglib.timing import span
+
 
 def get_log():
     return logging.getLogger('pp.pkglib.osutil')
@@ -13,6 +19,9 @@ def chdir(dir):
     """ Context Manager that changes to the given dir 
         and back again on exit. Much like bash's pushd and popd.
 
+        This changes the cwd of the whole process, so it mustn't be used
+        from threads; pass ``cwd`` to `run` instead.
+
         Parameters
         ----------
         :param dir: `str`
@@ -24,23 +33,239 @@ def chdir(dir):
     os.chdir(here)
 
 
-def run(cmd, capture=False, **kwargs):
+def get_cache_dir(*parts):
+    """ Returns a directory under the pkglib cache, creating it if needed.
+        The cache lives in ``$PKGLIB_CACHE_DIR``, defaulting to
+        ``~/.cache/pp-pkglib``.
+    """
+    root = os.environ.get('PKGLIB_CACHE_DIR') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'pp-pkglib')
+    res = os.path.join(root, *parts)
+    if not os.path.isdir(res):
+        try:
+            os.makedirs(res)
+        except OSError:
+            # Someone else may have just made it
+            if not os.path.isdir(res):
+                raise
+    return res
+
+
+def get_span_name(cmd):
+    """ Returns a short name for a command line in timing reports,
+        eg. ``hg tag`` or ``python setup.py sdist``
+    """
+    if isinstance(cmd, basestring):
+        cmd = cmd.split()
+    words = [os.path.basename(cmd[0])] if cmd else []
+    for arg in cmd[1:]:
+        if arg.startswith('-') or len(words) == 3:
+            break
+        words.append(arg)
+    return ' '.join(words)
+
+
+def get_env(env=None):
+    """ Returns the environment for a subprocess: the current environment
+        with the given variables added, or None to inherit it unchanged.
+    """
+    if not env:
+        return None
+    res = dict(os.environ)
+    res.update(env)
+    return res
+
+
+# Number of output lines kept from a streamed command, for error messages
+STREAM_TAIL = 100
+
+
+def iter_lines(cmd, cwd=None, env=None, tail=None):
+    """ Runs a command and yields its combined stdout and stderr one line at
+        a time as they are written. Once the output is exhausted a
+        CalledProcessError is raised if the command failed, with the last
+        lines of output (see `tail`) as its output.
+
+        Parameters
+        ----------
+        :param cwd: `str`
+            Directory to run the command in, defaulting to the cwd
+        :param env: `dict`
+            Variables to add to the command's environment
+        :param tail: `collections.deque`
+            Buffer to keep the last lines of output in. Defaults to one of
+            `STREAM_TAIL` lines.
+    """
+    if tail is None:
+        tail = collections.deque(maxlen=STREAM_TAIL)
+    get_log().debug('run: %r%s' % (cmd, ' in %s' % cwd if cwd else ''))
+    with span(get_span_name(cmd), 'subprocess', cmd=cmd, cwd=cwd):
+        ps = subprocess.Popen(cmd, cwd=cwd, env=get_env(env), stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, close_fds=True)
+        try:
+            # readline rather than iterating the file, which reads ahead
+            for line in iter(ps.stdout.readline, ''):
+                line = line.rstrip('\n')
+                tail.append(line)
+                yield line
+            ps.wait()
+        finally:
+            if ps.returncode is None:
+                # The caller stopped reading early
+                ps.kill()
+                ps.wait()
+            ps.stdout.close()
+    if ps.returncode != 0:
+        raise subprocess.CalledProcessError(ps.returncode, cmd, '\n'.join(tail))
+
+
+def run(cmd, capture=False, cwd=None, env=None, stream=False, prefix='',
+        tail=STREAM_TAIL, input=None, **kwargs):
     """ Convenience wrapper around subprocess.Popen
 
         Parameters
         ----------
         :param capture: `bool`
-            Captures and returns stdout if True
+            Captures and returns stdout if True. Stderr is captured too, and
+            logged as a warning if the command succeeds but writes any.
+        :param cwd: `str`
+            Directory to run the command in, defaulting to the cwd
+        :param env: `dict`
+            Variables to add to the command's environment
+        :param stream: `bool`
+            Logs each line of stdout and stderr as it arrives, starting with
+            `prefix`. Only the last `tail` lines are kept, for the error
+            if the command fails.
+        :param input: `str`
+            Data to send to the command's stdin
     """
-    get_log().debug('run: %r' % cmd)  
-    stdout = None
+    if stream:
+        log = get_log()
+        lines = collections.deque(maxlen=tail)
+        try:
+            for line in iter_lines(cmd, cwd, env, lines):
+                log.info('%s%s' % (prefix, line))
+        except subprocess.CalledProcessError:
+            log.error("Non-zero exit code for: %r" % cmd)
+            log.error("Last %d lines of output:\n%s" % (len(lines), '\n'.join(lines)))
+            raise
+        return None
+
+    get_log().debug('run: %r%s' % (cmd, ' in %s' % cwd if cwd else ''))
+    stdout = stderr = None
     if capture:
-        stdout=subprocess.PIPE
-    ps = subprocess.Popen(cmd,stdout=stdout, **kwargs)
-    out, err = ps.communicate()
+        stdout = stderr = subprocess.PIPE
+    with span(get_span_name(cmd), 'subprocess', cmd=cmd, cwd=cwd):
+        if input is not None:
+            kwargs['stdin'] = subprocess.PIPE
+        ps = subprocess.Popen(cmd,stdout=stdout, stderr=stderr, cwd=cwd, env=get_env(env),
+                              **kwargs)
+        out, err = ps.communicate(input)
     if not ps.returncode == 0:
        get_log().error("Non-zero exit code for: %r" % cmd)
        get_log().error("Stdout: %r" % out)
        get_log().error("Stderr: %r" % err)
        raise subprocess.CalledProcessError(ps.returncode, cmd, out)
+    if err and err.strip():
+        # Warnings that would otherwise have gone to the terminal
+        get_log().warn("%s: %s" % (get_span_name(cmd), err.strip()))
     return out
+
+
+class Command(object):
+    """ A command for `run_many`
+
+        Parameters
+        ----------
+        :param cmd: `list`
+            The command line
+        :param cwd: `str`
+            Directory to run the command in, defaulting to the cwd
+        :param env: `dict`
+            Variables to add to the command's environment
+        :param timeout: `float`
+            Seconds after which the command is killed
+    """
+
+    def __init__(self, cmd, cwd=None, env=None, timeout=None):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<Command %r%s>' % (self.cmd, ' in %s' % self.cwd if self.cwd else '')
+
+
+class Result(collections.namedtuple('Result', ['cmd', 'cwd', 'returncode', 'stdout',
+                                               'stderr', 'duration', 'timed_out'])):
+    """ The outcome of a command run by `run_many`
+    """
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def check(self):
+        """ Raises CalledProcessError if the command failed
+        """
+        if not self.ok:
+            raise subprocess.CalledProcessError(self.returncode, self.cmd, self.stdout)
+        return self
+
+
+def execute(command, timeout=None):
+    """ Runs a `Command`, capturing stdout and stderr, and returns a
+        `Result`. This never raises for a failed command; check the result.
+    """
+    timeout = command.timeout or timeout
+    get_log().debug('run: %r' % command)
+    start = time.time()
+    ps = subprocess.Popen(command.cmd, cwd=command.cwd, env=get_env(command.env),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    timed_out = []
+    timer = None
+    if timeout:
+        def kill():
+            timed_out.append(True)
+            try:
+                ps.kill()
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        with span(get_span_name(command.cmd), 'subprocess', cmd=command.cmd, cwd=command.cwd):
+            out, err = ps.communicate()
+    finally:
+        if timer:
+            timer.cancel()
+    if timed_out:
+        get_log().error("Timed out after %ss: %r" % (timeout, command))
+    return Result(command.cmd, command.cwd, ps.returncode, out, err,
+                  time.time() - start, bool(timed_out))
+
+
+def run_many(commands, jobs=4, timeout=None):
+    """ Runs many commands with up to `jobs` at the same time, returning a
+        list of `Result` objects in the same order as the commands.
+
+        Parameters
+        ----------
+        :param commands: `list`
+            `Command` objects, or plain command lines to run in the cwd
+        :param jobs: `int`
+            Maximum number of commands to run at once
+        :param timeout: `float`
+            Default per-command timeout in seconds
+    """
+    commands = [i if isinstance(i, Command) else Command(i) for i in commands]
+    order = range(len(commands))
+    results, failures = run_graph(order, {}, lambda i: execute(commands[i], timeout),
+                                  jobs=jobs, keep_going=True)
+    if failures:
+        # Only raised when the command couldn't be started at all
+        exc_info = failures[min(failures)]
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return [results[i] for i in order]
@@ -9,15 +9,23 @@ Oisin Mulvihill
 """
 import os
 import sys
+import shlex
 import os.path
 import collections
 
+# The tasks and options below need paver as soon as this is loaded, but
+# paver.virtual and pkg_resources are only imported by the tasks using them
 from paver import easy
 from paver import tasks
-from paver import virtual
 from paver.path import path
 from paver.options import Bunch
 
+from pp.pkglib import metadata, repocache
+from pp.pkglib.wheelhouse import Wheelhouse
+from pp.pkglib.envstate import EnvState, get_fingerprint, get_wheel_name, diff_wheels
+from pp.pkglib.osutil import run, execute, Command
+from pp.pkglib.scheduler import run_graph, dependency_levels, CycleError
+
 
 CWD = os.path.abspath(os.curdir)
 
@@ -29,6 +37,9 @@ if BASKET:
 
 Dep = collections.namedtuple('Dep', ['name', 'repo', 'uri'])
 
+# Default number of clones to run at the same time
+DEFAULT_JOBS = 4
+
 
 # Paver global options we'll add to:
 easy.options(
@@ -65,14 +76,87 @@ easy.options(
 
 def git_clone(uri, target):
     """Call git clone on given uri and check it out as target.
+
+    The clone is made from a local mirror, see pp.pkglib.repocache.
     """
-    easy.sh("git clone -b develop %s %s" % (uri, target))
+    easy.info("git clone -b develop %s %s" % (uri, target))
+    repocache.clone('git', uri, target, branch='develop')
 
 
 def hg_clone(uri, target):
-    """Call git clone on given uri and check it out as target.
+    """Call hg clone on given uri and check it out as target.
+
+    The clone is made from a local mirror, see pp.pkglib.repocache.
+    """
+    easy.info("hg clone %s %s" % (uri, target))
+    repocache.clone('hg', uri, target)
+
+
+def clone(dev_pkg, target):
+    """Check out a dev package into the (absolute) target path.
+    """
+    if dev_pkg.repo == 'git':
+        git_clone(dev_pkg.uri, target)
+    elif dev_pkg.repo == 'hg':
+        hg_clone(dev_pkg.uri, target)
+
+
+def clone_all(dev_pkgs, src_dir, jobs=DEFAULT_JOBS):
+    """Clone every dev package whose checkout is missing, all at the same time.
+    """
+    missing = [i for i in dev_pkgs if not (src_dir / i.name).isdir()]
+    if not missing:
+        return
+    easy.info("Cloning %s" % ', '.join(i.name for i in missing))
+    by_name = dict((i.name, i) for i in missing)
+    results, failures = run_graph([i.name for i in missing], {},
+                                  lambda name: clone(by_name[name], src_dir / name),
+                                  jobs=jobs, keep_going=True)
+    if failures:
+        for name in failures:
+            easy.error("Clone of %s failed: %s" % (name, failures[name][1]))
+        raise easy.BuildFailure("Unable to clone %s" % ', '.join(sorted(failures)))
+
+
+def get_third_party_requirements(dev_pkgs, src_dir):
+    """Return the requirements of the dev package checkouts that aren't
+    themselves dev packages, sorted.
+    """
+    import pkg_resources
+    names, reqs = set(), {}
+    for dev_pkg in dev_pkgs:
+        t = src_dir / dev_pkg.name
+        if not (t / 'setup.cfg').isfile():
+            continue
+        cfg = metadata.read_metadata(t)
+        names.add(pkg_resources.safe_name(cfg.get('name', dev_pkg.name)).lower())
+        for req in pkg_resources.parse_requirements(cfg['install_requires']):
+            reqs[str(req)] = req
+    return sorted(k for k, v in reqs.items() if v.key not in names)
+
+
+def get_develop_order(dev_pkgs, src_dir):
+    """Return the dev packages in the order to set them up, each after the
+    ones it depends on, using the install_requires in each checkout's
+    setup.cfg. Packages are otherwise kept in the order given.
     """
-    easy.sh("hg clone %s %s" % (uri, target))
+    import pkg_resources
+    names, deps = [], {}
+    for dev_pkg in dev_pkgs:
+        t = src_dir / dev_pkg.name
+        if not (t / 'setup.cfg').isfile():
+            names.append(dev_pkg.name)
+            continue
+        cfg = metadata.read_metadata(t)
+        name = pkg_resources.safe_name(cfg.get('name', dev_pkg.name)).lower()
+        names.append(name)
+        deps[name] = [i.key for i in pkg_resources.parse_requirements(cfg['install_requires'])]
+    by_name = dict(zip(names, dev_pkgs))
+    try:
+        levels = dependency_levels(names, deps)
+    except CycleError, e:
+        raise easy.BuildFailure("Can't set up the dev packages: %s" % e)
+    return [by_name[i] for level in levels for i in level]
 
 
 
@@ -126,11 +210,16 @@ def build(options):
 #
 #
 @easy.task
+@easy.cmdopts([
+    ('clear', None, "Rebuild the virtualenv even if it is up to date."),
+])
 def bootstrap(options):
     """create virtualenv in ./env
 
     This will use the system python
 
+    An existing virtualenv built by the same interpreter with the same
+    options is reused rather than cleared.
     """
     env = options.development_env
 
@@ -138,18 +227,30 @@ def bootstrap(options):
     # We do this so it doesn't try to get it via the network. It will be installed along
     # with other dependencies we deliver.
     #
-    virtual._create_bootstrap(
-        env.bootstrap,
+    bootstrap_options = dict(
         packages_to_install=[],
         paver_command_line=None,
         install_paver=False,
-        dest_dir=env.env_root,
         no_site_packages=True,
         unzip_setuptools=True,
     )
+    fingerprint = get_fingerprint(bootstrap_options)
+    state = EnvState(env.env_root)
 
-    # Actually create the virtual from the bootstrap we just created:
-    easy.sh('%s %s --no-site-packages --clear' % (sys.executable, env.bootstrap))
+    if (state.fingerprint == fingerprint and (env.env_root / 'bin' / 'python').isfile()
+            and not getattr(options, 'clear', False)):
+        easy.info("Reusing up to date virtualenv in %s" % env.env_root)
+    else:
+        from paver import virtual
+        virtual._create_bootstrap(env.bootstrap, dest_dir=env.env_root, **bootstrap_options)
+
+        # Actually create the virtual from the bootstrap we just created:
+        easy.sh('%s %s --no-site-packages --clear' % (sys.executable, env.bootstrap))
+        state = EnvState(env.env_root)
+        state.fingerprint = fingerprint
+        state.requirements = []
+        state.wheels = []
+        state.save()
     env.env_root.chdir()
 
 
@@ -232,8 +333,15 @@ def development_env(options):
 #
 @easy.task
 @easy.needs('development_env', 'bootstrap')
+@easy.cmdopts([
+    ('jobs=', 'j', "Number of clones to run at the same time."),
+    ('no-wheels', None, "Don't install third-party dependencies from the local wheelhouse."),
+])
 def develop(options):
     """Set up an environment to do development under.
+
+    Missing checkouts are all cloned at the same time, then packages are set
+    up one at a time in dependency order.
     """
     de = options.development_env
     env = options.env
@@ -264,32 +372,53 @@ def develop(options):
         print("Source checkout dir '%s' not present. Making." % src_dir)
         os.makedirs(src_dir)
 
-    for dev_pkg in options.DEV_PKGS_IN_DEP_ORDER:
-        src_dir.chdir()
-        t = src_dir / dev_pkg.name
-
-        # Get code if the checkout isn't present already:
-        if not t.isdir() and dev_pkg.repo == 'git':
-            git_clone(dev_pkg.uri, dev_pkg.name)
-        elif not t.isdir() and dev_pkg.repo == 'hg':
-            hg_clone(dev_pkg.uri, dev_pkg.name)
-
-        # Change into the checkout dir and do the setup.py develop
-        # if there is a setup.py present.
-        #
-        t.chdir()
-
-        # Set up the
-        setup_py = t / 'setup.py'
-        if setup_py.isfile():
-            easy.info("Setting up '{0}': ".format(dev_pkg))
-            stdout = easy.sh("{python} setup.py develop {BASKET} ".format(
-                    python=python,
-                    BASKET=BASKET
-                ),
-                capture=True,
-            )
-            easy.info(stdout)
+    jobs = int(getattr(options, 'jobs', DEFAULT_JOBS))
+
+    # Get code for any checkouts that aren't present already:
+    src_dir = path(os.path.abspath(src_dir))
+    clone_all(options.DEV_PKGS_IN_DEP_ORDER, src_dir, jobs)
+
+    # Install third-party dependencies from wheels built once and cached,
+    # rather than resolving and building them again for every environment.
+    # Only the difference from what the environment already has is applied,
+    # worked out on the resolved closures so shared dependencies are kept.
+    if not getattr(options, 'no_wheels', False):
+        reqs = get_third_party_requirements(options.DEV_PKGS_IN_DEP_ORDER, src_dir)
+        state = EnvState(de.env_root)
+        wheelhouse = Wheelhouse()
+        wheels = wheelhouse.build(python, reqs) if reqs else []
+        if state.wheels is None:
+            # Recorded without its closure, so we can't tell what's safe to remove
+            to_install, to_remove = wheels, []
+        else:
+            to_install, to_remove = diff_wheels(state.wheels, wheels)
+        if to_remove:
+            easy.info("Removing %s" % ', '.join(to_remove))
+            run([python, '-m', 'pip', 'uninstall', '-y'] + to_remove)
+        if to_install:
+            easy.info("Installing %s" % ', '.join(get_wheel_name(i) for i in to_install))
+            wheelhouse.install_wheels(python, to_install)
+        else:
+            easy.info("Third-party requirements are up to date")
+        state.requirements = reqs
+        state.wheels = [os.path.basename(i) for i in wheels]
+        state.save()
+
+    # Do the setup.py develop in each checkout with a setup.py present, in
+    # dependency order, stopping at the first failure. These run one at a
+    # time: each develop rewrites easy-install.pth and may install shared
+    # dependencies into the environment, with no locking.
+    #
+    for dev_pkg in get_develop_order(options.DEV_PKGS_IN_DEP_ORDER, src_dir):
+        if not (src_dir / dev_pkg.name / 'setup.py').isfile():
+            continue
+        easy.info("-- {0} --".format(dev_pkg.name))
+        result = execute(Command([python, 'setup.py', 'develop'] + shlex.split(BASKET),
+                                 cwd=src_dir / dev_pkg.name))
+        easy.info(result.stdout)
+        if not result.ok:
+            easy.error(result.stderr)
+            raise easy.BuildFailure("setup.py develop failed for %s" % dev_pkg.name)
 
     # Add the hook to change into the source directory when workon is called.
     if env.is_wrappered:
@@ -0,0 +1,108 @@
+"""
+A shared local cache of repositories to clone checkouts from.
+
+Each upstream repository is mirrored once into the cache directory (bare for
+git, without a working copy for hg). Checkouts are then cloned from the
+local mirror, which hardlinks the history where the filesystem allows, and
+pointed back at the upstream url. Mirrors are brought up to date with a
+fetch/pull before each clone, so only new changesets are downloaded.
+
+The cache directory is ``$PKGLIB_REPO_CACHE``, defaulting to ``repos`` in
+the pkglib cache directory.
+"""
+import os
+import re
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from pp.pkglib.osutil import run, get_cache_dir
+
+CACHE_ENV = 'PKGLIB_REPO_CACHE'
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.repocache')
+
+
+def get_repo_cache_dir():
+    res = os.environ.get(CACHE_ENV)
+    if not res:
+        return get_cache_dir('repos')
+    if not os.path.isdir(res):
+        os.makedirs(res)
+    return res
+
+
+def get_mirror_path(repo, uri, cache_dir=None):
+    """ Returns where the mirror of `uri` lives in the cache
+    """
+    name = re.sub(r'[^\w.-]', '_', uri.rstrip('/').split('/')[-1]) or 'repo'
+    if name.endswith('.git'):
+        name = name[:-4]
+    digest = hashlib.sha1(uri).hexdigest()[:12]
+    return os.path.join(cache_dir or get_repo_cache_dir(), repo,
+                        '%s-%s%s' % (name, digest, '.git' if repo == 'git' else ''))
+
+
+def update_mirror(repo, uri, cache_dir=None):
+    """ Creates or updates the local mirror of a repository, returning its path.
+    """
+    mirror = get_mirror_path(repo, uri, cache_dir)
+    if os.path.isdir(mirror):
+        get_log().info("Updating cached %s" % uri)
+        if repo == 'git':
+            run(['git', '--git-dir', mirror, 'fetch', '--prune', 'origin'])
+        else:
+            run(['hg', 'pull', '-R', mirror, uri])
+        return mirror
+
+    get_log().info("Mirroring %s into %s" % (uri, mirror))
+    parent = os.path.dirname(mirror)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    # Build it to one side so a failed mirror doesn't leave a broken cache
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.mirror-')
+    try:
+        target = os.path.join(tmp, 'repo')
+        if repo == 'git':
+            run(['git', 'clone', '--mirror', uri, target])
+        else:
+            run(['hg', 'clone', '-U', uri, target])
+        try:
+            os.rename(target, mirror)
+        except OSError:
+            if not os.path.isdir(mirror):
+                raise
+            # Another process sharing the cache mirrored it first
+            get_log().info("Using the mirror of %s made meanwhile" % uri)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return mirror
+
+
+def clone(repo, uri, target, branch=None, cache_dir=None):
+    """ Clones `uri` into `target` by way of the local mirror cache.
+
+        Parameters
+        ----------
+        :param repo: `str`
+            Repository type, 'git' or 'hg'
+        :param branch: `str`
+            Branch to check out
+    """
+    mirror = update_mirror(repo, uri, cache_dir)
+    if repo == 'git':
+        cmd = ['git', 'clone']
+        if branch:
+            cmd += ['-b', branch]
+        run(cmd + [mirror, target])
+        run(['git', 'remote', 'set-url', 'origin', uri], cwd=target)
+    else:
+        cmd = ['hg', 'clone']
+        if branch:
+            cmd += ['-u', branch]
+        run(cmd + [mirror, target])
+        with open(os.path.join(target, '.hg', 'hgrc'), 'w') as fp:
+            fp.write('[paths]\ndefault = %s\n' % uri)
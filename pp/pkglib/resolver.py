@@ -0,0 +1,128 @@
+"""
+Memoized dependency resolution.
+
+Resolving the same requirement again for every package that depends on it
+is wasted work, so each requirement's resolved closure is remembered. The
+closures can also be saved to disk, keyed by a fingerprint of the installed
+distributions, so later runs in an unchanged environment don't resolve at
+all.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.resolver')
+
+
+def get_requires(dist):
+    if dist.has_metadata('requires.txt'):
+        return dist.get_metadata('requires.txt')
+    return ''
+
+
+def get_fingerprint(index):
+    """ Returns a fingerprint of the distributions in a `DistIndex`.
+        Source distributions' requirements change during development without
+        a version bump, so their requires.txt is included too.
+    """
+    lines = []
+    for dist in index:
+        line = '%s %s %s' % (dist.key, dist.version, dist.location)
+        if index.is_src(dist):
+            line += ' ' + hashlib.sha1(get_requires(dist)).hexdigest()
+        lines.append(line)
+    sha = hashlib.sha1()
+    for line in sorted(lines):
+        sha.update(line + '\n')
+    return sha.hexdigest()
+
+
+class Resolver(object):
+    """ Resolves requirements against the distributions in a `DistIndex`,
+        remembering the closure of each requirement.
+
+        Parameters
+        ----------
+        :param index: `pp.pkglib.distindex.DistIndex`
+            The environment to resolve against.
+        :param cache_dir: `str`
+            Directory to save resolved closures in. Nothing is saved if None.
+    """
+
+    def __init__(self, index, cache_dir=None):
+        self.index = index
+        self.lock = threading.Lock()
+        self.closures = {}
+        self.dirty = False
+        self._working_set = None
+        self.cache_file = None
+        if cache_dir:
+            self.cache_file = os.path.join(cache_dir, 'resolved-%s.json' %
+                                           get_fingerprint(index))
+            self.load()
+
+    @property
+    def working_set(self):
+        if self._working_set is None:
+            # Built from the already-scanned index rather than sys.path
+            import pkg_resources
+            ws = pkg_resources.WorkingSet([])
+            for dist in self.index:
+                ws.add(dist)
+            self._working_set = ws
+        return self._working_set
+
+    def load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as fp:
+                closures = json.load(fp)
+        except (IOError, ValueError), e:
+            get_log().warn("Ignoring unreadable resolver cache %s: %s" % (self.cache_file, e))
+            return
+        self.closures.update((str(k), frozenset(v)) for k, v in closures.items())
+        get_log().debug("Loaded %d resolved requirements from %s" %
+                        (len(closures), self.cache_file))
+
+    def save(self):
+        """ Writes the resolved closures to the cache file, if there is one
+            and anything new has been resolved.
+        """
+        if not self.cache_file or not self.dirty:
+            return
+        with self.lock:
+            data = dict((k, sorted(v)) for k, v in self.closures.items())
+            self.dirty = False
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.cache_file))
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.rename(tmp, self.cache_file)
+
+    def resolve_requirement(self, req):
+        """ Returns the set of distribution keys needed by a requirement,
+            including the requirement itself.
+        """
+        key = str(req)
+        with self.lock:
+            if key in self.closures:
+                return self.closures[key]
+            get_log().debug("Resolving %s" % key)
+            closure = frozenset(i.key for i in self.working_set.resolve([req]))
+            self.closures[key] = closure
+            self.dirty = True
+            return closure
+
+    def resolve(self, dists):
+        """ Returns a dict of key -> distribution for the given distributions
+            and everything they depend on.
+        """
+        keys = set()
+        for dist in dists:
+            keys.update(self.resolve_requirement(dist.as_requirement()))
+        return dict((i, self.index.by_key[i]) for i in keys)
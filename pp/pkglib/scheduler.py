@@ -0,0 +1,120 @@
+"""
+Runs work over a dependency graph on a bounded pool of worker threads.
+
+Nodes are started as soon as everything they depend on has finished, so
+independent branches of the graph proceed in parallel while the dependency
+order is still respected.
+"""
+import sys
+import Queue
+import logging
+import threading
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.scheduler')
+
+
+class CycleError(Exception):
+    """ Raised when a dependency graph cannot be ordered """
+    pass
+
+
+def _prune(nodes, deps):
+    """ Returns a dict of node -> set of dependencies, dropping any edges
+        pointing at nodes outside of the graph.
+    """
+    known = set(nodes)
+    return dict((n, set(d for d in deps.get(n, ()) if d in known and d != n))
+                for n in nodes)
+
+
+def dependency_levels(nodes, deps):
+    """ Groups nodes into levels, where every node only depends on nodes in
+        earlier levels. Ordering within a level follows the order of `nodes`.
+
+        Parameters
+        ----------
+        :param nodes: `list`
+            Nodes in the graph, in their preferred order.
+        :param deps: `dict`
+            Mapping of node to the nodes it depends on.
+    """
+    remaining = _prune(nodes, deps)
+    done = set()
+    levels = []
+    while remaining:
+        level = [n for n in nodes if n in remaining and remaining[n] <= done]
+        if not level:
+            raise CycleError("Dependency cycle between: %s" %
+                             ', '.join(str(n) for n in nodes if n in remaining))
+        levels.append(level)
+        done.update(level)
+        [remaining.pop(n) for n in level]
+    return levels
+
+
+def run_graph(nodes, deps, func, jobs=1, keep_going=False):
+    """ Calls ``func(node)`` for every node once all of its dependencies
+        have finished, running up to `jobs` calls at the same time.
+
+        A call fails by raising an exception. Unless `keep_going` is set,
+        the first failure stops any further nodes from being started; the
+        ones already running are allowed to finish.
+
+        Parameters
+        ----------
+        :param nodes: `list`
+            Nodes in the graph, in their preferred start order.
+        :param deps: `dict`
+            Mapping of node to the nodes it depends on.
+        :param func: `callable`
+            Called with each node from a worker thread.
+        :param jobs: `int`
+            Maximum number of concurrent calls.
+        :param keep_going: `bool`
+            Carry on starting nodes after a failure.
+
+        Returns
+        -------
+        A tuple of ``(results, failures)``: dicts of node to return value and
+        node to ``sys.exc_info()`` tuple respectively.
+    """
+    pending = _prune(nodes, deps)
+    dependency_levels(nodes, pending)
+    jobs = max(1, jobs or 1)
+    finished = Queue.Queue()
+    results, failures = {}, {}
+    done, running = set(), set()
+
+    def worker(node):
+        try:
+            finished.put((node, func(node), None))
+        except Exception:
+            finished.put((node, None, sys.exc_info()))
+
+    while pending or running:
+        if not failures or keep_going:
+            for node in nodes:
+                if len(running) >= jobs:
+                    break
+                if node in pending and pending[node] <= done:
+                    del pending[node]
+                    running.add(node)
+                    get_log().debug("Starting %s" % (node,))
+                    thread = threading.Thread(target=worker, args=(node,))
+                    thread.daemon = True
+                    thread.start()
+        elif not running:
+            break
+
+        # A timeout keeps the wait interruptible with Ctrl-C
+        node, result, exc_info = finished.get(True, 3600 * 24)
+        running.discard(node)
+        done.add(node)
+        if exc_info:
+            get_log().debug("Failed %s: %s" % (node, exc_info[1]))
+            failures[node] = exc_info
+        else:
+            results[node] = result
+    return results, failures
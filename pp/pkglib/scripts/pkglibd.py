@@ -0,0 +1,84 @@
+"""
+Client and server for the pkglib daemon; see `pp.pkglib.daemon`.
+
+    pkglibd serve                    Run the server in the foreground
+    pkglibd plan pp.foo [pp.bar ..]  Print the tagup plan (takes tagup's options)
+    pkglibd changed DIR [DIR ..]     Print the package dirs changed since release
+    pkglibd status                   Show what the server has cached
+    pkglibd stop                     Stop the server
+"""
+import sys
+import os
+import json
+import logging
+import argparse
+
+from pp.pkglib import daemon
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.scripts.pkglibd')
+
+
+def get_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description='Keep pkglib state warm between commands.')
+    parser.add_argument('--socket', metavar='PATH',
+                        help="The server's socket (default: $%s, or one in the pkglib "
+                             "cache for this environment)" % daemon.SOCKET_ENV)
+    parser.add_argument('--json', action='store_true',
+                        help="Print results as JSON")
+    parser.add_argument('command', choices=['serve', 'plan', 'changed', 'status', 'ping', 'stop'])
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help="Arguments for the command")
+    return parser.parse_args(argv)
+
+
+def print_plan(plan):
+    if not plan['targets']:
+        print "Nothing to tag"
+    for target in plan['targets']:
+        print "%s %s (then %s)" % (target['name'], target['version'], target['next_version'])
+        for req in target['requirements']:
+            print "|-- %s" % req
+    for name in plan['unchanged']:
+        print "%s unchanged" % name
+
+
+def print_result(args, result):
+    if args.json:
+        print json.dumps(result, indent=2, sort_keys=True)
+    elif args.command == 'plan':
+        print_plan(result)
+    elif args.command == 'changed':
+        for path in result:
+            print os.path.relpath(path)
+    elif isinstance(result, dict):
+        for key in sorted(result):
+            print "%s: %s" % (key, result[key])
+
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO)
+        try:
+            daemon.serve(args.socket)
+        except KeyboardInterrupt:
+            pass
+        except daemon.DaemonError, e:
+            get_log().critical(e.args[0])
+            sys.exit(1)
+        return
+    logging.basicConfig(level=logging.WARN)
+    try:
+        result = daemon.request(args.command, args.args, args.socket)
+    except daemon.DaemonError, e:
+        get_log().critical(e.args[0])
+        sys.exit(1)
+    print_result(args, result)
+
+
+if __name__ == '__main__':
+    main()
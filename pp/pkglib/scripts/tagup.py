@@ -4,19 +4,33 @@ import logging
 import ConfigParser
 import argparse     
 import shutil
-import pprint
-
-import pkg_resources
-
-from pp.pkglib.osutil import chdir, run
-from pp.pkglib.vcs import get_tags, get_revno, get_previous_revno
-from pp.pkglib.metadata import get_parser, get_version, Version, get_metadata
-
-PKG_REPO=os.environ['PKG_REPO']
-HG_ROOT=os.environ['HG_ROOT']
+import json
+import hashlib
+import subprocess
+
+from pp.pkglib.osutil import run, get_cache_dir
+from pp.pkglib import vcs, cmdserver
+from pp.pkglib.scheduler import run_graph
+from pp.pkglib.distindex import DistIndex, MissingDistributions
+from pp.pkglib.resolver import Resolver
+from pp.pkglib.upload import get_target, upload as upload_files
+from pp.pkglib.buildcache import BuildCache
+from pp.pkglib.builder import ForkBuilder, can_fork
+from pp.pkglib.journal import Journal
+from pp.pkglib import metadata, timing, changes
+from pp.pkglib.metadata import get_parser, get_version, Version, read_metadata
+
+# Where sdists are uploaded to, and the base url of the repositories. Taken
+# from the environment variables of the same name unless set here; see
+# get_setting()
+PKG_REPO = None
+HG_ROOT = None
 
 SOURCE_PACKAGE_PREFIXES = ['pp.']
 
+# Number of dists each tagup stage works on at the same time
+DEFAULT_JOBS = 4
+
 
 def get_log():
     return logging.getLogger('pp.pkglib.scripts.tagup')
@@ -31,6 +45,22 @@ class PackageError(UserError):
     pass
 
 
+class StageError(UserError):
+    """ One or more dists failed a tagup stage """
+    pass
+
+
+def get_setting(name):
+    """
+    Returns the value of ``PKG_REPO`` or ``HG_ROOT``, read when it's first
+    needed so that commands which don't use them work without them.
+    """
+    value = globals()[name] or os.environ.get(name)
+    if not value:
+        raise UserError("%s is not set in the environment" % name)
+    return value
+
+
 def next_version(version):
     """
       Returns the next version after this one
@@ -41,26 +71,48 @@ def next_version(version):
 
 
 def get_dist_name(pkg_dir):
-    with chdir(pkg_dir):
-        return get_metadata(get_parser())['name']
+    return read_metadata(pkg_dir)['name']
 
 # --------- Distutils ------------ # 
 
+_index = None
+_resolver = None
+
+
+def get_index():
+    """
+    Returns the index of distributions in this environment, building it on
+    first use.
+    """
+    global _index
+    if _index is None:
+        _index = DistIndex(prefixes=SOURCE_PACKAGE_PREFIXES)
+    return _index
+
+
 def get_dist(dist_name):
-    res = [i for i in pkg_resources.working_set if i.project_name == dist_name]
-    if not res:
-        raise PackageError("Distribution %s not installed" % dist_name)
-    return res[0]
+    try:
+        return get_index().get(dist_name)
+    except MissingDistributions, e:
+        raise PackageError(str(e))
+
+
+def get_dists(dist_names):
+    """
+    Returns the distributions for a list of names, reporting all the missing
+    ones at once.
+    """
+    try:
+        return get_index().get_many(dist_names)
+    except MissingDistributions, e:
+        raise PackageError(str(e))
 
 
 def is_third_party(dist):
     """
     True if this dist is 'third-party'. 
     """
-    for prefix in SOURCE_PACKAGE_PREFIXES:
-        if dist.project_name.startswith(prefix):
-            return False
-    return True
+    return get_index().is_third_party(dist)
 
 
 def is_src(dist):
@@ -68,164 +120,453 @@ def is_src(dist):
     True if this dist is a source package we could be tagging up within this environment.
     Dependant on specifying a common package prefix
     """
-    for prefix in SOURCE_PACKAGE_PREFIXES:
-        if dist.project_name.startswith(prefix) and not dist.location.endswith('.egg'):
-            return True
-    return False
+    return get_index().is_src(dist)
+
+
+def get_resolver(use_cache=True):
+    """
+    Returns the dependency resolver for this environment, creating it on
+    first use. With `use_cache` resolved dependencies are saved between runs.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver(get_index(), get_cache_dir('resolver') if use_cache else None)
+    return _resolver
 
 
 def resolve_dependencies(dists):
-    reqs = [i.as_requirement() for i in dists]
-    return dict([(i.key, i) for i in pkg_resources.WorkingSet().resolve(reqs)])
+    return get_resolver().resolve(dists)
 
 
 def get_vcs_url(dist):
     """
-    Return the VCS url for this dist.
+    Return the VCS url for this dist. Dists in a sub-directory of a
+    multi-package repository share the repository's url.
     """
-    # TODO: support multi-pkg repos
-    return '%s/%s' % (HG_ROOT, dist.project_name.replace('.','-'))
+    root = vcs.find_root(dist.location)
+    if os.path.normpath(root) != os.path.normpath(dist.location):
+        return '%s/%s' % (get_setting('HG_ROOT'), os.path.basename(root))
+    return '%s/%s' % (get_setting('HG_ROOT'), dist.project_name.replace('.','-'))
+
+
+def group_by_repo(dists):
+    """
+    Returns a dict of repository root -> the dists in that repository, for
+    working on each repository once however many packages it holds.
+    """
+    res = {}
+    for dist in dists:
+        res.setdefault(vcs.find_root(dist.location), []).append(dist)
+    return res
+
+
+def describe_versions(dists):
+    return 'version %s' % ', '.join(sorted(set(str(i.version) for i in dists)))
 
 
 # -------- Tagup Stages ----------- # 
 
 
-def verify(dist):
-    get_log().info("Verifying %s" % dist)
-    with chdir(dist.location):
-        diff = run(['hg','st'], capture = True)
-        if diff:
-            raise PackageError("Package %s has uncommitted changes at %s" % (dist.project_name, dist.location))
+def verify(root, dists):
+    """
+    Checks the repository at `root`, holding these dists, has no uncommitted
+    changes.
+    """
+    get_log().info("Verifying %s" % ', '.join(str(i) for i in dists))
+    diff = vcs.get_status(root)
+    if diff:
+        raise PackageError("Package %s has uncommitted changes at %s"
+                           % (', '.join(i.project_name for i in dists), root))
 
 
 def update(dist):
     get_log().info("Updating %s" % dist)
-    with chdir(dist.location):
-        run(['hg','pull', '-u'])
-        heads = run(['hg','heads', '--template','{node}-'],capture=True).split('-')[:-1]
-        if len(heads) > 1:
-            raise PackageError("Package %s has unmerged heads at %s" % (dist.project_name, dist.location))
+    run(['hg','pull', '-u'], cwd=dist.location)
+    heads = vcs.hg(['heads', '--template','{node}-'], dist.location).split('-')[:-1]
+    if len(heads) > 1:
+        raise PackageError("Package %s has unmerged heads at %s" % (dist.project_name, dist.location))
 
 
 def is_top_level(pkg):
-    with chdir(pkg):
-        parser = get_parser()
-        try:
-            if parser.get('tagup','top_level') == 'true':
-                return True
-        except (ConfigParser.NoSectionError, ConfigParser.NoOpotionError):
-            pass
+    parser = get_parser(pkg)
+    try:
+        if parser.get('tagup','top_level') == 'true':
+            return True
+    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+        pass
     return False
              
 
-def build_dist(dist):
-    get_log().info("Building %s" % dist)
-    with chdir(dist.location):    
-        run(['python','setup.py','egg_info','--tag-build=', 'sdist'])
+BUILD_CMD = ['python','setup.py','egg_info','--tag-build=', 'sdist']
 
 
-def should_tag(dist):
+def build_dist(dist, cache=None, builder=None):
+    """
+    Builds the sdist for this dist, or with a `BuildCache` reuses the one
+    stored for identical sources. Builds go through the `ForkBuilder` if
+    given, rather than a new python process.
+    """
+    sdist = get_sdist(dist)
+    if cache:
+        key = cache.get_key(dist.location, ' '.join(BUILD_CMD))
+        if cache.restore(key, sdist):
+            get_log().info("Sources unchanged, reusing cached build of %s" % dist)
+            return sdist
+    get_log().info("Building %s" % dist)
+    prefix = '[%s] ' % dist.project_name
+    if builder:
+        builder.check_run(dist.location, BUILD_CMD[2:], prefix)
+    else:
+        run(BUILD_CMD, cwd=dist.location, stream=True, prefix=prefix)
+    if not os.path.isfile(sdist):
+        raise PackageError("Building %s did not produce %s" % (dist, sdist))
+    if cache:
+        cache.store(key, sdist)
+    return sdist
+
+
+def should_tag(dist, state=None, changed=None):
+    """
+    Returns the version to tag this dist at, or False if it hasn't changed
+    since its last release. `state` is the dist's `vcs.RepoState`, queried
+    here if not given. `changed` is whether the dist's files have changed
+    since its last release, as found by `changes.get_changed_packages`;
+    if not given the revisions since its last release tag are checked.
+    """
     get_log().info("Checking if we should tag %s" % dist)
-    with chdir(dist.location):
-        # Using cfg version in case the env is out-of-date
-        version = get_version(get_parser())
-        releases = get_tags()
-        get_log().debug("This version: %s" % (version))
-        get_log().debug("Releases : %s" % (releases))
-        if version.vstring in releases.keys():
-            raise PackageError("Version %s has already been tagged" % version)
-
-        # Check if the second last revision number is in our releases
-        # Second last because creating the tag itself is one commit, and
-        # rolling over the version is another.
-
-        second_last_revno = get_previous_revno(get_previous_revno(get_revno()))
-        get_log().debug("Second-last revno: %s" % second_last_revno)
-        if second_last_revno in releases.values():
+    if state is None:
+        state = vcs.get_repo_state(dist.location)
+    # Using cfg version in case the env is out-of-date
+    version = get_version(get_parser(dist.location))
+    releases = vcs.get_package_tags(state.tags, get_tag_prefix(dist, state.root))
+    get_log().debug("This version: %s" % (version))
+    get_log().debug("Releases : %s" % (releases))
+    if version.vstring in releases:
+        raise PackageError("Version %s has already been tagged" % version)
+
+    if changed is not None:
+        if not changed:
             get_log().info("No changes since last release")
             return False
         return version
 
+    # Check if the revision before the tagup's own commits is in our
+    # releases. For hg that's the second last, because creating the tag
+    # itself is one commit and rolling over the version is another.
+    depth = state.release_depth
+    if len(state.ancestors) > depth:
+        released_revno = state.ancestors[depth]
+        get_log().debug("Revno before rollover: %s" % released_revno)
+        if released_revno in set(releases.values()):
+            get_log().info("No changes since last release")
+            return False
+    return version
+
+
+def get_pinned_requirements(dist, all_dists):
+    """
+    Returns the requirements of this dist with the versions of things we're
+    tagging as explicit pins. Third-party requirements are 'flattened' to
+    everything they depend on, so nothing shifts under our feet when we
+    install this later.
 
-def pin_requirements(dist, all_dists):
+    This only reads the (cached) setup.cfg; see `write_pinned_requirements`.
+    """
+    import pkg_resources
+    new_reqs = set()
+    for req in pkg_resources.parse_requirements(read_metadata(dist.location)['install_requires']):
+        if not req.key in all_dists:
+            raise PackageError("Dependency %s is not installed, cannot pin to version." % req.project_name)
+        req_dist = all_dists[req.key]
+        if is_third_party(req_dist):
+            # Flatten third-party requirement graphs.
+            [new_reqs.add(i.as_requirement()) for i in resolve_dependencies([req_dist]).values()]
+        else:
+            new_reqs.add(all_dists[req.key].as_requirement())
+    return new_reqs
+
+
+def write_pinned_requirements(dist, requirements):
     """
-    Override versions of things we're tagging to be explicit pins. 
-    This will 'flatten' the dependency graph for anything that is third-party so that nothing 
-    shifts under our feet when we install this later.
+    Writes pinned requirements into this dist's setup.cfg, saving the
+    original as setup.cfg.unpinned so we can go back to it.
+
+    Safe to run again after being interrupted, as on --resume: an existing
+    setup.cfg.unpinned is the original, and is kept.
     """
     get_log().info("Pinning requirements for %s" % dist)
+    setup_cfg = os.path.join(dist.location, 'setup.cfg')
+    parser = get_parser(dist.location, cached=False)
+    parser.set('metadata','install_requires',  '\n'.join(sorted(str(i) for i in requirements)))
+
+    # Save setup file away so we can go back to the un-pinned version, unless
+    # that's already been done and setup.cfg is pinned
+    if os.path.isfile(setup_cfg + '.unpinned'):
+        get_log().info("Keeping the existing %s.unpinned" % setup_cfg)
+    else:
+        shutil.copyfile(setup_cfg, setup_cfg + '.unpinned')
+
+    # Write out pinned requirements 
+    metadata.write_parser(parser, dist.location)
+
+
+class Plan(object):
+    """
+    What a tagup run will do: the dists to tag with the version each is
+    tagged at, their pinned requirements and the version they roll over to.
+
+    Attributes
+    ----------
+    targets : `dict`
+        Dist key -> `Version` to tag at, for the dists that changed
+    requirements : `dict`
+        Dist key -> set of pinned requirements
+    unchanged : `list`
+        Keys of source dists with no changes since their last release
+    all_deps : `dict`
+        Dist key -> dist for everything involved, with targets at their new
+        versions
+    """
+
+    def __init__(self, targets, requirements, unchanged, all_deps):
+        self.targets = targets
+        self.requirements = requirements
+        self.unchanged = unchanged
+        self.all_deps = all_deps
+
+    def to_dict(self):
+        return {
+            'targets': [{'name': self.all_deps[key].project_name,
+                         'location': self.all_deps[key].location,
+                         'version': self.targets[key].vstring,
+                         'next_version': next_version(self.targets[key]).vstring,
+                         'requirements': sorted(str(i) for i in self.requirements[key])}
+                        for key in sorted(self.targets)],
+            'unchanged': sorted(self.unchanged),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Returns the plan saved with `to_dict`
+        """
+        import pkg_resources
+        targets, requirements, all_deps = {}, {}, {}
+        for target in data['targets']:
+            dist = pkg_resources.Distribution(target['location'], project_name=target['name'],
+                                              version=target['version'])
+            all_deps[dist.key] = dist
+            targets[dist.key] = Version(target['version'])
+            requirements[dist.key] = set(pkg_resources.parse_requirements(target['requirements']))
+        return cls(targets, requirements, data['unchanged'], all_deps)
+
+    def write(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+        get_log().info("Wrote plan to %s" % filename)
+
+
+def make_plan(src_keys, all_deps, jobs=1):
+    """
+    Works out the tagup plan for these source dists without changing
+    anything on disk, from their cached setup.cfg and one batch of vcs
+    queries.
+
+    Parameters
+    ----------
+    :param src_keys: `list`
+        Keys of the source dists to consider for tagging
+    :param all_deps: `dict`
+        Dist key -> dist for the source dists and all their dependencies.
+        Not modified.
+    """
+    all_deps = dict(all_deps)
+    locations = [all_deps[key].location for key in src_keys]
+    with timing.span('repo_state', 'stage'):
+        states = vcs.get_repo_states(locations)
+    with timing.span('changes', 'stage'):
+        changed = changes.get_changed_packages(locations, states)
+    versions = run_stage('should_tag',
+                         lambda key: should_tag(all_deps[key], states[all_deps[key].location],
+                                                all_deps[key].location in changed),
+                         src_keys, jobs)
+    targets = {}
+    for key in src_keys:
+        version = versions[key]
+        if version:
+            targets[key] = version
+            # Set new version on our list of packages
+            all_deps[key] = all_deps[key].clone(version=version.vstring)
+    requirements = run_stage('plan_requirements',
+                             lambda key: get_pinned_requirements(all_deps[key], all_deps),
+                             targets, jobs)
+    return Plan(targets, requirements, [key for key in src_keys if key not in targets], all_deps)
 
-    with chdir(dist.location):
-        parser = get_parser()
-        cfg = get_metadata(parser)
-        new_reqs = set()
-        for req in pkg_resources.parse_requirements(cfg['install_requires']):
-            if not req.key in all_dists:
-                raise PackageError("Dependency %s is not installed, cannot pin to version." % req.project_name)
-            req_dist = all_dists[req.key]
-            if is_third_party(req_dist):
-                # Flatten third-party requirement graphs.
-                [new_reqs.add(i.as_requirement()) for i in resolve_dependencies([req_dist]).values()]
-            else:
-                new_reqs.add(all_dists[req.key].as_requirement())
-        
-        parser.set('metadata','install_requires',  '\n'.join(str(i) for i in new_reqs))
-
-        # Save setup file away so we can go back to the un-pinned version
-        shutil.copyfile('setup.cfg', 'setup.cfg.unpinned')
-
-        # Write out pinned requirements 
-        with open('setup.cfg', 'wb') as fp:
-            parser.write(fp)
-        return new_reqs
-
-
-def print_plan(plan, all_deps):
+
+def print_plan(plan):
     get_log().info(40 * '-')
     get_log().info("    Tagup Plan")
     get_log().info(40 * '-')
-    for key in plan:
-        get_log().info("    %s %s" % (key, all_deps[key].version))
-        for req in sorted(plan[key]):
+    for key in sorted(plan.targets):
+        get_log().info("    %s %s (then %s)" % (key, plan.targets[key],
+                                                next_version(plan.targets[key])))
+        for req in sorted(str(i) for i in plan.requirements[key]):
             get_log().info("    |-- %s" % (req))
         get_log().info(40 * '-')
 
 
-def tag(dist):
-    get_log().info("Tagging %s" % dist)
-    with chdir(dist.location):    
-        diff = run(['hg','st'], capture = True)
-        if 'setup.cfg' in diff:
-            get_log().info("Committing new setup.cfg") 
-            run(['hg','commit','-m','Pinning requirements for version %s' % dist.version])
-        run(['hg','tag', str(dist.version)])
+def get_tag_prefix(dist, root):
+    """
+    Returns what comes before the version in this dist's release tags; see
+    `vcs.get_tag_prefix`.
+    """
+    return vcs.get_tag_prefix(get_dist_name(dist.location), dist.location, root)
+
+
+def get_tag_name(dist, root):
+    return get_tag_prefix(dist, root) + str(dist.version)
+
+
+def has_changes(root):
+    """
+    True if any tracked files in the repository at `root` have changed.
+    """
+    return any(i.strip() and not i.startswith('?') for i in vcs.get_status(root).splitlines())
+
+
+def tag(root, dists):
+    """
+    Commits the pinned setup.cfg files of these dists, which share the
+    repository at `root`, and tags it once for each of them.
+
+    Safe to run again after being interrupted, as on --resume: tags that
+    already point at the pinned revision are left alone.
+    """
+    get_log().info("Tagging %s" % ', '.join(str(i) for i in dists))
+    diff = vcs.get_status(root)
+    if 'setup.cfg' in diff:
+        get_log().info("Committing new setup.cfg") 
+        vcs.commit('Pinning requirements for %s' % describe_versions(dists), root)
+    names = sorted(set(get_tag_name(i, root) for i in dists))
+    state = vcs.get_repo_state(root)
+    existing = [i for i in names if i in state.tags]
+    if existing:
+        # With hg the tags were committed on top of the pinned revision
+        depth = state.release_depth - 1
+        pinned = state.ancestors[depth] if len(state.ancestors) > depth else None
+        wrong = [i for i in existing if state.tags[i] != pinned]
+        if wrong:
+            raise PackageError("Already tagged at another revision: %s" % ', '.join(wrong))
+        get_log().info("Already tagged: %s" % ', '.join(existing))
+    missing = [i for i in names if i not in existing]
+    if missing:
+        vcs.tag(missing, root)
 
 
 def rollover(dist, version):
     get_log().info("Rolling over %s" % dist)
-    with chdir(dist.location):    
-        if os.path.isfile('setup.cfg.unpinned'):
-            get_log().info("Rolling back to unpinned setup.cfg")
-            shutil.move('setup.cfg.unpinned', 'setup.cfg')
-        new_version = next_version(version)
-        cfg = get_parser()
-        cfg.set('metadata','version',new_version.vstring)
-        with open('setup.cfg', 'wb') as fp:
-            cfg.write(fp)
-        get_log().info("New version is: %s" % new_version.vstring)
-
-
-def commit(dist):
-    get_log().info("Committing %s" % dist)
-    with chdir(dist.location):    
-        run(['hg','commit','-m','Tagged at version %s' % dist.version])
-
-
-def upload(dist):
-    get_log().info("Uploading %s" % dist)
-    with chdir(dist.location):    
-        cfg = get_parser()
-        run(['scp', 'dist/%s-%s.tar.gz' % (cfg.get('metadata','name'), dist.version), PKG_REPO])
+    setup_cfg = os.path.join(dist.location, 'setup.cfg')
+    if os.path.isfile(setup_cfg + '.unpinned'):
+        get_log().info("Rolling back to unpinned setup.cfg")
+        shutil.move(setup_cfg + '.unpinned', setup_cfg)
+    new_version = next_version(version)
+    cfg = get_parser(dist.location, cached=False)
+    cfg.set('metadata','version',new_version.vstring)
+    metadata.write_parser(cfg, dist.location)
+    get_log().info("New version is: %s" % new_version.vstring)
+
+
+def commit(root, dists):
+    get_log().info("Committing %s" % ', '.join(str(i) for i in dists))
+    if not has_changes(root):
+        # Committed before an interruption
+        get_log().info("Nothing to commit in %s" % root)
+        return
+    vcs.commit('Tagged at %s' % describe_versions(dists), root)
+
+
+def get_sdist(dist):
+    """
+    Returns the path to the sdist built for this dist.
+    """
+    name = read_metadata(dist.location)['name']
+    return os.path.join(dist.location, 'dist', '%s-%s.tar.gz' % (name, dist.version))
+
+
+def upload(dists, jobs=1):
+    """
+    Uploads the sdists for all these dists to the package repository in one
+    batch, skipping any that are already there.
+    """
+    get_log().info("Uploading %s" % ', '.join(str(i) for i in dists))
+    sdists = [get_sdist(i) for i in dists]
+    missing = [i for i in sdists if not os.path.isfile(i)]
+    if missing:
+        raise PackageError("Distribution files not found: %s" % ', '.join(missing))
+    target = get_target(get_setting('PKG_REPO'), jobs)
+    try:
+        return upload_files(sdists, target)
+    except subprocess.CalledProcessError, e:
+        cmd = ' '.join(e.cmd) if isinstance(e.cmd, (list, tuple)) else e.cmd
+        raise StageError("Stage 'upload' failed: %s exited with %d%s" %
+                         (cmd, e.returncode, ':\n' + e.output.strip() if e.output else ''))
+    except EnvironmentError, e:
+        raise StageError("Stage 'upload' failed: %s" % e)
+    finally:
+        target.close()
+
+
+def get_journal_path(dist_names):
+    """
+    Returns where the journal is kept for a tagup of these dists.
+    """
+    import pkg_resources
+    names = sorted(pkg_resources.safe_name(i).lower() for i in dist_names)
+    return os.path.join(get_cache_dir('tagup'),
+                        'journal-%s.json' % hashlib.sha1(' '.join(names)).hexdigest()[:12])
+
+
+def run_stage(name, func, items, jobs=1, journal=None, what='distributions'):
+    """
+    Runs one tagup stage, calling func(item) for every item with up to `jobs`
+    at the same time. Every item is run even if some fail; the failures are
+    then raised together as a StageError, so no later stage starts until
+    this one has succeeded for everything.
+
+    With a `Journal`, items it records as done for this stage are skipped
+    and each item is recorded as it succeeds.
+
+    `what` says what the items are, for messages.
+
+    Returns a dict of item -> result, for the items that were run.
+    """
+    items = list(items)
+    if journal:
+        done = [i for i in items if journal.is_done(name, i)]
+        if done:
+            get_log().info("Stage '%s' already done for %s" % (name, ', '.join(str(i) for i in done)))
+        items = [i for i in items if i not in done]
+
+    def run_item(item):
+        with timing.span('%s %s' % (name, item), 'dist', stage=name, item=item):
+            res = func(item)
+        if journal:
+            journal.mark_done(name, item)
+        return res
+
+    get_log().info("Stage '%s' for %d %s" % (name, len(items), what))
+    with timing.span(name, 'stage', count=len(items)):
+        results, failures = run_graph(items, {}, run_item, jobs=jobs, keep_going=True)
+    if failures:
+        msg = ["Stage '%s' failed for %d of %d %s:" % (name, len(failures), len(items), what)]
+        for item in items:
+            if item in failures:
+                exc = failures[item][1]
+                get_log().debug("%s failed" % item, exc_info=failures[item])
+                msg.append("  %s: %s" % (item, exc.args[0] if isinstance(exc, UserError) else
+                                         "%s: %s" % (exc.__class__.__name__, exc)))
+        raise StageError('\n'.join(msg))
+    return results
+
 
 # -------- Main Run -------- #
 
@@ -237,6 +578,35 @@ def get_args(argv=None):
 
     parser.add_argument('distributions', metavar='DISTRIBUTIONS', type=str, nargs='+',
                        help='Python distributions to tagup ')
+    parser.add_argument('--no-cmdserver', dest='cmdserver', action='store_false',
+                       help="Run each hg command as a new process instead of "
+                            "through a persistent hg command server")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                       help="Number of dists to work on at the same time in each "
+                            "stage (default: %(default)s)")
+    parser.add_argument('--fork-build', action='store_true',
+                       help="Build sdists in children forked from worker processes "
+                            "that have already imported setuptools, instead of "
+                            "starting python for each one")
+    parser.add_argument('--no-build-cache', dest='build_cache', action='store_false',
+                       help="Always build sdists, rather than reusing ones built "
+                            "from identical sources")
+    parser.add_argument('--no-resolve-cache', dest='resolve_cache', action='store_false',
+                       help="Don't use or save the cache of resolved dependencies")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                       help="Work out and print the plan without changing, building "
+                            "or uploading anything")
+    parser.add_argument('--plan', metavar='FILE',
+                       help="Write the plan to FILE as JSON")
+    parser.add_argument('--resume', action='store_true',
+                       help="Carry on from where an interrupted tagup of the same "
+                            "distributions stopped, skipping the work it finished")
+    parser.add_argument('--journal', metavar='FILE',
+                       help="Where to record progress for --resume (default: in the "
+                            "pkglib cache, named after the distributions)")
+    parser.add_argument('--profile', metavar='FILE',
+                       help="Time each stage, distribution and command, log a summary "
+                            "and write the timings to FILE in Chrome trace format")
 
     return parser.parse_args(argv)
 
@@ -244,66 +614,133 @@ def get_args(argv=None):
 def main(argv = None):
     logging.basicConfig(level=logging.INFO)
     args = get_args(argv)
+    vcs.use_cmdserver(args.cmdserver)
+    profiler = None
+    if args.profile:
+        profiler = timing.Profiler()
+        timing.set_profiler(profiler)
+    # Started first, so the workers don't inherit any hg command server pipes
+    builder = None
+    if args.fork_build and can_fork():
+        builder = ForkBuilder(args.jobs)
     try:
-        tagup(args)
+        tagup(args, builder)
     except UserError, e:
         get_log().critical(e.args[0])
         sys.exit(1)
+    finally:
+        if builder:
+            builder.close()
+        cmdserver.close_servers()
+        if profiler:
+            timing.set_profiler(None)
+            get_log().info("Timings:\n%s" % profiler.summary())
+            profiler.write_trace(args.profile)
 
 
-def tagup(args):
-    tagging_dists = [get_dist(i) for i in args.distributions] 
+def plan_tagup(args):
+    """
+    Resolves and verifies the dists to tag and returns the `Plan` for them.
+    """
+    tagging_dists = get_dists(args.distributions)
     get_log().info("Top-level Targets:")
     [get_log().info("  %r" % i) for i in tagging_dists]
 
     # Gather full list of dependencies for tagging targets
-    all_deps = resolve_dependencies(tagging_dists)
+    with timing.span('resolve', 'stage'):
+        get_resolver(args.resolve_cache)
+        all_deps = resolve_dependencies(tagging_dists)
+        get_resolver().save()
 
     #get_log().info("All dependencies:")
     #[get_log().info("  %r" % i) for i in all_deps.values()]
     
     tagging_dists = [i for i in all_deps.values() if is_src(i)]
 
-    # Verify
-    [verify(i) for i in tagging_dists]
+    src_keys = [i.key for i in tagging_dists]
+    jobs = args.jobs
+
+    # Verify, once for each repository
+    repos = group_by_repo(tagging_dists)
+    run_stage('verify', lambda root: verify(root, repos[root]), sorted(repos), jobs,
+              what='repositories')
 
     # Update
     # XXX 
-    #[update(i) for i in tagging_dists]
-
-    # Gather tagging targets.
-    tagging_targets = {}
-    for dist in tagging_dists:
-        version = should_tag(dist)
-        if version:
-            tagging_targets[dist.key] = version
-            # Set new version on our global list of packages
-            all_deps[dist.key]._version = version
+    #run_stage('update', lambda key: update(all_deps[key]), src_keys, jobs)
+
+    # Work out what to tag, and how
+    plan = make_plan(src_keys, all_deps, jobs)
+    get_resolver().save()
+    return plan
+
+
+def tagup(args, builder=None):
+    journal = Journal(args.journal or get_journal_path(args.distributions))
+    if args.resume:
+        if not journal.exists():
+            raise UserError("There is no interrupted tagup to resume at %s" % journal.path)
+        journal.load()
+        plan = Plan.from_dict(journal.plan)
+    else:
+        if journal.exists() and not args.dry_run:
+            raise UserError("A previous tagup of these distributions did not finish. "
+                            "Run again with --resume to complete it, or remove %s "
+                            "to start over." % journal.path)
+        plan = plan_tagup(args)
+        if args.plan:
+            plan.write(args.plan)
+
+    all_deps = plan.all_deps
+    tagging_targets = plan.targets
+    jobs = args.jobs
 
     if not tagging_targets:
         get_log().info("Nothing to tag")
         sys.exit(0)
 
-    # Pin package dependencies and gather tagging plan
-    plan = dict([(i.key, pin_requirements(i, all_deps)) for dist in tagging_targets.items()])
-
     # Print plan
-    print_plan(plan, all_deps)
+    print_plan(plan)
+    if args.dry_run:
+        get_log().info("Dry run, stopping here")
+        return plan
+    # Before anything is changed, rather than failing at the upload stage
+    get_setting('PKG_REPO')
+    if not args.resume:
+        journal.start(plan.to_dict())
+
+    # Pin package dependencies
+    run_stage('pin_requirements',
+              lambda key: write_pinned_requirements(all_deps[key], plan.requirements[key]),
+              tagging_targets, jobs, journal)
 
     # Build
-    [build_dist(i) for i in tagging_dists]
+    cache = BuildCache(get_cache_dir('sdists')) if args.build_cache else None
+    run_stage('build_dist', lambda key: build_dist(all_deps[key], cache, builder),
+              tagging_targets, jobs, journal)
 
-    # Create Tags
-    [tag(all_deps[key]) for key in tagging_targets]
+    # Create Tags, with one commit and one set of tags for each repository
+    repos = group_by_repo([all_deps[key] for key in tagging_targets])
+    run_stage('tag', lambda root: tag(root, repos[root]), sorted(repos), jobs, journal,
+              'repositories')
 
     # Rollover versions
-    [rollover(all_deps[key], version) for key, version in tagging_targets.items()]
+    run_stage('rollover', lambda key: rollover(all_deps[key], tagging_targets[key]),
+              tagging_targets, jobs, journal)
 
     # Upload
-    [upload(all_deps[key]) for key in tagging_targets]
+    with timing.span('upload', 'stage', count=len(tagging_targets)):
+        pending = [key for key in tagging_targets if not journal.is_done('upload', key)]
+        if pending:
+            upload([all_deps[key] for key in pending], jobs)
+        for key in pending:
+            journal.mark_done('upload', key)
 
     # Commit
-    [commit(all_deps[key]) for key in tagging_targets]
+    run_stage('commit', lambda root: commit(root, repos[root]), sorted(repos), jobs, journal,
+              'repositories')
+    journal.remove()
+    return plan
 
 if __name__ == '__main__':
     main()
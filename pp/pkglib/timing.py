@@ -0,0 +1,127 @@
+"""
+Timing instrumentation.
+
+Code marks interesting sections with `span`, which records nothing unless a
+`Profiler` has been installed with `set_profiler`. The profiler can then
+print a summary table of where the time went and write the spans out in
+Chrome's trace event format, for viewing in chrome://tracing or Perfetto.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import collections
+from contextlib import contextmanager
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.timing')
+
+
+Span = collections.namedtuple('Span', ['name', 'cat', 'start', 'duration', 'thread', 'args'])
+
+
+class Profiler(object):
+    """ Collects timed spans from any thread
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+        self.start = time.time()
+
+    def add(self, name, cat, start, duration, args):
+        with self.lock:
+            self.spans.append(Span(name, cat, start, duration,
+                                   threading.current_thread().ident, args))
+
+    def totals(self, cat, key=None):
+        """ Returns a list of ``(name, total seconds, count)`` for the spans
+            in a category, slowest first. Spans are grouped by name, or by
+            the given argument.
+        """
+        res = collections.defaultdict(lambda: [0.0, 0])
+        for span in self.spans:
+            if span.cat == cat:
+                group = res[span.args.get(key) if key else span.name]
+                group[0] += span.duration
+                group[1] += 1
+        return sorted(((k, v[0], v[1]) for k, v in res.items()), key=lambda i: -i[1])
+
+    def summary(self, top=10):
+        """ Returns a text table of the time spent in each stage, dist and
+            the slowest subprocesses.
+        """
+        lines = ['%-50s %10s %6s' % ('', 'seconds', 'count')]
+
+        def section(title, rows):
+            if rows:
+                lines.append('%s:' % title)
+                lines.extend('  %-48s %10.3f %6d' % (str(n)[:48], t, c) for n, t, c in rows)
+
+        wall = time.time() - self.start
+        section('Stages', self.totals('stage'))
+        section('Distributions', self.totals('dist', 'item')[:top])
+        section('Commands', [('all', sum(i[1] for i in self.totals('subprocess')),
+                              sum(i[2] for i in self.totals('subprocess')))])
+        slowest = sorted((i for i in self.spans if i.cat == 'subprocess'),
+                         key=lambda i: -i.duration)[:top]
+        section('Slowest commands', [('%s (%s)' % (i.name, i.args.get('cwd') or '.'), i.duration, 1)
+                                     for i in slowest])
+        lines.append('%-50s %10.3f' % ('Total', wall))
+        return '\n'.join(lines)
+
+    def trace(self):
+        """ Returns the spans as a Chrome trace event dict
+        """
+        pid = os.getpid()
+        events = [{'name': i.name, 'cat': i.cat, 'ph': 'X', 'pid': pid, 'tid': i.thread,
+                   'ts': int((i.start - self.start) * 1e6), 'dur': int(i.duration * 1e6),
+                   'args': dict((k, str(v)) for k, v in i.args.items())}
+                  for i in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.trace(), fp)
+        get_log().info("Wrote timings to %s" % filename)
+
+
+_profiler = None
+
+
+def set_profiler(profiler):
+    """ Installs the profiler that spans are recorded into, or None to stop
+        recording. Returns the previous one.
+    """
+    global _profiler
+    previous, _profiler = _profiler, profiler
+    return previous
+
+
+def get_profiler():
+    return _profiler
+
+
+@contextmanager
+def span(name, cat='', **args):
+    """ Context manager timing the code it wraps, if a profiler is installed
+
+        Parameters
+        ----------
+        :param name: `str`
+            What is being timed
+        :param cat: `str`
+            Category, eg. 'stage', 'dist' or 'subprocess'
+        :param args: Extra details to record with the span
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        profiler.add(name, cat, start, time.time() - start, args)
@@ -0,0 +1,160 @@
+"""
+Batched upload of built distributions to a package repository.
+
+Files whose checksum already matches the copy in the repository are
+skipped, so re-running an upload after a partial failure only sends what
+is missing. Remote repositories are reached over one shared ssh
+connection, with the files split across a few ``scp`` processes.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+
+from pp.pkglib.osutil import run, run_many, Command
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.upload')
+
+
+def md5sum(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class LocalTarget(object):
+    """ A package repository in a local (or mounted) directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def get_checksums(self, names):
+        """ Returns a dict of name -> md5 for the given file names that are
+            already in the repository.
+        """
+        res = {}
+        for name in names:
+            filename = os.path.join(self.path, name)
+            if os.path.isfile(filename):
+                res[name] = md5sum(filename)
+        return res
+
+    def put(self, filenames):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for filename in filenames:
+            # Copy then rename, so nobody sees a half-written file
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.upload-')
+            os.close(fd)
+            shutil.copyfile(filename, tmp)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, os.path.join(self.path, os.path.basename(filename)))
+
+    def close(self):
+        pass
+
+
+class SshTarget(object):
+    """ A package repository on a remote host, reached with ssh and scp over
+        one multiplexed connection.
+
+        Parameters
+        ----------
+        :param host: `str`
+            The ``[user@]host`` to connect to
+        :param path: `str`
+            Repository directory on the host
+        :param jobs: `int`
+            Number of scp processes to split the upload across
+    """
+
+    def __init__(self, host, path, jobs=4):
+        self.host = host
+        self.path = path or '.'
+        self.jobs = jobs
+        self.control_dir = tempfile.mkdtemp(prefix='pkglib-ssh-')
+        self.ssh_opts = ['-o', 'ControlMaster=auto',
+                         '-o', 'ControlPath=%s' % os.path.join(self.control_dir, 'master'),
+                         '-o', 'ControlPersist=60',
+                         '-o', 'BatchMode=yes']
+
+    def __str__(self):
+        return '%s:%s' % (self.host, self.path)
+
+    def get_checksums(self, names):
+        if not names:
+            return {}
+        # Also opens the master connection the uploads will share
+        # Remote commands start in the home directory
+        path = self.path[2:] if self.path.startswith('~/') else self.path
+        script = 'cd %s && md5sum -- %s 2>/dev/null; true' % (
+            quote(path), ' '.join(quote(i) for i in names))
+        out = run(['ssh'] + self.ssh_opts + [self.host, script], capture=True)
+        res = {}
+        for line in out.splitlines():
+            if line.strip():
+                checksum, name = line.split(None, 1)
+                res[name.lstrip('*')] = checksum
+        return res
+
+    def put(self, filenames):
+        jobs = max(1, min(self.jobs, len(filenames)))
+        batches = [filenames[i::jobs] for i in range(jobs)]
+        cmds = [Command(['scp', '-p', '-q'] + self.ssh_opts + batch + [str(self)])
+                for batch in batches if batch]
+        for result in run_many(cmds, jobs=jobs):
+            if not result.ok:
+                get_log().error("Upload failed: %s" % result.stderr.strip())
+            result.check()
+
+    def close(self):
+        if os.path.exists(os.path.join(self.control_dir, 'master')):
+            try:
+                run(['ssh', '-q'] + self.ssh_opts + ['-O', 'exit', self.host], capture=True)
+            except subprocess.CalledProcessError:
+                pass
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+
+def quote(arg):
+    """ Quotes an argument for a remote shell
+    """
+    return "'%s'" % arg.replace("'", "'\\''")
+
+
+def get_target(url, jobs=4):
+    """ Returns the upload target for a repository location: a local
+        directory or ``file://`` url, or an scp-style ``[user@]host:path``.
+    """
+    if url.startswith('file://'):
+        return LocalTarget(url[len('file://'):])
+    if ':' not in url or '/' in url.split(':', 1)[0]:
+        return LocalTarget(url)
+    host, path = url.split(':', 1)
+    return SshTarget(host, path, jobs)
+
+
+def upload(filenames, target):
+    """ Uploads files to a target, skipping any that are already there with
+        the same checksum. Returns the list of files sent.
+    """
+    names = [os.path.basename(i) for i in filenames]
+    remote = target.get_checksums(names)
+    todo = [i for i in filenames if remote.get(os.path.basename(i)) != md5sum(i)]
+    skipped = len(filenames) - len(todo)
+    if skipped:
+        get_log().info("%d file(s) already uploaded to %s" % (skipped, target))
+    if todo:
+        get_log().info("Uploading %d file(s) to %s" % (len(todo), target))
+        target.put(todo)
+    return todo
@@ -0,0 +1,161 @@
+"""
+Version control operations for the repositories packages live in.
+
+Each kind of repository has a `Backend`, picked by the metadata directory
+found at its root. The functions here look up the backend for a path and
+pass the call on, so callers don't need to know which VCS a package uses.
+"""
+import os
+import threading
+
+from pp.pkglib.vcs.base import Backend, RepoState, RE_VERSION, NULL_REVNO
+from pp.pkglib.vcs.base import get_tag_prefix, get_package_tags
+from pp.pkglib.vcs import base
+from pp.pkglib.vcs.hgbackend import HgBackend, hg, use_cmdserver
+from pp.pkglib.vcs.gitbackend import GitBackend
+
+# Backends in the order their markers are looked for at each level
+BACKENDS = [HgBackend, GitBackend]
+
+
+class StateCache(object):
+    """ Cache of `RepoState` objects, keyed by repository root and depth.
+
+        Each entry remembers the backend's state stamp, and the state is only
+        queried again once that changes. Safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, backend, depth):
+        stamp = backend.get_state_stamp()
+        with self.lock:
+            entry = self.entries.get((backend.root, depth))
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        state = backend.get_repo_state(depth)
+        with self.lock:
+            self.entries[(backend.root, depth)] = (stamp, state)
+        return state
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# Set by cache_states(), for long-running processes
+_state_cache = None
+
+
+def cache_states(enabled=True):
+    """ Turns caching of repository states on or off. Only worthwhile in a
+        long-running process; see `StateCache`.
+    """
+    global _state_cache
+    _state_cache = StateCache() if enabled else None
+
+
+def find_root(path=None):
+    """ Returns the root of the repository containing `path`, defaulting
+        to the cwd.
+    """
+    return base.find_root(path, [i.marker for i in BACKENDS])[0]
+
+
+def get_backend(path=None):
+    """ Returns the `Backend` for the repository containing `path`,
+        defaulting to the cwd. Paths outside any repository get the hg
+        backend, whose commands will then fail as hg would.
+    """
+    root, marker = base.find_root(path, [i.marker for i in BACKENDS])
+    for backend in BACKENDS:
+        if backend.marker == marker:
+            return backend(root)
+    return HgBackend(root)
+
+
+def get_tags(path=None):
+    """ Returns a dict of release tag -> revision for the cwd
+    """
+    return get_backend(path).get_tags()
+
+
+def get_revno(path=None):
+    """ Returns the revision number of the cwd
+    """
+    return get_backend(path).get_revno()
+
+
+def get_previous_revno(revno, path=None):
+    """ Retuns the revision number before this one, used
+        for detecting similar tags.
+    """
+    return get_backend(path).get_previous_revno(revno)
+
+
+def get_files(path=None):
+    """ Returns the absolute paths of the files tracked under `path`,
+        defaulting to the cwd.
+    """
+    path = os.path.abspath(path or os.getcwd())
+    backend = get_backend(path)
+    res = []
+    for name in backend.get_files():
+        filename = os.path.join(backend.root, name)
+        if filename.startswith(os.path.join(path, '')):
+            res.append(filename)
+    return res
+
+
+def get_status(path=None):
+    """ Returns the changed and unknown files in the cwd, as listed by
+        ``hg st`` or ``git status``
+    """
+    return get_backend(path).get_status()
+
+
+def commit(message, path=None):
+    """ Commits all outstanding changes in the cwd
+    """
+    return get_backend(path).commit(message)
+
+
+def tag(names, path=None):
+    """ Tags the working revision of the cwd with a name, or a list of names
+    """
+    if isinstance(names, basestring):
+        names = [names]
+    return get_backend(path).tag(names)
+
+
+def get_repo_state(path=None, depth=2):
+    """ Returns a `RepoState` for the repository at `path`, defaulting to the
+        cwd, in as few calls as the backend can manage.
+
+        Parameters
+        ----------
+        :param depth: `int`
+            How many ancestors of the working revision to include.
+    """
+    backend = get_backend(path)
+    cache = _state_cache
+    if cache is not None:
+        return cache.get(backend, depth)
+    return backend.get_repo_state(depth)
+
+
+def get_repo_states(paths, depth=2):
+    """ Returns a dict of path -> `RepoState` for a batch of paths, querying
+        each distinct repository once.
+    """
+    by_root = {}
+    for path in paths:
+        by_root.setdefault(find_root(path), []).append(path)
+    res = {}
+    for root, root_paths in by_root.items():
+        state = get_repo_state(root, depth)
+        for path in root_paths:
+            res[path] = state
+    return res
@@ -0,0 +1,179 @@
+import os
+import re
+import collections
+
+RE_VERSION = re.compile(r'\d+\.\d+\.\d+')
+# A bare version, or ``<name>-<version>`` for packages sharing a repository
+RE_RELEASE_TAG = re.compile(r'(.+-)?\d+\.\d+\.\d+')
+NULL_REVNO = '000000000000'
+
+# Revision ids are shortened to this many characters
+SHORT_ID = 12
+
+
+class RepoState(collections.namedtuple('RepoState', ['root', 'revno', 'ancestors', 'tags',
+                                                     'release_depth'])):
+    """ Working revision of a repository, the first-parent chain of revisions
+        leading to it (starting with the working revision) and its release
+        tags.
+
+        `release_depth` is how far back from the working revision the
+        released revision sits straight after a tagup: 2 for hg, where the
+        tag itself is a commit before the version rollover, or 1 for git.
+    """
+
+    def __new__(cls, root, revno, ancestors, tags, release_depth=2):
+        return super(RepoState, cls).__new__(cls, root, revno, ancestors, tags, release_depth)
+
+
+def is_release_tag(name):
+    return RE_RELEASE_TAG.match(name) is not None
+
+
+def get_tag_prefix(name, pkg_dir, root):
+    """ Returns what comes before the version in a package's release tags:
+        nothing for a package at the root of its repository, or ``<name>-``
+        for one in a subdirectory, so packages sharing a repository each
+        have their own tags.
+
+        Parameters
+        ----------
+        :param name: `str`
+            The package name from its setup.cfg
+        :param pkg_dir: `str`
+            The package directory
+        :param root: `str`
+            Root of the repository it's in
+    """
+    if os.path.normpath(pkg_dir) == os.path.normpath(root):
+        return ''
+    return name + '-'
+
+
+def get_package_tags(tags, prefix):
+    """ Returns a dict of version -> revision for the release tags, from
+        a dict of tag -> revision, that start with `prefix`, as returned by
+        `get_tag_prefix`.
+    """
+    res = {}
+    for tag, rev in tags.items():
+        if tag.startswith(prefix) and RE_VERSION.match(tag[len(prefix):]):
+            res[tag[len(prefix):]] = rev
+    return res
+
+
+class Backend(object):
+    """ Version control operations on one repository
+
+        Parameters
+        ----------
+        :param root: `str`
+            Root directory of the repository
+    """
+    # Name of the metadata directory that marks a repository's root
+    marker = None
+    # See `RepoState.release_depth`
+    release_depth = 2
+
+    def __init__(self, root):
+        self.root = root
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.root)
+
+    def get_tags(self):
+        """ Returns a dict of release tag -> short revision id
+        """
+        raise NotImplementedError
+
+    def get_revno(self):
+        """ Returns the short id of the working revision
+        """
+        raise NotImplementedError
+
+    def get_previous_revno(self, revno):
+        """ Returns the short id of the first parent of a revision
+        """
+        raise NotImplementedError
+
+    def get_ancestors(self, depth):
+        """ Returns the short ids of the working revision and up to `depth`
+            of its first-parent ancestors, newest first.
+        """
+        raise NotImplementedError
+
+    def get_files(self):
+        """ Returns the paths of the tracked files, relative to the root
+        """
+        raise NotImplementedError
+
+    def get_changed_files(self, rev):
+        """ Returns a dict of path, relative to the root -> status letter
+            ('M'odified, 'A'dded, 'R'emoved) for the tracked files that
+            differ between revision `rev` and the working copy.
+        """
+        raise NotImplementedError
+
+    def cat(self, rev, paths):
+        """ Returns a dict of path -> contents at revision `rev` for paths
+            relative to the root, with None for those that didn't exist.
+        """
+        raise NotImplementedError
+
+    def get_status(self):
+        """ Returns the status output listing changed and unknown files, which
+            is empty when the working copy is clean.
+        """
+        raise NotImplementedError
+
+    def commit(self, message):
+        """ Commits all outstanding changes to tracked files
+        """
+        raise NotImplementedError
+
+    def tag(self, names):
+        """ Tags the working revision with each of a list of names
+        """
+        raise NotImplementedError
+
+    # Files, relative to the root, whose changes can change the `RepoState`
+    state_files = []
+
+    def get_state_stamp(self):
+        """ Returns something that changes whenever the `RepoState` might,
+            from the mtimes and sizes of the `state_files`.
+        """
+        return tuple(get_file_stamp(os.path.join(self.root, i)) for i in self.state_files)
+
+    def get_repo_state(self, depth=2):
+        """ Returns a `RepoState`. Backends override this when they can do it
+            in fewer calls.
+        """
+        ancestors = self.get_ancestors(depth)
+        return RepoState(self.root, ancestors[0] if ancestors else NULL_REVNO, ancestors,
+                         self.get_tags(), self.release_depth)
+
+
+def get_file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def find_root(path, markers):
+    """ Returns a tuple of ``(root, marker)`` for the innermost directory
+        containing `path` that has one of the `markers` in it, or
+        ``(path, None)`` if there isn't one.
+    """
+    path = os.path.abspath(path or os.getcwd())
+    here = path
+    while True:
+        for marker in markers:
+            if os.path.exists(os.path.join(here, marker)):
+                return here, marker
+        parent = os.path.dirname(here)
+        if parent == here:
+            return path, None
+        here = parent
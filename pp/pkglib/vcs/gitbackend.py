@@ -0,0 +1,310 @@
+"""
+Git backend.
+
+Tags and the working revision are read straight from the refs and
+``packed-refs`` files in the git directory, rather than by starting a git
+process. Annotated tags are peeled to the commit they point at using the
+peeled entries in ``packed-refs`` or by reading the tag objects; only tags
+stored as deltas in a pack need a (single, batched) ``git rev-parse``.
+Everything else runs git.
+"""
+import os
+import glob
+import zlib
+import struct
+import logging
+import binascii
+
+from pp.pkglib.osutil import run
+from pp.pkglib.vcs.base import Backend, NULL_REVNO, SHORT_ID, is_release_tag, get_file_stamp
+
+TAGS = 'refs/tags/'
+
+# Object types in pack files
+PACK_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.vcs')
+
+
+def get_git_dir(root):
+    """ Returns the git directory of the working tree at `root`, following
+        ``gitdir:`` files as used by worktrees and submodules.
+    """
+    path = os.path.join(root, '.git')
+    if os.path.isfile(path):
+        with open(path) as fp:
+            line = fp.read().strip()
+        if line.startswith('gitdir:'):
+            path = os.path.normpath(os.path.join(root, line[len('gitdir:'):].strip()))
+    return path
+
+
+def get_common_dir(git_dir):
+    """ Returns the directory holding the refs and objects shared by all
+        worktrees.
+    """
+    commondir = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir):
+        with open(commondir) as fp:
+            return os.path.normpath(os.path.join(git_dir, fp.read().strip()))
+    return git_dir
+
+
+def read_packed_refs(common_dir):
+    """ Returns a tuple of dicts ``(refs, peeled)``: ref name -> id for every
+        packed ref, and ref name -> commit id for the annotated tags git has
+        peeled. If the file says it is fully peeled, tags missing from
+        `peeled` are known to be lightweight and are added to it as-is.
+    """
+    refs, peeled = {}, {}
+    fully_peeled = False
+    last = None
+    try:
+        fp = open(os.path.join(common_dir, 'packed-refs'))
+    except IOError:
+        return refs, peeled
+    with fp:
+        for line in fp:
+            line = line.strip()
+            if line.startswith('#'):
+                traits = line.split(':', 1)[-1].split()
+                fully_peeled = 'fully-peeled' in traits or 'peeled' in traits
+            elif line.startswith('^'):
+                peeled[last] = line[1:]
+            elif line:
+                sha, last = line.split(' ', 1)
+                refs[last] = sha
+    if fully_peeled:
+        for name, sha in refs.items():
+            if name.startswith(TAGS):
+                peeled.setdefault(name, sha)
+    return refs, peeled
+
+
+def find_in_pack_index(filename, sha):
+    """ Returns the offset of an object in the pack for this (version 2)
+        pack index, or None if it isn't there.
+    """
+    binary = binascii.unhexlify(sha)
+    with open(filename, 'rb') as fp:
+        if fp.read(8) != '\377tOc\0\0\0\2':
+            return None
+        fanout = struct.unpack('>256I', fp.read(1024))
+        count = fanout[255]
+        lo = fanout[ord(binary[0]) - 1] if binary[0] != '\0' else 0
+        hi = fanout[ord(binary[0])]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            fp.seek(1032 + mid * 20)
+            name = fp.read(20)
+            if name == binary:
+                break
+            elif name < binary:
+                lo = mid + 1
+            else:
+                hi = mid
+        else:
+            return None
+        fp.seek(1032 + count * 24 + mid * 4)
+        offset = struct.unpack('>I', fp.read(4))[0]
+        if offset & 0x80000000:
+            fp.seek(1032 + count * 28 + (offset & 0x7fffffff) * 8)
+            offset = struct.unpack('>Q', fp.read(8))[0]
+        return offset
+
+
+def read_packed_object_header(common_dir, sha):
+    """ Returns the type and the start of the content of a packed object, or
+        None if it can't be found or is stored as a delta.
+    """
+    for idx in glob.glob(os.path.join(common_dir, 'objects', 'pack', 'pack-*.idx')):
+        offset = find_in_pack_index(idx, sha)
+        if offset is None:
+            continue
+        with open(idx[:-len('.idx')] + '.pack', 'rb') as fp:
+            fp.seek(offset)
+            c = ord(fp.read(1))
+            kind = PACK_TYPES.get((c >> 4) & 7)
+            while c & 0x80:
+                c = ord(fp.read(1))
+            if kind is None:
+                return None
+            try:
+                return kind, zlib.decompressobj().decompress(fp.read(4096))
+            except zlib.error:
+                return None
+    return None
+
+
+def read_object_header(common_dir, sha):
+    """ Returns the type and the start of the content of an object, or None
+        if it can't be read without git.
+    """
+    path = os.path.join(common_dir, 'objects', sha[:2], sha[2:])
+    try:
+        with open(path, 'rb') as fp:
+            data = zlib.decompressobj().decompress(fp.read(4096))
+    except IOError:
+        return read_packed_object_header(common_dir, sha)
+    except zlib.error:
+        return None
+    header, _, content = data.partition('\0')
+    return header.split(' ')[0], content
+
+
+class GitBackend(Backend):
+    """ A git working tree
+    """
+    marker = '.git'
+    # Tags aren't commits, so the released revision is right before the
+    # version rollover
+    release_depth = 1
+
+    def __init__(self, root):
+        super(GitBackend, self).__init__(root)
+        self.git_dir = get_git_dir(root)
+        self.common_dir = get_common_dir(self.git_dir)
+
+    def get_state_stamp(self):
+        """ Stamps HEAD, the branch it's on, packed-refs and the tags
+        """
+        files = [os.path.join(self.git_dir, 'HEAD'),
+                 os.path.join(self.common_dir, 'packed-refs'),
+                 os.path.join(self.common_dir, TAGS)]
+        head = self.read_loose_ref('HEAD') or ''
+        if head.startswith('ref:'):
+            files.append(os.path.join(self.common_dir, head[len('ref:'):].strip()))
+        return tuple(get_file_stamp(i) for i in files)
+
+    def git(self, args):
+        return run(['git'] + args, capture=True, cwd=self.root)
+
+    def read_loose_ref(self, name):
+        # HEAD and other pseudo-refs are per-worktree, refs/ are shared
+        base = self.common_dir if name.startswith('refs/') else self.git_dir
+        try:
+            with open(os.path.join(base, name)) as fp:
+                return fp.read().strip()
+        except IOError:
+            return None
+
+    def resolve_ref(self, name, packed=None):
+        """ Returns the id a ref points at, following symbolic refs, or None
+            if it doesn't exist (eg. HEAD on a new branch).
+        """
+        for _ in range(10):
+            value = self.read_loose_ref(name)
+            if value is None:
+                if packed is None:
+                    packed = read_packed_refs(self.common_dir)
+                value = packed[0].get(name)
+            if value is None or not value.startswith('ref:'):
+                return value
+            name = value[len('ref:'):].strip()
+        return None
+
+    def peel(self, sha):
+        """ Returns the commit a tag object points at, `sha` itself if it
+            isn't a tag, or None if the object can't be read directly.
+        """
+        for _ in range(10):
+            obj = read_object_header(self.common_dir, sha)
+            if obj is None:
+                return None
+            kind, content = obj
+            if kind != 'tag':
+                return sha
+            sha = content.split('\n', 1)[0].split(' ')[1]
+        return None
+
+    def get_tag_refs(self):
+        """ Returns a dict of release tag -> full commit id
+        """
+        refs, peeled = read_packed_refs(self.common_dir)
+        ids, res = {}, {}
+        for name, sha in refs.items():
+            if name.startswith(TAGS):
+                ids[name[len(TAGS):]] = sha
+                if name in peeled:
+                    res[name[len(TAGS):]] = peeled[name]
+        tags_dir = os.path.join(self.common_dir, TAGS)
+        for dirpath, _, filenames in os.walk(tags_dir):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), tags_dir)
+                name = name.replace(os.sep, '/')
+                with open(os.path.join(dirpath, filename)) as fp:
+                    ids[name] = fp.read().strip()
+                # A loose ref overrides a packed one
+                res.pop(name, None)
+
+        unpeeled = []
+        for name, sha in ids.items():
+            if not is_release_tag(name) or name in res:
+                continue
+            commit = self.peel(sha)
+            if commit is None:
+                unpeeled.append(name)
+            else:
+                res[name] = commit
+        if unpeeled:
+            out = self.git(['rev-parse'] + ['%s%s^{commit}' % (TAGS, i) for i in unpeeled])
+            res.update(zip(unpeeled, out.split()))
+        return dict((k, v) for k, v in res.items() if is_release_tag(k))
+
+    def get_tags(self):
+        return dict((k, v[:SHORT_ID]) for k, v in self.get_tag_refs().items())
+
+    def get_revno(self):
+        sha = self.resolve_ref('HEAD')
+        return sha[:SHORT_ID] if sha else NULL_REVNO
+
+    def get_previous_revno(self, revno):
+        return self.git(['rev-parse', '--short=%d' % SHORT_ID, revno + '^']).strip()
+
+    def get_ancestors(self, depth):
+        if self.resolve_ref('HEAD') is None:
+            return []
+        out = self.git(['rev-list', '--first-parent', '--max-count=%d' % (depth + 1), 'HEAD'])
+        return [i[:SHORT_ID] for i in out.split()]
+
+    def get_files(self):
+        return [i for i in self.git(['ls-files', '-z']).split('\0') if i]
+
+    def get_changed_files(self, rev):
+        res = {}
+        for line in self.git(['diff', '--name-status', '--no-renames', rev]).splitlines():
+            if line.strip():
+                status, path = line.split('\t', 1)
+                res[path] = 'R' if status == 'D' else status[0]
+        return res
+
+    def cat(self, rev, paths):
+        """ Fetches all the files with one ``git cat-file --batch``
+        """
+        out = run(['git', 'cat-file', '--batch'], capture=True, cwd=self.root,
+                  input=''.join('%s:%s\n' % (rev, i) for i in paths))
+        res = {}
+        pos = 0
+        for path in paths:
+            end = out.index('\n', pos)
+            header = out[pos:end].split()
+            pos = end + 1
+            if header[-1] == 'missing':
+                res[path] = None
+            else:
+                size = int(header[2])
+                res[path] = out[pos:pos + size]
+                pos += size + 1
+        return res
+
+    def get_status(self):
+        return self.git(['status', '--porcelain'])
+
+    def commit(self, message):
+        return self.git(['commit', '-a', '-m', message])
+
+    def tag(self, names):
+        for name in names:
+            self.git(['tag', name])
@@ -0,0 +1,163 @@
+"""
+Mercurial backend.
+
+Commands go through a per-repository command server when it's turned on
+with `use_cmdserver`, or run as ``hg`` subprocesses otherwise.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+
+from pp.pkglib.osutil import run, get_span_name
+from pp.pkglib.timing import span
+from pp.pkglib import cmdserver
+from pp.pkglib.vcs.base import Backend, RepoState, NULL_REVNO, is_release_tag, find_root
+
+# Send hg commands through a per-repository command server rather than
+# starting a new hg process each time. See use_cmdserver()
+_use_cmdserver = False
+_broken_servers = set()
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.vcs')
+
+
+def use_cmdserver(enabled=True):
+    """ Turns the hg command server backend on or off. When on, any
+        repository whose command server fails to start falls back to running
+        hg as a subprocess.
+    """
+    global _use_cmdserver
+    _use_cmdserver = enabled
+
+
+def hg(args, path=None):
+    """ Runs an hg command in the repository containing `path` (defaulting
+        to the cwd) and returns its stdout. It runs at the root of the
+        repository whether or not it goes through the command server, so
+        relative paths in the output are always relative to the root.
+
+        Parameters
+        ----------
+        :param args: `list`
+            The hg command line, without the leading ``hg``
+    """
+    path = path or os.getcwd()
+    root = find_root(path, ['.hg'])[0]
+    if _use_cmdserver and root not in _broken_servers:
+        get_log().debug('hg: %r in %s' % (args, root))
+        try:
+            with span(get_span_name(['hg'] + args), 'subprocess', cmd=['hg'] + args,
+                      cwd=root, cmdserver=True):
+                rc, out, err = cmdserver.get_server(root).runcommand(args)
+        except cmdserver.CommandServerError, e:
+            get_log().warn("%s, falling back to hg subprocesses" % e)
+            _broken_servers.add(root)
+        else:
+            if rc != 0:
+                get_log().error("Non-zero exit code for: %r" % args)
+                get_log().error("Stdout: %r" % out)
+                get_log().error("Stderr: %r" % err)
+                raise subprocess.CalledProcessError(rc, ['hg'] + args, out)
+            if err.strip():
+                get_log().warn("%s: %s" % (get_span_name(['hg'] + args), err.strip()))
+            return out
+    return run(['hg'] + args, capture=True, cwd=root)
+
+
+class HgBackend(Backend):
+    """ A Mercurial repository
+    """
+    marker = '.hg'
+    # Tagging commits .hgtags, so the released revision is the tag's parent
+    release_depth = 2
+    # The working revision, history and local tags
+    state_files = ['.hg/dirstate', '.hg/store/00changelog.i', '.hg/00changelog.i',
+                   '.hg/localtags']
+
+    def hg(self, args):
+        return hg(args, self.root)
+
+    def get_tags(self):
+        res = {}
+        for line in self.hg(['tags']).splitlines():
+            if not line.strip():
+                continue
+            tag, rev = line.split()
+            if tag == 'tip' or not is_release_tag(tag):
+                continue
+            res[tag] = rev.split(':')[1]
+        return res
+
+    def get_revno(self):
+        return self.hg(['id', '-i']).strip()
+
+    def get_previous_revno(self, revno):
+        return self.hg(['parents', '-r', revno, '--template', '{node}'])[:12].strip()
+
+    def get_ancestors(self, depth):
+        return self.get_repo_state(depth).ancestors
+
+    def get_files(self):
+        return self.hg(['manifest']).splitlines()
+
+    def get_changed_files(self, rev):
+        res = {}
+        for line in self.hg(['status', '--rev', rev, '-m', '-a', '-r', '-d']).splitlines():
+            if line.strip():
+                status, path = line.split(' ', 1)
+                res[path] = 'R' if status == '!' else status
+        return res
+
+    def cat(self, rev, paths):
+        """ Fetches all the files with one ``hg cat``
+        """
+        tmp = tempfile.mkdtemp(prefix='pkglib-cat-')
+        try:
+            try:
+                self.hg(['cat', '-r', rev, '-o', os.path.join(tmp, '%p')] + list(paths))
+            except subprocess.CalledProcessError:
+                # Some of them are missing; the rest have still been written
+                pass
+            res = {}
+            for path in paths:
+                filename = os.path.join(tmp, path)
+                res[path] = open(filename).read() if os.path.isfile(filename) else None
+            return res
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def get_status(self):
+        return self.hg(['st'])
+
+    def commit(self, message):
+        return self.hg(['commit', '-m', message])
+
+    def tag(self, names):
+        # All in one commit
+        return self.hg(['tag'] + list(names))
+
+    def get_repo_state(self, depth=2):
+        """ Returns a `RepoState` from a single ``hg log`` call
+        """
+        revset = ' + '.join(['.~%d' % i for i in range(depth + 1)] + ['tag()'])
+        out = self.hg(['log', '-r', revset, '--template',
+                       '{node|short} {p1node|short} {tags}\n'])
+        parents, tags = {}, {}
+        revno = None
+        for line in out.splitlines():
+            node, p1, names = (line.split(' ', 2) + [''])[:3]
+            revno = revno or node
+            parents[node] = p1
+            for name in names.split():
+                if name != 'tip' and is_release_tag(name):
+                    tags[name] = node
+        ancestors = []
+        node = revno
+        while node and node != NULL_REVNO and len(ancestors) <= depth:
+            ancestors.append(node)
+            node = parents.get(node)
+        return RepoState(self.root, revno, ancestors, tags, self.release_depth)
@@ -0,0 +1,138 @@
+"""
+A local cache of built wheels for third-party dependencies.
+
+Wheels for a set of requirements are built once with ``pip wheel``, which
+resolves the whole dependency closure, and stored in a directory keyed by
+the requirements and the target interpreter's ABI. Later installs of the
+same set go straight from that directory with ``--no-index --no-deps``, so
+nothing is resolved, downloaded or compiled again.
+
+The wheelhouse lives in ``$PKGLIB_WHEELHOUSE``, defaulting to ``wheels`` in
+the pkglib cache directory.
+"""
+import os
+import glob
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from pp.pkglib.osutil import run, get_cache_dir
+
+WHEELHOUSE_ENV = 'PKGLIB_WHEELHOUSE'
+
+# Written once a wheelhouse entry is complete
+MANIFEST = 'wheels.txt'
+
+ABI_SCRIPT = """\
+import sys, sysconfig, distutils.util
+impl = 'pp' if 'PyPy' in sys.version else 'cp'
+abi = sysconfig.get_config_var('SOABI') or \
+    '%s%d%d%s' % (impl, sys.version_info[0], sys.version_info[1],
+                  'mu' if sys.maxunicode > 0xffff else 'm')
+sys.stdout.write('%s%d%d-%s-%s' % (impl, sys.version_info[0], sys.version_info[1], abi,
+                                   distutils.util.get_platform().replace('-', '_')))
+"""
+
+
+def get_log():
+    return logging.getLogger('pp.pkglib.wheelhouse')
+
+
+def get_wheelhouse_dir():
+    res = os.environ.get(WHEELHOUSE_ENV)
+    if not res:
+        return get_cache_dir('wheels')
+    if not os.path.isdir(res):
+        os.makedirs(res)
+    return res
+
+
+def get_abi_tag(python):
+    """ Returns a tag describing the interpreter's version, ABI and platform,
+        eg. ``cp27-cp27mu-linux_x86_64``
+    """
+    return run([python, '-c', ABI_SCRIPT], capture=True).strip()
+
+
+def get_key(requirements, abi_tag):
+    """ Returns the wheelhouse key for a set of requirements on an interpreter
+    """
+    reqs = sorted(set(' '.join(str(i).split()) for i in requirements))
+    return hashlib.sha1('\n'.join([abi_tag] + reqs)).hexdigest()
+
+
+class Wheelhouse(object):
+    """ Wheels built for sets of requirements, stored as ``<key>/*.whl``
+
+        Parameters
+        ----------
+        :param path: `str`
+            The wheelhouse directory, defaulting to `get_wheelhouse_dir()`
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_wheelhouse_dir()
+
+    def get_wheels(self, key):
+        """ Returns the wheel files stored under `key`, or None if there
+            isn't a complete set.
+        """
+        manifest = os.path.join(self.path, key, MANIFEST)
+        if not os.path.isfile(manifest):
+            return None
+        with open(manifest) as fp:
+            return [os.path.join(self.path, key, i.strip()) for i in fp if i.strip()]
+
+    def build(self, python, requirements, abi_tag=None):
+        """ Builds wheels for the requirements and everything they depend
+            on, unless they're already in the wheelhouse. Returns the list of
+            wheel files.
+        """
+        key = get_key(requirements, abi_tag or get_abi_tag(python))
+        wheels = self.get_wheels(key)
+        if wheels is not None:
+            get_log().info("Using %d cached wheels from %s" % (len(wheels), self.path))
+            return wheels
+
+        get_log().info("Building wheels for %d requirement(s)" % len(requirements))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.build-')
+        try:
+            run([python, '-m', 'pip', 'wheel', '--wheel-dir', tmp] + list(requirements))
+            names = sorted(os.path.basename(i) for i in glob.glob(os.path.join(tmp, '*.whl')))
+            with open(os.path.join(tmp, MANIFEST), 'w') as fp:
+                fp.write(''.join('%s\n' % i for i in names))
+            target = os.path.join(self.path, key)
+            if os.path.isdir(target) and self.get_wheels(key) is None:
+                # An incomplete earlier attempt
+                shutil.rmtree(target)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                if self.get_wheels(key) is None:
+                    raise
+                # Another process sharing the wheelhouse built them first
+                get_log().info("Using the wheels built meanwhile in %s" % target)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return self.get_wheels(key)
+
+    def install(self, python, requirements, abi_tag=None):
+        """ Installs the requirements into the environment of `python` from
+            the wheelhouse, building the wheels first if needed.
+        """
+        if not requirements:
+            return []
+        wheels = self.build(python, requirements, abi_tag)
+        self.install_wheels(python, wheels)
+        return wheels
+
+    def install_wheels(self, python, wheels):
+        """ Installs wheel files returned by `build` into the environment of
+            `python`, without resolving anything.
+        """
+        if wheels:
+            get_log().info("Installing %d wheels" % len(wheels))
+            run([python, '-m', 'pip', 'install', '--no-index', '--no-deps'] + list(wheels))
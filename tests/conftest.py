@@ -0,0 +1,5 @@
+import os
+
+# Read by tagup when it needs them
+os.environ.setdefault('PKG_REPO', 'localhost:/tmp/pkg_repo')
+os.environ.setdefault('HG_ROOT', 'ssh://localhost/hg')
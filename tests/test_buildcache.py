@@ -0,0 +1,79 @@
+import os
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib.buildcache import BuildCache
+from pp.pkglib.scripts import tagup
+
+pytestmark = pytest.mark.skipif(not find_executable('hg'), reason='hg is not installed')
+
+SETUP_PY = """\
+import os
+if not os.path.isdir('dist'):
+    os.mkdir('dist')
+with open('dist/pp.foo-1.0.0.tar.gz', 'w') as fp:
+    fp.write(open('src.py').read())
+with open('builds.log', 'a') as fp:
+    fp.write('built\\n')
+"""
+
+
+class Dist(object):
+    project_name = key = 'pp.foo'
+    version = '1.0.0'
+
+    def __init__(self, location):
+        self.location = location
+
+    def __str__(self):
+        return self.project_name
+
+
+@pytest.fixture
+def pkg(tmpdir, monkeypatch):
+    monkeypatch.setenv('HGUSER', 'test <test@example.com>')
+    monkeypatch.setenv('HGRCPATH', '')
+    repo = tmpdir.mkdir('repo')
+    pkg = repo.mkdir('pp.foo')
+    pkg.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.0\n')
+    pkg.join('setup.py').write(SETUP_PY)
+    pkg.join('src.py').write('print "hello"\n')
+    repo.join('other.py').write('')
+    subprocess.check_call(['hg', 'init'], cwd=str(repo))
+    subprocess.check_call(['hg', 'commit', '-Aqm', 'init', '-X', 'pp.foo/builds.log'], cwd=str(repo))
+    return pkg
+
+
+def builds(pkg):
+    return len(pkg.join('builds.log').readlines()) if pkg.join('builds.log').check() else 0
+
+
+def test_key_depends_on_package_files(pkg, tmpdir):
+    cache = BuildCache(str(tmpdir.join('cache')))
+    key = cache.get_key(str(pkg))
+    assert cache.get_key(str(pkg)) == key
+    # Files outside the package don't matter
+    pkg.dirpath().join('other.py').write('changed')
+    assert cache.get_key(str(pkg)) == key
+    # Uncommitted setup.cfg changes, eg. pinned requirements, do
+    pkg.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.0\n'
+                                'install_requires = bar==1.0\n')
+    assert cache.get_key(str(pkg)) != key
+
+
+def test_build_dist_reuses_cached_sdist(pkg, tmpdir):
+    cache = BuildCache(str(tmpdir.join('cache')))
+    dist = Dist(str(pkg))
+    sdist = tagup.build_dist(dist, cache)
+    assert builds(pkg) == 1
+    os.remove(sdist)
+    assert tagup.build_dist(dist, cache) == sdist
+    assert builds(pkg) == 1
+    assert open(sdist).read() == 'print "hello"\n'
+
+    pkg.join('src.py').write('print "changed"\n')
+    tagup.build_dist(dist, cache)
+    assert builds(pkg) == 2
+    assert open(sdist).read() == 'print "changed"\n'
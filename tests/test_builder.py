@@ -0,0 +1,55 @@
+import os
+import subprocess
+
+import pytest
+
+from pp.pkglib.builder import ForkBuilder, can_fork
+
+pytestmark = pytest.mark.skipif(not can_fork(), reason='needs os.fork')
+
+SETUP_PY = """\
+import sys
+import setuptools
+print('args: %s' % ' '.join(sys.argv[1:]))
+# Package state must not leak between builds
+print('seen: %s' % getattr(setuptools, '_pkglib_test_seen', None))
+setuptools._pkglib_test_seen = True
+if 'fail' in sys.argv:
+    sys.exit('it broke')
+"""
+
+
+@pytest.fixture
+def builder():
+    builder = ForkBuilder(jobs=2)
+    yield builder
+    builder.close()
+
+
+@pytest.fixture
+def pkg(tmpdir):
+    tmpdir.join('setup.py').write(SETUP_PY)
+    return str(tmpdir)
+
+
+def test_run(builder, pkg):
+    for i in range(2):
+        rc, output = builder.run(pkg, ['sdist', '--formats=gztar'])
+        assert rc == 0
+        assert open(output).read().splitlines() == ['args: sdist --formats=gztar', 'seen: None']
+
+
+def test_check_run_failure(builder, pkg, caplog):
+    caplog.set_level('INFO')
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        builder.check_run(pkg, ['fail'], prefix='[pkg] ')
+    assert exc.value.returncode == 1
+    assert exc.value.output.splitlines()[-1] == 'it broke'
+    assert '[pkg] args: fail' in caplog.text
+
+
+def test_output_removed_on_close(pkg):
+    builder = ForkBuilder()
+    builder.check_run(pkg, [])
+    builder.close()
+    assert not os.path.exists(builder.output_dir)
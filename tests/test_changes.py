@@ -0,0 +1,112 @@
+import os
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import changes, vcs
+
+SETUP_CFG = '[metadata]\nname = %s\nversion = %s\ninstall_requires =\n    %s\n'
+
+
+def test_last_release():
+    tags = {'1.0.9': 'a', '1.0.10': 'b', '1.1.0': 'c'}
+    assert changes.get_last_release(tags, '1.0.11') == '1.0.10'
+    assert changes.get_last_release(tags, '1.1.0') == '1.0.10'
+    assert changes.get_last_release(tags, '1.0.0') is None
+
+
+class Repo(object):
+    """ A repository of two packages, pp.a and pp.b, released at 1.0.0 the way
+        tagup does it and rolled over to 1.0.1
+    """
+
+    def __init__(self, root, kind):
+        self.root = root
+        self.kind = kind
+        self.cmd([kind, 'init', '-q'] if kind == 'git' else [kind, 'init'])
+        for name, reqs in (('a', 'six'), ('b', 'pp.a')):
+            self.write(name, SETUP_CFG % ('pp.' + name, '1.0.0', reqs))
+            self.write(os.path.join(name, 'code.py'), 'x = 1\n')
+        self.commit('Initial', add=True)
+        # Pin, tag and roll over
+        self.write('a', SETUP_CFG % ('pp.a', '1.0.0', 'six==1.9'))
+        self.write('b', SETUP_CFG % ('pp.b', '1.0.0', 'pp.a==1.0.0'))
+        self.commit('Pinning requirements')
+        vcs.tag(['pp.a-1.0.0', 'pp.b-1.0.0'], root)
+        self.write('a', SETUP_CFG % ('pp.a', '1.0.1', 'six'))
+        self.write('b', SETUP_CFG % ('pp.b', '1.0.1', 'pp.a'))
+        self.commit('Rollover')
+        self.dirs = [os.path.join(root, 'a'), os.path.join(root, 'b')]
+
+    def cmd(self, args):
+        subprocess.check_call(args, cwd=self.root)
+
+    def write(self, path, text):
+        if not path.endswith('.py'):
+            path = os.path.join(path, 'setup.cfg')
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def commit(self, message, add=False):
+        if self.kind == 'git':
+            if add:
+                self.cmd(['git', 'add', '-A'])
+            self.cmd(['git', 'commit', '-q', '-a', '-m', message])
+        else:
+            self.cmd(['hg', 'commit', '-q', '-m', message] + (['-A'] if add else []))
+
+
+@pytest.fixture(params=['hg', 'git'])
+def repo(request, tmpdir, monkeypatch):
+    if not find_executable(request.param):
+        pytest.skip('%s is not installed' % request.param)
+    monkeypatch.setenv('HGUSER', 'test <test@example.com>')
+    monkeypatch.setenv('HGRCPATH', '')
+    for var in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+        monkeypatch.setenv(var + '_NAME', 'test')
+        monkeypatch.setenv(var + '_EMAIL', 'test@example.com')
+    return Repo(str(tmpdir), request.param)
+
+
+def test_unchanged_after_release(repo):
+    assert changes.get_changed_packages(repo.dirs) == set()
+
+
+def test_changed_file(repo):
+    repo.write(os.path.join('b', 'code.py'), 'x = 2\n')
+    assert changes.get_changed_packages(repo.dirs) == set([repo.dirs[1]])
+
+
+def test_changed_requirements(repo):
+    repo.write('a', SETUP_CFG % ('pp.a', '1.0.1', 'six>=1.10'))
+    repo.commit('Bump six')
+    assert changes.get_changed_packages(repo.dirs) == set([repo.dirs[0]])
+
+
+def test_version_only_change(repo):
+    repo.write('a', SETUP_CFG % ('pp.a', '1.0.2', 'six'))
+    assert changes.get_changed_packages(repo.dirs) == set()
+
+
+def test_never_released(repo):
+    repo.write('b', SETUP_CFG % ('pp.b', '0.9.0', 'pp.a'))
+    assert changes.get_changed_packages(repo.dirs) == set([repo.dirs[1]])
+
+
+def test_sibling_release(repo):
+    # pp.a changes and moves on to 1.0.3, then only pp.b is released at 1.0.1.
+    # That's below pp.a's version but after its change, and mustn't be
+    # taken for pp.a's last release
+    repo.write(os.path.join('a', 'code.py'), 'x = 2\n')
+    repo.write('a', SETUP_CFG % ('pp.a', '1.0.3', 'six'))
+    repo.commit('Change a')
+    repo.write('b', SETUP_CFG % ('pp.b', '1.0.1', 'pp.a==1.0.3'))
+    repo.commit('Pinning requirements')
+    vcs.tag('pp.b-1.0.1', repo.root)
+    repo.write('b', SETUP_CFG % ('pp.b', '1.0.2', 'pp.a'))
+    repo.commit('Rollover')
+    assert changes.get_changed_packages(repo.dirs) == set([repo.dirs[0]])
@@ -0,0 +1,99 @@
+import os
+import threading
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import daemon, vcs
+from pp.pkglib.vcs import hgbackend
+from pp.pkglib.vcs.hgbackend import HgBackend
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    # serve() turns these on for the whole process
+    monkeypatch.setattr(hgbackend, '_use_cmdserver', False)
+    monkeypatch.setattr(vcs, '_state_cache', None)
+    path = str(tmpdir.join('pkglibd.sock'))
+    thread = threading.Thread(target=daemon.serve, args=(path,))
+    thread.start()
+    for _ in range(500):
+        if daemon.is_running(path):
+            break
+    yield path
+    if daemon.is_running(path):
+        daemon.request('stop', path=path)
+    thread.join(10)
+    assert not os.path.exists(path)
+
+
+def test_no_server(tmpdir):
+    with pytest.raises(daemon.DaemonError):
+        daemon.request('ping', path=str(tmpdir.join('missing.sock')))
+    assert not daemon.is_running(str(tmpdir.join('missing.sock')))
+
+
+def test_requests(server):
+    assert daemon.request('ping', path=server)['pid'] == os.getpid()
+    assert daemon.request('changed', [], path=server) == []
+    with pytest.raises(daemon.DaemonError) as e:
+        daemon.request('frobnicate', path=server)
+    assert 'Unknown command' in str(e.value)
+    with pytest.raises(daemon.DaemonError):
+        daemon.request('plan', path=server)
+
+    # The index was built on startup, and isn't rebuilt while nothing changes
+    status = daemon.request('status', path=server)
+    assert status['index_builds'] == 1
+    assert status['distributions'] > 0
+
+    daemon.request('stop', path=server)
+
+
+def test_already_running(server):
+    with pytest.raises(daemon.DaemonError):
+        daemon.serve(server)
+
+
+def test_stale_socket(tmpdir, monkeypatch):
+    monkeypatch.setattr(hgbackend, '_use_cmdserver', False)
+    monkeypatch.setattr(vcs, '_state_cache', None)
+    path = str(tmpdir.join('pkglibd.sock'))
+    tmpdir.join('pkglibd.sock').write('')
+    thread = threading.Thread(target=daemon.serve, args=(path,))
+    thread.start()
+    for _ in range(500):
+        if daemon.is_running(path):
+            break
+    daemon.request('stop', path=path)
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+@pytest.mark.skipif(not find_executable('hg'), reason='hg is not installed')
+def test_state_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('HGUSER', 'test <test@example.com>')
+    monkeypatch.setenv('HGRCPATH', '')
+    monkeypatch.setattr(vcs, '_state_cache', None)
+    repo = str(tmpdir)
+    subprocess.check_call(['hg', 'init'], cwd=repo)
+    tmpdir.join('setup.cfg').write('[metadata]\nversion = 1.0.0\n')
+    subprocess.check_call(['hg', 'commit', '-q', '-A', '-m', 'Initial'], cwd=repo)
+
+    calls = []
+    get_repo_state = HgBackend.get_repo_state
+
+    def counting(self, depth=2):
+        calls.append(self.root)
+        return get_repo_state(self, depth)
+    monkeypatch.setattr(HgBackend, 'get_repo_state', counting)
+
+    vcs.cache_states(True)
+    state = vcs.get_repo_state(repo)
+    assert vcs.get_repo_state(repo) is state
+    assert len(calls) == 1
+
+    vcs.tag('1.0.0', repo)
+    assert vcs.get_repo_state(repo).tags.keys() == ['1.0.0']
+    assert len(calls) == 2
@@ -0,0 +1,41 @@
+import pytest
+from pkg_resources import Distribution
+
+from pp.pkglib.distindex import DistIndex, MissingDistributions
+
+
+@pytest.fixture
+def index():
+    return DistIndex([
+        Distribution('/src/pp-foo', project_name='pp.foo', version='1.0'),
+        Distribution('/site/pp.bar-1.0.egg', project_name='pp.bar', version='1.0'),
+        Distribution('/site', project_name='SQLAlchemy', version='0.7'),
+        Distribution('/other', project_name='SQLAlchemy', version='0.6'),
+    ])
+
+
+def test_lookup(index):
+    assert len(index) == 3
+    assert index.get('SQLAlchemy').version == '0.7'
+    assert index.get('sqlalchemy') is index.get('SQLAlchemy')
+    assert [i.project_name for i in index.get_many(['pp.foo', 'pp.bar'])] == ['pp.foo', 'pp.bar']
+
+
+def test_missing_names_reported_together(index):
+    with pytest.raises(MissingDistributions) as exc:
+        index.get_many(['pp.foo', 'pp.missing', 'nope'])
+    assert exc.value.names == ['pp.missing', 'nope']
+    assert 'pp.missing, nope' in str(exc.value)
+
+
+def test_classification(index):
+    assert index.is_src(index.get('pp.foo'))
+    assert not index.is_src(index.get('pp.bar'))
+    assert not index.is_third_party(index.get('pp.bar'))
+    assert index.is_third_party(index.get('SQLAlchemy'))
+
+
+def test_classification_of_unindexed_dist(index):
+    dist = Distribution('/src/pp-new', project_name='pp.new', version='1.0')
+    assert index.is_src(dist)
+    assert not index.is_third_party(dist)
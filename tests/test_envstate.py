@@ -0,0 +1,47 @@
+from pp.pkglib.envstate import EnvState, get_fingerprint, get_wheel_name, diff_wheels
+
+
+def test_fingerprint():
+    options = {'no_site_packages': True, 'packages_to_install': []}
+    assert get_fingerprint(options) == get_fingerprint(dict(options))
+    assert get_fingerprint(options) != get_fingerprint(dict(options, no_site_packages=False))
+
+
+def test_wheel_name():
+    assert get_wheel_name('/w/zope_interface-4.1.0-cp27-cp27mu-linux_x86_64.whl') == \
+        'zope-interface'
+    assert get_wheel_name('SQLAlchemy-0.8.0-cp27-none-any.whl') == 'sqlalchemy'
+
+
+def test_diff_wheels():
+    mock = 'mock-1.0-py2-none-any.whl'
+    six = 'six-1.9.0-py2.py3-none-any.whl'
+    # Dropping six as a requirement doesn't remove it while mock needs it
+    assert diff_wheels([mock, six], ['/w/' + mock, '/w/' + six]) == ([], [])
+    # Dropping mock removes the dependencies only it needed
+    assert diff_wheels([mock, six], []) == ([], ['mock', 'six'])
+    # Upgrades install the new wheel without removing the project
+    assert diff_wheels([six], ['/w/six-1.10.0-py2.py3-none-any.whl']) == \
+        (['/w/six-1.10.0-py2.py3-none-any.whl'], [])
+
+
+def test_state_round_trip(tmpdir):
+    state = EnvState(str(tmpdir))
+    assert state.fingerprint is None and state.requirements == [] and state.wheels == []
+    state.fingerprint = 'abc'
+    state.requirements = ['paver']
+    state.wheels = ['paver-1.0-py2-none-any.whl']
+    state.save()
+    state = EnvState(str(tmpdir))
+    assert (state.fingerprint, state.requirements, state.wheels) == \
+        ('abc', ['paver'], ['paver-1.0-py2-none-any.whl'])
+
+
+def test_state_without_wheels(tmpdir):
+    tmpdir.join('.pkglib-env.json').write('{"fingerprint": "abc", "requirements": ["paver"]}')
+    assert EnvState(str(tmpdir)).wheels is None
+
+
+def test_unreadable_state(tmpdir):
+    tmpdir.join('.pkglib-env.json').write('{not json')
+    assert EnvState(str(tmpdir)).fingerprint is None
@@ -1,3 +1,54 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds the cheap commands may take over starting the interpreter
+IMPORT_BUDGET = 0.3
+
+CHEAP_COMMANDS = [
+    ['-m', 'pp.pkglib.scripts.tagup', '--help'],
+    ['-m', 'pp.pkglib.scripts.pkglibd', '--help'],
+    ['-c', 'import pp.pkglib.daemon'],
+]
+
+
+def python(args):
+    """ Runs python with `args` and returns its stdout and the best time of
+        three runs, without the tagup settings in the environment.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('PKG_REPO', None)
+    env.pop('HG_ROOT', None)
+    best = None
+    for _ in range(3):
+        start = time.time()
+        out = subprocess.check_output([sys.executable] + args, cwd=ROOT, env=env)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best
+
+
 def test_import():
     import pp.pkglib
- 
+
+
+def test_no_pkg_resources():
+    check = 'import sys; print "pkg_resources" in sys.modules'
+    if python(['-c', check])[0].strip() == 'True':
+        pytest.skip("pkg_resources is imported at startup")
+    out = python(['-c', 'import pp.pkglib.scripts.tagup, pp.pkglib.scripts.pkglibd; ' + check])[0]
+    assert out.strip() == 'False'
+
+
+@pytest.mark.parametrize('args', CHEAP_COMMANDS)
+def test_import_budget(args):
+    baseline = python(['-c', 'pass'])[1]
+    elapsed = python(args)[1]
+    assert elapsed - baseline < IMPORT_BUDGET, \
+        "%s took %.3fs, %.3fs over the budget" % (' '.join(args), elapsed,
+                                                 elapsed - baseline - IMPORT_BUDGET)
@@ -0,0 +1,24 @@
+import json
+
+from pp.pkglib.journal import Journal
+
+
+def test_journal_round_trip(tmpdir):
+    path = str(tmpdir.join('tagup', 'journal.json'))
+    journal = Journal(path)
+    assert not journal.exists()
+    journal.start({'targets': ['pp.foo']})
+    journal.mark_done('tag', 'pp.foo')
+    assert journal.is_done('tag', 'pp.foo')
+    assert not journal.is_done('commit', 'pp.foo')
+
+    journal = Journal(path)
+    journal.load()
+    assert journal.plan == {'targets': ['pp.foo']}
+    assert journal.is_done('tag', 'pp.foo')
+    with open(path) as fp:
+        assert json.load(fp)['done'] == {'tag': ['pp.foo']}
+    assert tmpdir.join('tagup').listdir() == [tmpdir.join('tagup', 'journal.json')]
+
+    journal.remove()
+    assert not journal.exists()
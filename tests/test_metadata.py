@@ -0,0 +1,44 @@
+from pp.pkglib import metadata
+
+
+def write_cfg(tmpdir, version, extra=''):
+    tmpdir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = %s\n'
+                                   'install_requires =\n    bar\n    baz\n%s' % (version, extra))
+
+
+def test_parser_is_cached(tmpdir):
+    write_cfg(tmpdir, '1.0.0')
+    parser = metadata.get_parser(str(tmpdir))
+    assert metadata.get_parser(str(tmpdir)) is parser
+    assert metadata.get_version(parser).vstring == '1.0.0'
+
+
+def test_reparsed_when_file_changes(tmpdir):
+    write_cfg(tmpdir, '1.0.0')
+    assert metadata.read_metadata(str(tmpdir))['version'] == '1.0.0'
+    write_cfg(tmpdir, '1.0.1', extra='# changed\n')
+    assert metadata.read_metadata(str(tmpdir))['version'] == '1.0.1'
+
+
+def test_metadata(tmpdir):
+    write_cfg(tmpdir, '1.0.0')
+    res = metadata.read_metadata(str(tmpdir))
+    assert res['install_requires'] == ['bar', 'baz']
+    assert metadata.read_metadata(str(tmpdir)) is res
+
+
+def test_cwd_default(tmpdir):
+    write_cfg(tmpdir, '2.0.0')
+    with tmpdir.as_cwd():
+        assert metadata.read_metadata()['version'] == '2.0.0'
+
+
+def test_write_parser(tmpdir):
+    write_cfg(tmpdir, '1.0.0')
+    cached = metadata.get_parser(str(tmpdir))
+    parser = metadata.get_parser(str(tmpdir), cached=False)
+    assert parser is not cached
+    parser.set('metadata', 'version', '1.0.1')
+    metadata.write_parser(parser, str(tmpdir))
+    assert cached.get('metadata', 'version') == '1.0.0'
+    assert metadata.read_metadata(str(tmpdir))['version'] == '1.0.1'
@@ -0,0 +1,80 @@
+import sys
+import time
+import subprocess
+
+import pytest
+
+from pp.pkglib import osutil
+
+
+def py(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_cwd_and_env(tmpdir):
+    out = osutil.run(py('import os; print(os.getcwd()); print(os.environ["FOO"])'),
+                     capture=True, cwd=str(tmpdir), env={'FOO': 'bar'})
+    assert out.split() == [str(tmpdir), 'bar']
+
+
+def test_run_failure():
+    with pytest.raises(subprocess.CalledProcessError):
+        osutil.run(py('import sys; sys.exit(2)'))
+
+
+def test_run_many():
+    results = osutil.run_many([py('print(%d)' % i) for i in range(5)] +
+                              [osutil.Command(py('import sys; sys.stderr.write("err"); sys.exit(3)'))],
+                              jobs=3)
+    assert [i.stdout.strip() for i in results[:5]] == [str(i) for i in range(5)]
+    assert all(i.ok for i in results[:5])
+    failed = results[5]
+    assert (failed.returncode, failed.stderr, failed.ok) == (3, 'err', False)
+    with pytest.raises(subprocess.CalledProcessError):
+        failed.check()
+
+
+def test_run_many_is_concurrent():
+    start = time.time()
+    results = osutil.run_many([py('import time; time.sleep(0.5)')] * 4, jobs=4)
+    assert all(i.ok for i in results)
+    assert time.time() - start < 1.5
+
+
+def test_run_many_timeout():
+    result, = osutil.run_many([osutil.Command(py('import time; time.sleep(10)'), timeout=0.2)])
+    assert result.timed_out
+    assert not result.ok
+    assert result.duration < 5
+
+
+def test_run_captures_stderr(caplog):
+    with pytest.raises(subprocess.CalledProcessError):
+        osutil.run(py('import sys; sys.stderr.write("oops"); sys.exit(1)'), capture=True)
+    assert "Stderr: 'oops'" in caplog.text
+
+
+def test_run_logs_stderr_warnings(caplog):
+    assert osutil.run(py('import sys; sys.stderr.write("careful\\n"); print "ok"'),
+                      capture=True) == 'ok\n'
+    warnings = [i.getMessage() for i in caplog.records if i.levelname == 'WARNING']
+    assert len(warnings) == 1 and warnings[0].endswith(': careful')
+
+
+def test_iter_lines_streams():
+    lines = osutil.iter_lines(py('import sys, time\n'
+                                 'print("first"); sys.stdout.flush(); time.sleep(10)'))
+    start = time.time()
+    assert next(lines) == 'first'
+    assert time.time() - start < 5
+    lines.close()
+
+
+def test_run_stream_keeps_tail(caplog):
+    caplog.set_level('INFO')
+    code = 'import sys\nfor i in range(1000): print(i)\nsys.exit(4)'
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        osutil.run(py(code), stream=True, prefix='[pkg] ', tail=3)
+    assert exc.value.returncode == 4
+    assert exc.value.output == '997\n998\n999'
+    assert '[pkg] 500' in caplog.text
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('paver')
+
+from paver.path import path
+from paver.easy import BuildFailure
+
+from pp.pkglib import pavement
+from pp.pkglib.pavement import Dep
+
+
+def make_pkg(src_dir, dirname, name, requires=()):
+    pkg = src_dir.mkdir(dirname)
+    pkg.join('setup.cfg').write('[metadata]\nname = %s\nversion = 1.0\ninstall_requires =\n%s'
+                                % (name, ''.join('    %s\n' % i for i in requires)))
+    pkg.join('setup.py').write('')
+
+
+def test_develop_order(tmpdir):
+    make_pkg(tmpdir, 'pp-a', 'pp.a', ['SQLAlchemy'])
+    make_pkg(tmpdir, 'pp-b', 'pp.b', ['pp.a'])
+    make_pkg(tmpdir, 'pp-c', 'pp.c', ['pp.a'])
+    make_pkg(tmpdir, 'pp-d', 'pp.d', ['pp.b', 'pp.c'])
+    make_pkg(tmpdir, 'pp-e', 'pp.e')
+    deps = [Dep(i, 'hg', 'ssh://hg/' + i) for i in ['pp-d', 'pp-b', 'pp-a', 'pp-c', 'pp-e']]
+    order = pavement.get_develop_order(deps, path(str(tmpdir)))
+    assert [i.name for i in order] == ['pp-a', 'pp-e', 'pp-b', 'pp-c', 'pp-d']
+
+
+def test_develop_order_cycle(tmpdir):
+    make_pkg(tmpdir, 'pp-a', 'pp.a', ['pp.b'])
+    make_pkg(tmpdir, 'pp-b', 'pp.b', ['pp.a'])
+    deps = [Dep(i, 'hg', 'ssh://hg/' + i) for i in ['pp-a', 'pp-b']]
+    with pytest.raises(BuildFailure) as e:
+        pavement.get_develop_order(deps, path(str(tmpdir)))
+    assert 'pp.a, pp.b' in str(e.value)
+
+
+def test_clone_all_is_concurrent(tmpdir, monkeypatch):
+    tmpdir.mkdir('pp-present')
+    cloned = []
+    lock = threading.Lock()
+
+    def clone(dev_pkg, target):
+        time.sleep(0.3)
+        with lock:
+            cloned.append((dev_pkg.name, target))
+
+    monkeypatch.setattr(pavement, 'clone', clone)
+    src_dir = path(str(tmpdir))
+    deps = [Dep(i, 'git', 'file:///' + i) for i in ['pp-present', 'pp-a', 'pp-b', 'pp-c']]
+    start = time.time()
+    pavement.clone_all(deps, src_dir)
+    assert time.time() - start < 0.8
+    assert sorted(cloned) == [(i, src_dir / i) for i in ['pp-a', 'pp-b', 'pp-c']]
+
+
+def test_clone_all_failure(tmpdir, monkeypatch):
+    def clone(dev_pkg, target):
+        if dev_pkg.name == 'pp-b':
+            raise BuildFailure('no such repo')
+    monkeypatch.setattr(pavement, 'clone', clone)
+    with pytest.raises(BuildFailure):
+        pavement.clone_all([Dep('pp-a', 'hg', ''), Dep('pp-b', 'hg', '')], path(str(tmpdir)))
+
+
+def test_third_party_requirements(tmpdir):
+    make_pkg(tmpdir, 'pp-a', 'pp.a', ['SQLAlchemy>=0.7', 'paver'])
+    make_pkg(tmpdir, 'pp-b', 'pp.b', ['pp.a', 'paver'])
+    deps = [Dep(i, 'hg', '') for i in ['pp-a', 'pp-b', 'pp-missing']]
+    assert pavement.get_third_party_requirements(deps, path(str(tmpdir))) == \
+        ['SQLAlchemy>=0.7', 'paver']
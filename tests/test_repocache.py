@@ -0,0 +1,94 @@
+import os
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import repocache
+
+
+def git(*args, **kwargs):
+    return subprocess.check_output(('git',) + args, **kwargs).strip()
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for name, value in [('GIT_AUTHOR_NAME', 'test'), ('GIT_AUTHOR_EMAIL', 'test@example.com'),
+                        ('GIT_COMMITTER_NAME', 'test'), ('GIT_COMMITTER_EMAIL', 'test@example.com'),
+                        ('HGUSER', 'test <test@example.com>'), ('HGRCPATH', '')]:
+        monkeypatch.setenv(name, value)
+
+
+def commit(repo, repo_type, content):
+    with open(os.path.join(repo, 'file.txt'), 'w') as fp:
+        fp.write(content)
+    if repo_type == 'git':
+        git('add', '.', cwd=repo)
+        git('commit', '-qm', content, cwd=repo)
+    else:
+        subprocess.check_call(['hg', 'commit', '-Aqm', content], cwd=repo)
+
+
+@pytest.mark.skipif(not find_executable('git'), reason='git is not installed')
+def test_git_clone_through_cache(tmpdir, env):
+    upstream = str(tmpdir.mkdir('upstream'))
+    git('init', '-q', cwd=upstream)
+    commit(upstream, 'git', 'one')
+    git('checkout', '-qb', 'develop', cwd=upstream)
+    cache = str(tmpdir.join('cache'))
+    uri = 'file://' + upstream
+
+    first = str(tmpdir.join('first'))
+    repocache.clone('git', uri, first, branch='develop', cache_dir=cache)
+    assert open(os.path.join(first, 'file.txt')).read() == 'one'
+    assert git('remote', 'get-url', 'origin', cwd=first) == uri
+    assert git('rev-parse', '--abbrev-ref', 'HEAD', cwd=first) == 'develop'
+    mirror = repocache.get_mirror_path('git', uri, cache)
+    assert os.path.isdir(mirror)
+
+    # New changesets are fetched into the existing mirror
+    commit(upstream, 'git', 'two')
+    second = str(tmpdir.join('second'))
+    repocache.clone('git', uri, second, branch='develop', cache_dir=cache)
+    assert open(os.path.join(second, 'file.txt')).read() == 'two'
+    assert os.listdir(os.path.dirname(mirror)) == [os.path.basename(mirror)]
+
+
+@pytest.mark.skipif(not find_executable('hg'), reason='hg is not installed')
+def test_hg_clone_through_cache(tmpdir, env):
+    upstream = str(tmpdir.mkdir('upstream'))
+    subprocess.check_call(['hg', 'init', upstream])
+    commit(upstream, 'hg', 'one')
+    cache = str(tmpdir.join('cache'))
+
+    first = str(tmpdir.join('first'))
+    repocache.clone('hg', upstream, first, cache_dir=cache)
+    assert open(os.path.join(first, 'file.txt')).read() == 'one'
+    paths = subprocess.check_output(['hg', 'paths', 'default'], cwd=first).strip()
+    assert paths == upstream
+
+    commit(upstream, 'hg', 'two')
+    second = str(tmpdir.join('second'))
+    repocache.clone('hg', upstream, second, cache_dir=cache)
+    assert open(os.path.join(second, 'file.txt')).read() == 'two'
+
+
+def test_cache_dir_from_env(tmpdir, monkeypatch):
+    monkeypatch.setenv(repocache.CACHE_ENV, str(tmpdir.join('repos')))
+    path = repocache.get_mirror_path('git', 'ssh://git@example.com/pp/pp-foo.git')
+    assert path.startswith(str(tmpdir.join('repos', 'git', 'pp-foo-')))
+    assert path.endswith('.git')
+
+
+def test_mirror_made_meanwhile(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir)
+    uri = 'ssh://hg.example.com/pp-foo'
+    mirror = repocache.get_mirror_path('hg', uri, cache_dir)
+
+    def clone(cmd, **kwargs):
+        # Another process finishes its mirror while we clone ours
+        os.makedirs(os.path.join(mirror, '.hg'))
+        os.makedirs(os.path.join(cmd[-1], '.hg'))
+    monkeypatch.setattr(repocache, 'run', clone)
+    assert repocache.update_mirror('hg', uri, cache_dir) == mirror
+    assert [i.basename for i in tmpdir.join('hg').listdir()] == [os.path.basename(mirror)]
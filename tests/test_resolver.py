@@ -0,0 +1,64 @@
+import pkg_resources
+from pkg_resources import Distribution
+
+from pp.pkglib.distindex import DistIndex
+from pp.pkglib.resolver import Resolver, get_fingerprint
+
+
+def get_index():
+    # Resolve against a real dist and its real dependencies
+    return DistIndex(pkg_resources.working_set)
+
+
+def test_resolve_is_memoized(monkeypatch):
+    resolver = Resolver(get_index())
+    dist = resolver.index.get('pytest')
+    expected = set(i.key for i in pkg_resources.working_set.resolve([dist.as_requirement()]))
+    assert set(resolver.resolve([dist])) == expected
+
+    calls = []
+    resolve = resolver.working_set.resolve
+    monkeypatch.setattr(resolver.working_set, 'resolve', lambda reqs: calls.append(reqs) or resolve(reqs))
+    assert set(resolver.resolve([dist])) == expected
+    assert calls == []
+
+
+def test_disk_cache(tmpdir):
+    cache_dir = str(tmpdir)
+    resolver = Resolver(get_index(), cache_dir)
+    dist = resolver.index.get('pytest')
+    expected = resolver.resolve([dist])
+    resolver.save()
+    assert len(tmpdir.listdir()) == 1
+
+    resolver = Resolver(get_index(), cache_dir)
+    assert str(dist.as_requirement()) in resolver.closures
+    assert resolver.resolve([dist]) == expected
+    assert resolver._working_set is None
+
+
+def test_disk_cache_keyed_by_environment(tmpdir):
+    cache_dir = str(tmpdir)
+    resolver = Resolver(get_index(), cache_dir)
+    resolver.resolve([resolver.index.get('pytest')])
+    resolver.save()
+
+    dists = list(pkg_resources.working_set) + [Distribution('/x', project_name='pp.new', version='1.0')]
+    resolver = Resolver(DistIndex(dists), cache_dir)
+    assert resolver.closures == {}
+
+
+def test_fingerprint_source_requires(tmpdir):
+    # A develop-mode source dist, whose requirements change without a new version
+    egg_info = tmpdir.mkdir('pp.dev.egg-info')
+    egg_info.join('PKG-INFO').write('Metadata-Version: 1.0\nName: pp.dev\nVersion: 1.0\n')
+    egg_info.join('requires.txt').write('six>=1.0\n')
+
+    def fingerprint():
+        dists = list(pkg_resources.find_distributions(str(tmpdir), only=True))
+        assert [i.key for i in dists] == ['pp.dev']
+        return get_fingerprint(DistIndex(dists))
+    before = fingerprint()
+    assert fingerprint() == before
+    egg_info.join('requires.txt').write('six>=2.0\n')
+    assert fingerprint() != before
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from pp.pkglib.scheduler import dependency_levels, run_graph, CycleError
+
+
+def test_dependency_levels():
+    deps = {'c': ['a', 'b'], 'b': ['a'], 'd': ['x']}
+    assert dependency_levels(['a', 'b', 'c', 'd'], deps) == [['a', 'd'], ['b'], ['c']]
+
+
+def test_dependency_levels_cycle():
+    with pytest.raises(CycleError):
+        dependency_levels(['a', 'b'], {'a': ['b'], 'b': ['a']})
+
+
+def test_run_graph_respects_dependencies():
+    order = []
+    lock = threading.Lock()
+
+    def func(node):
+        time.sleep(0.01)
+        with lock:
+            order.append(node)
+        return node.upper()
+
+    results, failures = run_graph(['a', 'b', 'c'], {'c': ['a', 'b']}, func, jobs=3)
+    assert not failures
+    assert results == {'a': 'A', 'b': 'B', 'c': 'C'}
+    assert order[-1] == 'c'
+
+
+def test_run_graph_runs_in_parallel():
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def func(node):
+        with lock:
+            active.append(node)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(node)
+
+    run_graph(['a', 'b', 'c', 'd'], {}, func, jobs=2)
+    assert peak[0] == 2
+
+
+def fail_on_a(node):
+    if node == 'a':
+        raise ValueError(node)
+    return node
+
+
+def test_run_graph_stops_on_failure():
+    results, failures = run_graph(['a', 'b'], {'b': ['a']}, fail_on_a)
+    assert list(failures) == ['a']
+    assert results == {}
+
+
+def test_run_graph_keep_going():
+    results, failures = run_graph(['a', 'b'], {'b': ['a']}, fail_on_a, keep_going=True)
+    assert list(failures) == ['a']
+    assert results == {'b': 'b'}
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import vcs
+from pp.pkglib.vcs import RepoState
+from pp.pkglib.scripts import tagup
+
+
+class Dist(object):
+    def __init__(self, location, project_name='pp.foo'):
+        self.location = location
+        self.project_name = project_name
+        self.key = project_name.lower()
+
+
+@pytest.fixture
+def dist(tmpdir):
+    tmpdir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.3\n')
+    return Dist(str(tmpdir))
+
+
+def test_should_tag_new_version(dist):
+    state = RepoState(dist.location, 'c', ['c', 'b', 'a'], {'1.0.2': 'x'})
+    assert tagup.should_tag(dist, state).vstring == '1.0.3'
+
+
+def test_should_tag_no_changes(dist):
+    state = RepoState(dist.location, 'c', ['c', 'b', 'a'], {'1.0.2': 'a'})
+    assert tagup.should_tag(dist, state) is False
+
+
+def test_should_tag_already_tagged(dist):
+    state = RepoState(dist.location, 'c', ['c', 'b', 'a'], {'1.0.3': 'a'})
+    with pytest.raises(tagup.PackageError):
+        tagup.should_tag(dist, state)
+
+
+def test_should_tag_shared_repo(tmpdir):
+    # pp.bar's release of the same version in the repository doesn't count
+    pkg_dir = tmpdir.join('pp-foo')
+    pkg_dir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.3\n', ensure=True)
+    dist = Dist(str(pkg_dir))
+    state = RepoState(str(tmpdir), 'c', ['c', 'b', 'a'], {'pp.bar-1.0.3': 'a', '1.0.3': 'a'})
+    assert tagup.should_tag(dist, state).vstring == '1.0.3'
+    state = RepoState(str(tmpdir), 'c', ['c', 'b', 'a'], {'pp.foo-1.0.3': 'a'})
+    with pytest.raises(tagup.PackageError):
+        tagup.should_tag(dist, state)
+
+
+def test_tag_names(tmpdir, monkeypatch):
+    tags = []
+    monkeypatch.setattr(tagup.vcs, 'get_status', lambda root: '')
+    monkeypatch.setattr(tagup.vcs, 'tag', lambda names, root: tags.extend(names))
+    monkeypatch.setattr(tagup.vcs, 'get_repo_state',
+                        lambda root: RepoState(root, 'c', ['c', 'b'], {}))
+    dists = []
+    for name, location in [('pp.foo', 'pp-foo'), ('pp.bar', 'pp-bar'), ('pp.baz', '')]:
+        tmpdir.join(location, 'setup.cfg').write('[metadata]\nname = %s\nversion = 1.0.3\n'
+                                                 % name, ensure=True)
+        dist = Dist(str(tmpdir.join(location)), name)
+        dist.version = '1.0.3'
+        dists.append(dist)
+    tagup.tag(str(tmpdir), dists)
+    assert tags == ['1.0.3', 'pp.bar-1.0.3', 'pp.foo-1.0.3']
+
+
+def test_run_stage_results():
+    assert tagup.run_stage('double', lambda i: i * 2, [1, 2, 3], jobs=2) == {1: 2, 2: 4, 3: 6}
+
+
+def test_run_stage_collects_all_failures():
+    seen = []
+    lock = threading.Lock()
+
+    def func(item):
+        with lock:
+            seen.append(item)
+        if item != 'b':
+            raise tagup.PackageError("%s is broken" % item)
+
+    with pytest.raises(tagup.StageError) as exc:
+        tagup.run_stage('verify', func, ['a', 'b', 'c'], jobs=2)
+    assert sorted(seen) == ['a', 'b', 'c']
+    msg = str(exc.value)
+    assert "failed for 2 of 3" in msg
+    assert "a: a is broken" in msg and "c: c is broken" in msg
+
+
+@pytest.fixture
+def plan_dists(tmpdir, monkeypatch):
+    from pkg_resources import Distribution
+    from pp.pkglib.distindex import DistIndex
+    dists = []
+    for name, version, requires in [('pp.foo', '1.0.3', 'pp.bar'), ('pp.bar', '2.0.0', '')]:
+        path = tmpdir.join(name).ensure(dir=True)
+        path.join('setup.cfg').write('[metadata]\nname = %s\nversion = %s\n'
+                                     'install_requires =\n    %s\n' % (name, version, requires))
+        dists.append(Distribution(str(path), project_name=name, version='0.0.0'))
+    monkeypatch.setattr(tagup, '_index', DistIndex(dists))
+    states = {dists[0].location: RepoState(dists[0].location, 'c', ['c', 'b', 'a'], {}),
+              dists[1].location: RepoState(dists[1].location, 'c', ['c', 'b', 'a'],
+                                           {'1.9.0': 'a'})}
+    monkeypatch.setattr(tagup.vcs, 'get_repo_states', lambda paths: states)
+    monkeypatch.setattr(tagup.changes, 'get_changed_packages',
+                        lambda paths, states: set([dists[0].location]))
+    return dict((i.key, i) for i in dists)
+
+
+def test_make_plan_changes_nothing(plan_dists, tmpdir):
+    def snapshot():
+        return dict((str(i), i.read()) for i in tmpdir.visit() if i.check(file=1))
+    before = snapshot()
+    plan = tagup.make_plan(sorted(plan_dists), plan_dists, jobs=2)
+    assert snapshot() == before
+    assert plan_dists['pp.foo'].version == '0.0.0'
+
+    assert plan.unchanged == ['pp.bar']
+    assert plan.targets.keys() == ['pp.foo']
+    data = plan.to_dict()
+    assert data['unchanged'] == ['pp.bar']
+    assert [(i['name'], i['version'], i['next_version'], i['requirements'])
+            for i in data['targets']] == [('pp.foo', '1.0.3', '1.0.4', ['pp.bar==0.0.0'])]
+
+
+def test_write_pinned_requirements(plan_dists):
+    dist = plan_dists['pp.foo']
+    tagup.write_pinned_requirements(dist, tagup.get_pinned_requirements(dist, plan_dists))
+    assert tagup.read_metadata(dist.location)['install_requires'] == ['pp.bar==0.0.0']
+    assert os.path.isfile(os.path.join(dist.location, 'setup.cfg.unpinned'))
+
+
+def test_pin_again_then_rollover(plan_dists):
+    # As when resuming after being interrupted straight after pinning
+    dist = plan_dists['pp.foo']
+    requirements = tagup.get_pinned_requirements(dist, plan_dists)
+    tagup.write_pinned_requirements(dist, requirements)
+    tagup.write_pinned_requirements(dist, requirements)
+    tagup.rollover(dist, tagup.Version('1.0.3'))
+    cfg = tagup.read_metadata(dist.location)
+    assert (cfg['version'], cfg['install_requires']) == ('1.0.4', ['pp.bar'])
+    assert not os.path.exists(os.path.join(dist.location, 'setup.cfg.unpinned'))
+
+
+def test_run_stage_resumes_from_journal(tmpdir):
+    from pp.pkglib.journal import Journal
+    journal = Journal(str(tmpdir.join('journal.json')))
+    journal.start({})
+    journal.mark_done('tag', 'a')
+    seen = []
+    assert tagup.run_stage('tag', seen.append, ['a', 'b'], journal=journal) == {'b': None}
+    assert seen == ['b']
+    assert journal.is_done('tag', 'b')
+
+
+def test_plan_round_trip(plan_dists):
+    plan = tagup.make_plan(sorted(plan_dists), plan_dists)
+    copy = tagup.Plan.from_dict(json.loads(json.dumps(plan.to_dict())))
+    assert copy.to_dict() == plan.to_dict()
+    assert str(copy.all_deps['pp.foo'].version) == '1.0.3'
+
+
+def test_group_by_repo(tmpdir):
+    tmpdir.join('multi', '.hg').ensure(dir=True)
+    tmpdir.join('single', '.git').ensure(dir=True)
+    dists = [Dist(str(tmpdir.join('multi', 'pp-foo')), 'pp.foo'),
+             Dist(str(tmpdir.join('multi', 'pp-bar')), 'pp.bar'),
+             Dist(str(tmpdir.join('single')), 'pp.baz')]
+    repos = tagup.group_by_repo(dists)
+    assert repos == {str(tmpdir.join('multi')): dists[:2], str(tmpdir.join('single')): dists[2:]}
+    assert tagup.get_vcs_url(dists[0]) == 'ssh://localhost/hg/multi'
+    assert tagup.get_vcs_url(dists[2]) == 'ssh://localhost/hg/pp-baz'
+
+
+def test_get_setting(monkeypatch):
+    monkeypatch.delenv('PKG_REPO', raising=False)
+    with pytest.raises(tagup.UserError):
+        tagup.get_setting('PKG_REPO')
+    monkeypatch.setenv('PKG_REPO', 'localhost:/srv/pkgs')
+    assert tagup.get_setting('PKG_REPO') == 'localhost:/srv/pkgs'
+    monkeypatch.setattr(tagup, 'PKG_REPO', 'localhost:/override')
+    assert tagup.get_setting('PKG_REPO') == 'localhost:/override'
+
+
+@pytest.fixture(params=['hg', 'git'])
+def repo_dist(request, tmpdir, monkeypatch):
+    """ A dist at the root of a new repository, with setup.cfg pinned but
+        not yet committed
+    """
+    if not find_executable(request.param):
+        pytest.skip('%s is not installed' % request.param)
+    monkeypatch.setenv('HGUSER', 'test <test@example.com>')
+    monkeypatch.setenv('HGRCPATH', '')
+    for var in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+        monkeypatch.setenv(var + '_NAME', 'test')
+        monkeypatch.setenv(var + '_EMAIL', 'test@example.com')
+    root = str(tmpdir)
+    subprocess.check_call([request.param, 'init', '-q', root])
+    tmpdir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.3\n')
+    subprocess.check_call([request.param, 'add', 'setup.cfg'], cwd=root)
+    subprocess.check_call([request.param, 'commit', '-q', '-m', 'Initial'], cwd=root)
+    tmpdir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.3\n'
+                                   'install_requires = six==1.9\n')
+    dist = Dist(root)
+    dist.version = '1.0.3'
+    return dist
+
+
+def test_tag_and_commit_again(repo_dist):
+    # As when resuming after being interrupted straight after each stage
+    root = repo_dist.location
+    tagup.tag(root, [repo_dist])
+    tags = vcs.get_tags(root)
+    tagup.tag(root, [repo_dist])
+    assert vcs.get_tags(root) == tags
+    assert tags.keys() == ['1.0.3']
+
+    tagup.rollover(repo_dist, tagup.Version('1.0.3'))
+    tagup.commit(root, [repo_dist])
+    revno = vcs.get_revno(root)
+    tagup.commit(root, [repo_dist])
+    assert vcs.get_revno(root) == revno
+    assert not tagup.has_changes(root)
+
+
+def test_tag_elsewhere(repo_dist):
+    root = repo_dist.location
+    vcs.tag('1.0.3', root)
+    with pytest.raises(tagup.PackageError):
+        tagup.tag(root, [repo_dist])
+
+
+def test_upload_failure(tmpdir, monkeypatch):
+    class Target(object):
+        def close(self):
+            pass
+
+    def fail(sdists, target):
+        raise subprocess.CalledProcessError(1, ['scp', 'a.tar.gz', 'pkgs:/srv'],
+                                            'Permission denied\n')
+    tmpdir.join('setup.cfg').write('[metadata]\nname = pp.foo\nversion = 1.0.3\n')
+    tmpdir.join('dist', 'pp.foo-1.0.3.tar.gz').write('', ensure=True)
+    dist = Dist(str(tmpdir))
+    dist.version = '1.0.3'
+    monkeypatch.setattr(tagup, 'get_target', lambda url, jobs: Target())
+    monkeypatch.setattr(tagup, 'upload_files', fail)
+    with pytest.raises(tagup.StageError) as e:
+        tagup.upload([dist])
+    assert 'scp a.tar.gz pkgs:/srv exited with 1' in str(e.value)
+    assert 'Permission denied' in str(e.value)
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from pp.pkglib import timing
+from pp.pkglib.osutil import run, get_span_name
+
+
+@pytest.fixture
+def profiler():
+    profiler = timing.Profiler()
+    previous = timing.set_profiler(profiler)
+    yield profiler
+    timing.set_profiler(previous)
+
+
+def test_no_profiler_records_nothing():
+    assert timing.get_profiler() is None
+    with timing.span('nothing'):
+        pass
+
+
+def test_spans(profiler):
+    with timing.span('verify', 'stage'):
+        with timing.span('verify pp.foo', 'dist', item='pp.foo'):
+            pass
+        with timing.span('verify pp.bar', 'dist', item='pp.bar'):
+            pass
+    assert [i.name for i in profiler.spans] == ['verify pp.foo', 'verify pp.bar', 'verify']
+    assert [i[0] for i in profiler.totals('stage')] == ['verify']
+    assert sorted(i[0] for i in profiler.totals('dist', 'item')) == ['pp.bar', 'pp.foo']
+
+
+def test_span_recorded_on_error(profiler):
+    with pytest.raises(ValueError):
+        with timing.span('tag', 'stage'):
+            raise ValueError
+    assert [i.name for i in profiler.spans] == ['tag']
+
+
+def test_subprocesses(profiler, tmpdir):
+    run(['true'])
+    run(['echo', 'hi'], capture=True, cwd=str(tmpdir))
+    assert [(i.name, i.cat) for i in profiler.spans] == [('true', 'subprocess'),
+                                                         ('echo hi', 'subprocess')]
+    assert 'Slowest commands' in profiler.summary()
+
+
+def test_trace(profiler, tmpdir):
+    with timing.span('build_dist', 'stage', count=2):
+        pass
+    filename = str(tmpdir.join('trace.json'))
+    profiler.write_trace(filename)
+    with open(filename) as fp:
+        events = json.load(fp)['traceEvents']
+    assert len(events) == 1
+    assert events[0]['ph'] == 'X' and events[0]['name'] == 'build_dist'
+    assert events[0]['args'] == {'count': '2'}
+
+
+def test_span_name():
+    assert get_span_name(['/usr/bin/hg', 'tag', '-m', 'x', '1.0']) == 'hg tag'
+    assert get_span_name(['python', 'setup.py', 'sdist', 'upload']) == 'python setup.py sdist'
@@ -0,0 +1,43 @@
+import os
+
+from pp.pkglib import upload
+from pp.pkglib.upload import LocalTarget, SshTarget, get_target
+
+
+def make_files(tmpdir, **contents):
+    res = []
+    for name, data in sorted(contents.items()):
+        f = tmpdir.join(name + '.tar.gz')
+        f.write(data)
+        res.append(str(f))
+    return res
+
+
+def test_get_target():
+    assert isinstance(get_target('/srv/pkgs'), LocalTarget)
+    assert isinstance(get_target('file:///srv/pkgs'), LocalTarget)
+    assert get_target('file:///srv/pkgs').path == '/srv/pkgs'
+    assert isinstance(get_target('./pkgs:old'), LocalTarget)
+    target = get_target('pkgs@repo.example.com:/srv/pkgs')
+    assert isinstance(target, SshTarget)
+    assert (target.host, target.path) == ('pkgs@repo.example.com', '/srv/pkgs')
+    target.close()
+
+
+def test_upload_to_local_dir(tmpdir):
+    files = make_files(tmpdir.mkdir('dist'), a='aaa', b='bbb')
+    repo = tmpdir.join('repo')
+    target = LocalTarget(str(repo))
+    assert upload.upload(files, target) == files
+    assert sorted(os.listdir(str(repo))) == ['a.tar.gz', 'b.tar.gz']
+    assert repo.join('a.tar.gz').read() == 'aaa'
+
+
+def test_upload_skips_matching_files(tmpdir):
+    files = make_files(tmpdir.mkdir('dist'), a='aaa', b='bbb', c='ccc')
+    repo = tmpdir.mkdir('repo')
+    repo.join('a.tar.gz').write('aaa')
+    repo.join('b.tar.gz').write('partial')
+    assert upload.upload(files, LocalTarget(str(repo))) == files[1:]
+    assert repo.join('b.tar.gz').read() == 'bbb'
+    assert upload.upload(files, LocalTarget(str(repo))) == []
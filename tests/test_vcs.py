@@ -0,0 +1,103 @@
+import os
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import vcs, cmdserver
+
+pytestmark = pytest.mark.skipif(not find_executable('hg'), reason='hg is not installed')
+
+
+@pytest.fixture
+def hg_repo(tmpdir, monkeypatch):
+    monkeypatch.setenv('HGUSER', 'test <test@example.com>')
+    monkeypatch.setenv('HGRCPATH', '')
+    repo = str(tmpdir.join('repo'))
+    subprocess.check_call(['hg', 'init', repo])
+    for i in range(3):
+        with open(os.path.join(repo, 'setup.cfg'), 'w') as fp:
+            fp.write('[metadata]\nversion = 1.0.%d\n' % i)
+        subprocess.check_call(['hg', 'commit', '-A', '-q', '-m', 'rev %d' % i], cwd=repo)
+    return repo
+
+
+@pytest.fixture(params=[False, True], ids=['subprocess', 'cmdserver'])
+def backend(request):
+    vcs.use_cmdserver(request.param)
+    yield request.param
+    vcs.use_cmdserver(False)
+    cmdserver.close_servers()
+
+
+def test_package_tags():
+    tags = {'1.0.0': 'a', 'pp.a-1.0.1': 'b', 'pp.a-b-1.0.2': 'c', 'pp.b-1.0.3': 'd'}
+    assert vcs.get_package_tags(tags, '') == {'1.0.0': 'a'}
+    assert vcs.get_package_tags(tags, 'pp.a-') == {'1.0.1': 'b'}
+    assert vcs.get_tag_prefix('pp.a', '/repo/a', '/repo') == 'pp.a-'
+    assert vcs.get_tag_prefix('pp.a', '/repo/', '/repo') == ''
+
+
+def test_find_root(hg_repo):
+    subdir = os.path.join(hg_repo, 'a', 'b')
+    os.makedirs(subdir)
+    assert vcs.find_root(subdir) == hg_repo
+
+
+def test_tag_and_query(hg_repo, backend):
+    assert vcs.get_status(hg_repo) == ''
+    revno = vcs.get_revno(hg_repo)
+    vcs.tag('1.0.2', hg_repo)
+    assert vcs.get_tags(hg_repo) == {'1.0.2': revno}
+    assert vcs.get_previous_revno(vcs.get_revno(hg_repo), hg_repo) == revno
+
+
+def test_failing_command(hg_repo, backend):
+    with pytest.raises(subprocess.CalledProcessError):
+        vcs.hg(['cat', 'does-not-exist'], hg_repo)
+
+
+def test_runs_at_root(hg_repo, backend, tmpdir, monkeypatch):
+    # Paths are printed relative to the cwd with this
+    tmpdir.join('hgrc').write('[ui]\nrelative-paths = yes\n')
+    monkeypatch.setenv('HGRCPATH', str(tmpdir.join('hgrc')))
+    subdir = os.path.join(hg_repo, 'a')
+    os.mkdir(subdir)
+    with open(os.path.join(subdir, 'new.txt'), 'w') as fp:
+        fp.write('new\n')
+    assert vcs.hg(['st'], subdir).split() == ['?', 'a/new.txt']
+
+
+def test_cmdserver_is_reused(hg_repo, backend):
+    if not backend:
+        return
+    vcs.get_revno(hg_repo)
+    server = cmdserver.get_server(hg_repo)
+    pid = server.proc.pid
+    vcs.get_tags(hg_repo)
+    assert cmdserver.get_server(hg_repo).proc.pid == pid
+
+
+def test_repo_state(hg_repo, backend):
+    revs = vcs.hg(['log', '--template', '{node|short}\n'], hg_repo).split()
+    vcs.tag('1.0.1', hg_repo)
+    state = vcs.get_repo_state(hg_repo)
+    assert state.root == hg_repo
+    assert state.ancestors[1:] == revs[:2]
+    assert state.revno == state.ancestors[0]
+    assert state.tags == {'1.0.1': revs[0]}
+
+
+def test_repo_state_short_history(tmpdir, backend):
+    repo = str(tmpdir)
+    subprocess.check_call(['hg', 'init', repo])
+    state = vcs.get_repo_state(repo, depth=5)
+    assert state.ancestors == []
+    assert state.tags == {}
+
+
+def test_repo_states_batch(hg_repo, backend):
+    subdir = os.path.join(hg_repo, 'sub')
+    os.mkdir(subdir)
+    states = vcs.get_repo_states([hg_repo, subdir])
+    assert states[hg_repo] is states[subdir]
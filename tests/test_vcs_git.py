@@ -0,0 +1,102 @@
+import os
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+from pp.pkglib import vcs
+from pp.pkglib.vcs.gitbackend import GitBackend
+
+pytestmark = pytest.mark.skipif(not find_executable('git'), reason='git is not installed')
+
+
+def git(repo, *args):
+    return subprocess.check_output(['git'] + list(args), cwd=repo).strip()
+
+
+@pytest.fixture
+def git_repo(tmpdir, monkeypatch):
+    for var in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+        monkeypatch.setenv(var + '_NAME', 'test')
+        monkeypatch.setenv(var + '_EMAIL', 'test@example.com')
+    repo = str(tmpdir.join('repo'))
+    subprocess.check_call(['git', 'init', '-q', repo])
+    for i in range(3):
+        with open(os.path.join(repo, 'setup.cfg'), 'w') as fp:
+            fp.write('[metadata]\nversion = 1.0.%d\n' % i)
+        git(repo, 'add', 'setup.cfg')
+        git(repo, 'commit', '-q', '-m', 'rev %d' % i)
+    return repo
+
+
+@pytest.fixture
+def no_git(monkeypatch):
+    """ Fails any git subprocess """
+    def fail(self, args):
+        raise AssertionError("Ran git %r" % args)
+    monkeypatch.setattr(GitBackend, 'git', fail)
+
+
+def short(repo, rev):
+    return git(repo, 'rev-parse', rev)[:12]
+
+
+def test_backend(git_repo):
+    subdir = os.path.join(git_repo, 'a')
+    os.mkdir(subdir)
+    assert vcs.find_root(subdir) == git_repo
+    assert isinstance(vcs.get_backend(subdir), GitBackend)
+
+
+def test_revno_without_git(git_repo, no_git):
+    assert vcs.get_revno(git_repo) == short(git_repo, 'HEAD')
+
+
+def test_tags(git_repo):
+    git(git_repo, 'tag', '1.0.0', 'HEAD~2')
+    git(git_repo, 'tag', '-a', '-m', 'release', '1.0.1', 'HEAD~1')
+    git(git_repo, 'tag', 'not-a-release')
+    expected = {'1.0.0': short(git_repo, 'HEAD~2'), '1.0.1': short(git_repo, 'HEAD~1')}
+    assert GitBackend(git_repo).get_tags() == expected
+
+    # Packed objects with loose refs
+    git(git_repo, 'repack', '-a', '-d', '-q')
+    assert GitBackend(git_repo).get_tags() == expected
+
+    # Packed refs
+    git(git_repo, 'gc', '-q')
+    assert os.path.isfile(os.path.join(git_repo, '.git', 'packed-refs'))
+    assert GitBackend(git_repo).get_tags() == expected
+    assert vcs.get_revno(git_repo) == short(git_repo, 'HEAD')
+
+
+def test_tags_without_git(git_repo, no_git):
+    subprocess.check_call(['git', 'tag', '-a', '-m', 'release', '1.0.2'], cwd=git_repo)
+    assert vcs.get_tags(git_repo) == {'1.0.2': short(git_repo, 'HEAD')}
+
+
+def test_empty_repo(tmpdir):
+    repo = str(tmpdir)
+    subprocess.check_call(['git', 'init', '-q', repo])
+    state = vcs.get_repo_state(repo)
+    assert state.ancestors == [] and state.tags == {}
+    assert state.revno == vcs.NULL_REVNO
+
+
+def test_tagup_cycle(git_repo):
+    assert vcs.get_status(git_repo) == ''
+    with open(os.path.join(git_repo, 'setup.cfg'), 'a') as fp:
+        fp.write('install_requires = foo==1.0\n')
+    assert 'setup.cfg' in vcs.get_status(git_repo)
+    vcs.commit('Pin', git_repo)
+    released = vcs.get_revno(git_repo)
+    vcs.tag('1.0.2', git_repo)
+    with open(os.path.join(git_repo, 'setup.cfg'), 'w') as fp:
+        fp.write('[metadata]\nversion = 1.0.3\n')
+    vcs.commit('Rollover', git_repo)
+
+    state = vcs.get_repo_state(git_repo)
+    assert state.tags == {'1.0.2': released}
+    assert state.ancestors[state.release_depth] == released
+    assert vcs.get_previous_revno(state.revno, git_repo) == released
+    assert vcs.get_files(git_repo) == [os.path.join(git_repo, 'setup.cfg')]
@@ -0,0 +1,58 @@
+import sys
+
+from pp.pkglib import wheelhouse
+from pp.pkglib.wheelhouse import Wheelhouse, get_key
+
+
+def test_abi_tag():
+    tag = wheelhouse.get_abi_tag(sys.executable)
+    assert tag.startswith('cp%d%d-' % sys.version_info[:2])
+    assert len(tag.split('-')) == 3
+
+
+def test_key():
+    key = get_key(['SQLAlchemy>=0.7', 'paver'], 'cp27-cp27mu-linux_x86_64')
+    assert get_key(['paver', 'SQLAlchemy>=0.7', 'paver'], 'cp27-cp27mu-linux_x86_64') == key
+    assert get_key(['paver'], 'cp27-cp27mu-linux_x86_64') != key
+    assert get_key(['SQLAlchemy>=0.7', 'paver'], 'cp27-cp27m-linux_x86_64') != key
+
+
+def test_install_builds_once(tmpdir, monkeypatch):
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        if cmd[3] == 'wheel':
+            wheel_dir = cmd[cmd.index('--wheel-dir') + 1]
+            for name in ['paver-1.0-py2-none-any.whl', 'six-1.0-py2.py3-none-any.whl']:
+                open('%s/%s' % (wheel_dir, name), 'w').close()
+
+    monkeypatch.setattr(wheelhouse, 'run', run)
+    house = Wheelhouse(str(tmpdir))
+    wheels = house.install('python', ['paver'], abi_tag='cp27-cp27mu-linux_x86_64')
+    assert [i.split('/')[-1] for i in wheels] == ['paver-1.0-py2-none-any.whl',
+                                                  'six-1.0-py2.py3-none-any.whl']
+    assert [i[3] for i in calls] == ['wheel', 'install']
+    assert calls[1][4:6] == ['--no-index', '--no-deps']
+
+    del calls[:]
+    assert house.install('python', ['paver'], abi_tag='cp27-cp27mu-linux_x86_64') == wheels
+    assert [i[3] for i in calls] == ['install']
+    assert [i.basename for i in tmpdir.listdir()] == [get_key(['paver'], 'cp27-cp27mu-linux_x86_64')]
+
+
+def test_built_meanwhile(tmpdir, monkeypatch):
+    abi_tag = 'cp27-cp27mu-linux_x86_64'
+    target = tmpdir.join(get_key(['paver'], abi_tag))
+
+    def run(cmd, **kwargs):
+        # Another process finishes the same set while we build ours
+        target.join('paver-1.0-py2-none-any.whl').write('', ensure=True)
+        target.join(wheelhouse.MANIFEST).write('paver-1.0-py2-none-any.whl\n')
+        wheel_dir = cmd[cmd.index('--wheel-dir') + 1]
+        open('%s/paver-1.0-py2-none-any.whl' % wheel_dir, 'w').close()
+
+    monkeypatch.setattr(wheelhouse, 'run', run)
+    wheels = Wheelhouse(str(tmpdir)).build('python', ['paver'], abi_tag=abi_tag)
+    assert wheels == [str(target.join('paver-1.0-py2-none-any.whl'))]
+    assert [i.basename for i in tmpdir.listdir()] == [target.basename]